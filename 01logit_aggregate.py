@@ -0,0 +1,87 @@
+import pandas as pd
+import biogeme.database as db
+import biogeme.biogeme as bio
+import biogeme.models as models
+import biogeme.results as res
+from aggregation import GroupIndex, aggregate, compareScenarios
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+pd.options.display.float_format = '{:.3g}'.format
+
+from headers import *
+
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+# The parameters are read from the pickle file of 01logit.py
+results = res.bioResults(pickleFile='01logit.pickle')
+betas = results.getBetaValues()
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+# Scenario: the cost of the Swissmetro is multiplied by a factor,
+# stored as a column so that the same formulas can be simulated again.
+database.data['SM_FACTOR'] = 1.0
+SM_FACTOR = Variable('SM_FACTOR')
+
+V1 = ASC_TRAIN + \
+     B_TIME * TRAIN_TT / 100.0 + \
+     B_COST * TRAIN_COST / 100.0
+V2 = ASC_SM + \
+     B_TIME * SM_TT / 100.0 + \
+     B_COST * SM_FACTOR * SM_COST / 100.0
+V3 = ASC_CAR + \
+     B_TIME * CAR_TT / 100.0 + \
+     B_COST * CAR_CO / 100.0
+
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+weight = 8.890991e-01 * (1.0 * (GROUP == 2) + 1.2 * (GROUP == 3))
+
+simulate = {'Prob. train': models.logit(V,av,1),
+            'Prob. Swissmetro': models.logit(V,av,2),
+            'Prob. car': models.logit(V,av,3),
+            'V1': V1, 'V2': V2, 'V3': V3,
+            'av1': TRAIN_AV_SP, 'av2': SM_AV, 'av3': CAR_AV_SP,
+            'weight': weight}
+
+# The index by origin-destination pair is built once.
+index = GroupIndex.fromData(database.data,['ORIGIN','DEST'])
+
+# The coefficient applies to costs divided by 100, so that the
+# consumer surplus is expressed in hundreds of CHF.
+costCoefficient = betas['B_COST']
+
+def forecast(factor):
+    database.data['SM_FACTOR'] = factor
+    biosim = bio.BIOGEME(database,simulate)
+    biosim.modelName = "01logit_aggregate"
+    sim = biosim.simulate(betas)
+    P = sim[['Prob. train','Prob. Swissmetro','Prob. car']].values
+    U = sim[['V1','V2','V3']].values
+    A = sim[['av1','av2','av3']].values
+    return aggregate(index,P,sim['weight'].values,U,A,
+                     costCoefficient=costCoefficient,
+                     alternatives=['train','Swissmetro','car'])
+
+base = forecast(1.0)
+print(base)
+scenario = forecast(1.2)
+print(compareScenarios(index,base,scenario,costCoefficient))
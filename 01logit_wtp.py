@@ -0,0 +1,23 @@
+import biogeme.results as res
+from wtp import deltaMethod, krinskyRobb
+
+# The estimates and their covariance matrix are read from the pickle
+# file of 01logit.py
+results = res.bioResults(pickleFile='01logit.pickle')
+
+# Time and cost are both scaled by 1/100 in 01logit.py, so that
+# B_TIME / B_COST is a value of time in CHF per minute. It is
+# multiplied by 60 to obtain CHF per hour. The willingness to pay for
+# a mode, relative to the Swissmetro, is -ASC / B_COST.
+ratios = {'VOT (CHF/hour)': ({'B_TIME': 60}, 'B_COST'),
+          'Car (CHF)': ({'ASC_CAR': -1}, 'B_COST'),
+          'Train (CHF)': ({'ASC_TRAIN': -1}, 'B_COST')}
+
+# All the ratios are obtained at once, with the robust covariance
+# matrix.
+print(deltaMethod(results,ratios))
+
+# Krinsky and Robb: the parameters are drawn from their asymptotic
+# distribution, and the ratios computed for all the draws.
+table, simulated = krinskyRobb(results,ratios,numberOfDraws=100000,seed=1)
+print(table)
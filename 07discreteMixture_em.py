@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import biogeme.database as db
+from latentclass import LatentClass, estimateEM
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+# The Pandas data structure is available as database.data. Use all the
+# Pandas functions to invesigate the database
+#print(database.data.describe())
+
+from headers import *
+
+# Removing some observations can be done directly using pandas.
+#remove = (((database.data.PURPOSE != 1) & (database.data.PURPOSE != 3)) | (database.data.CHOICE == 0))
+#database.data.drop(database.data[remove].index,inplace=True)
+
+# Here we use the "biogeme" way for backward compatibility
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,0,0)
+B_COST = Beta('B_COST',0,None,0,0)
+
+
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+# For latent class 1, whete the time coefficient is zero
+V11 = ASC_TRAIN + B_COST * TRAIN_COST_SCALED
+V12 = ASC_SM + B_COST * SM_COST_SCALED
+V13 = ASC_CAR + B_COST * CAR_CO_SCALED
+
+V1 = {1: V11,
+      2: V12,
+      3: V13}
+
+# For latent class 2, whete the time coefficient is estimated
+V21 = ASC_TRAIN + B_TIME * TRAIN_TT_SCALED + B_COST * TRAIN_COST_SCALED
+V22 = ASC_SM + B_TIME * SM_TT_SCALED + B_COST * SM_COST_SCALED
+V23 = ASC_CAR + B_TIME * CAR_TT_SCALED + B_COST * CAR_CO_SCALED
+
+V2 = {1: V21,
+      2: V22,
+      3: V23}
+
+
+# Associate the availability conditions with the alternatives
+
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+
+# Class membership model: the probability of class 2 (W_OTHER in
+# 07discreteMixture.py) is exp(CLASS_OTHER) / (1 + exp(CLASS_OTHER))
+CLASS_OTHER = Beta('CLASS_OTHER',0,None,None,0)
+membership = [0, CLASS_OTHER]
+
+# Estimation by EM: the posterior class probabilities of all the
+# observations are updated at once, and each class is then a weighted
+# logit. The two classes share ASC and B_COST, so they are solved
+# together, and in parallel with the membership model.
+model = LatentClass([V1,V2],av,CHOICE,database.data,membership,
+                    modelName="07discreteMixture_em")
+results = estimateEM(model)
+print("Results=",results)
+betas = results.getBetaValues()
+print("W_OTHER=",1 / (1 + np.exp(-betas['CLASS_OTHER'])))
@@ -0,0 +1,89 @@
+import pandas as pd
+import biogeme.database as db
+import biogeme.models as models
+from estimation import estimate
+from family import ModelFamily
+from profilelikelihood import profileLikelihood
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+# The Pandas data structure is available as database.data. Use all the
+# Pandas functions to invesigate the database
+#print(database.data.describe())
+
+from headers import *
+
+# Removing some observations can be done directly using pandas.
+#remove = (((database.data.PURPOSE != 1) & (database.data.PURPOSE != 3)) | (database.data.CHOICE == 0))
+#database.data.drop(database.data[remove].index,inplace=True)
+
+# Here we use the "biogeme" way for backward compatibility
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+LAMBDA = Beta('LAMBDA',1.5,0.0001,5,0)
+
+
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+V1 = (ASC_TRAIN +
+      B_TIME * models.boxcox(TRAIN_TT_SCALED,LAMBDA) +
+      B_COST * TRAIN_COST_SCALED)
+V2 = (ASC_SM +
+      B_TIME * models.boxcox(SM_TT_SCALED,LAMBDA) +
+      B_COST * SM_COST_SCALED)
+V3 = (ASC_CAR +
+      B_TIME * models.boxcox(CAR_TT_SCALED,LAMBDA) +
+      B_COST * CAR_CO_SCALED)
+
+# Associate utility functions with the numbering of alternatives
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+
+# Associate the availability conditions with the alternatives
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+logprob = bioLogLogit(V,av,CHOICE)
+
+# The likelihood is evaluated by the vectorized evaluator, through a
+# family with a single member.
+family = ModelFamily(database.data)
+family.add("08boxcox_profile",logprob)
+family.compile()
+model = family.members["08boxcox_profile"]
+results = estimate(model)
+print("Results=",results)
+
+# Profile likelihood of LAMBDA: the other parameters are estimated for
+# each value of LAMBDA on the grid. The interval follows the shape of
+# the likelihood, and cannot go below the lower bound of LAMBDA.
+profile, interval = profileLikelihood(model,'LAMBDA',results)
+print(profile[['LAMBDA','logLike','LR','function evaluations']])
+print(interval)
@@ -0,0 +1,104 @@
+# Serves the choice probabilities of the logit model (01logit.py) and
+# the cross-nested logit model (11cnl.py), using the parameters stored
+# in their pickle files. Example of request:
+#
+# curl -X POST localhost:8080/predict/11cnl -d '{"GA": 0, "SP": 1,
+#   "TRAIN_AV": 1, "SM_AV": 1, "CAR_AV": 1, "TRAIN_TT": 112,
+#   "TRAIN_CO": 48, "SM_TT": 63, "SM_CO": 52, "CAR_TT": 117,
+#   "CAR_CO": 65}'
+
+import sys
+import biogeme.models as models
+from serving import PredictionModel, serve
+from cache import PredictionCache
+
+from headers import *
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+MU_EXISTING = Beta('MU_EXISTING',1,1,None,0)
+MU_PUBLIC = Beta('MU_PUBLIC',1,1,None,0)
+ALPHA_EXISTING = Beta('ALPHA_EXISTING',0.5,0,1,0)
+ALPHA_PUBLIC = 1 - ALPHA_EXISTING
+
+# The variables are defined as expressions, not with DefineVariable,
+# as the requests contain only the original attributes.
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = TRAIN_TT / 100.0
+TRAIN_COST_SCALED = TRAIN_COST / 100
+SM_TT_SCALED = SM_TT / 100.0
+SM_COST_SCALED = SM_COST / 100
+CAR_TT_SCALED = CAR_TT / 100
+CAR_CO_SCALED = CAR_CO / 100
+
+V1 = ASC_TRAIN + \
+     B_TIME * TRAIN_TT_SCALED + \
+     B_COST * TRAIN_COST_SCALED
+V2 = ASC_SM + \
+     B_TIME * SM_TT_SCALED + \
+     B_COST * SM_COST_SCALED
+V3 = ASC_CAR + \
+     B_TIME * CAR_TT_SCALED + \
+     B_COST * CAR_CO_SCALED
+
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+CAR_AV_SP =  CAR_AV  * (  SP   !=  0  )
+TRAIN_AV_SP =  TRAIN_AV  * (  SP   !=  0  )
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+alpha_existing = {1: ALPHA_EXISTING,
+                  2:0.0,
+                  3:1.0}
+
+alpha_public = {1: ALPHA_PUBLIC,
+                2: 1.0,
+                3: 0.0}
+
+nest_existing = MU_EXISTING, alpha_existing
+nest_public = MU_PUBLIC, alpha_public
+nests = nest_existing, nest_public
+
+def withElasticities(prob1,prob2,prob3):
+    return {'Prob. train': prob1,
+            'Prob. Swissmetro': prob2,
+            'Prob. car': prob3,
+            'Elas. 1': Derive(prob1,'TRAIN_TT') * TRAIN_TT / prob1,
+            'Elas. 2': Derive(prob2,'SM_TT') * SM_TT / prob2,
+            'Elas. 3': Derive(prob3,'CAR_TT') * CAR_TT / prob3}
+
+logit = withElasticities(models.logit(V,av,1),
+                         models.logit(V,av,2),
+                         models.logit(V,av,3))
+
+cnl = withElasticities(models.cnl_avail(V,av,nests,1),
+                       models.cnl_avail(V,av,nests,2),
+                       models.cnl_avail(V,av,nests,3))
+
+# Planners query the same levels of the attributes again and
+# again. Times and costs are rounded to the minute and to the CHF in
+# the keys of the cache.
+resolution = {'TRAIN_TT': 1, 'TRAIN_CO': 1, 'SM_TT': 1, 'SM_CO': 1,
+              'CAR_TT': 1, 'CAR_CO': 1}
+
+served = {'01logit': PredictionCache(PredictionModel(logit,'01logit.pickle'),
+                                     resolution=resolution),
+          '11cnl': PredictionCache(PredictionModel(cnl,'11cnl.pickle'),
+                                   resolution=resolution)}
+
+# Usage: python3 11cnl_serve.py [port | path of a Unix socket]
+if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+    serve(served,path=sys.argv[1])
+else:
+    serve(served,port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
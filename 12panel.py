@@ -75,7 +75,9 @@ obsprob = models.logit(V,av,CHOICE)
 condprobIndiv = PanelLikelihoodTrajectory(obsprob)
 logprob = log(MonteCarlo(condprobIndiv))
 
-biogeme  = bio.BIOGEME(database,logprob,numberOfDraws=500)
+# The seed is fixed so that 12panel_conditional.py generates the same
+# draws
+biogeme  = bio.BIOGEME(database,logprob,numberOfDraws=500,seed=10)
 biogeme.modelName = "12panel"
 results = biogeme.estimate(bootstrap=10)
 print("Results=",results)
@@ -0,0 +1,93 @@
+import pandas as pd
+import biogeme.database as db
+import biogeme.biogeme as bio
+import biogeme.results as res
+import biogeme.models as models
+from conditional import conditionalMoments
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+database.panel("ID")
+
+# The Pandas data structure is available as database.data. Use all the
+# Pandas functions to invesigate the database
+#print(database.data.describe())
+
+from headers import *
+
+# Removing some observations can be done directly using pandas.
+#remove = (((database.data.PURPOSE != 1) & (database.data.PURPOSE != 3)) | (database.data.CHOICE == 0))
+#database.data.drop(database.data[remove].index,inplace=True)
+
+# Here we use the "biogeme" way for backward compatibility
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+# The parameters are read from the pickle file of 12panel.py
+results = res.bioResults(pickleFile='12panel.pickle')
+betas = results.getBetaValues()
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+B_TIME_S = Beta('B_TIME_S',0,None,None,0)
+
+# Define a random parameter, normally distirbuted, designed to be used
+# for Monte-Carlo simulation
+B_TIME_RND = B_TIME + B_TIME_S * bioDraws('B_TIME_RND','NORMAL')
+
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+V1 = ASC_TRAIN + \
+     B_TIME_RND * TRAIN_TT_SCALED + \
+     B_COST * TRAIN_COST_SCALED
+V2 = ASC_SM + \
+     B_TIME_RND * SM_TT_SCALED + \
+     B_COST * SM_COST_SCALED
+V3 = ASC_CAR + \
+     B_TIME_RND * CAR_TT_SCALED + \
+     B_COST * CAR_CO_SCALED
+
+# Associate utility functions with the numbering of alternatives
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+
+# Associate the availability conditions with the alternatives
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+obsprob = models.logit(V,av,CHOICE)
+condprobIndiv = PanelLikelihoodTrajectory(obsprob)
+logprob = log(MonteCarlo(condprobIndiv))
+# The BIOGEME object of the estimation, with the seed of 12panel.py,
+# generates the draws of the estimation in the database.
+biogeme  = bio.BIOGEME(database,logprob,numberOfDraws=500,seed=10)
+# Mean and standard deviation of B_TIME_RND for each individual,
+# conditional on the sequence of choices of the individual. The
+# likelihood of each draw weights the draws of the individual.
+conditional = conditionalMoments(condprobIndiv,
+                                 {'B_TIME_RND': B_TIME_RND},
+                                 database,betas)
+print(conditional.describe())
+conditional.to_csv("12panel_conditional.csv")
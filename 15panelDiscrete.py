@@ -91,7 +91,9 @@ prob2 = PanelLikelihoodTrajectory(models.logit(V2,av,CHOICE))
 probIndiv = probClass1 * prob1 + probClass2 * prob2
 logprob = log(MonteCarlo(probIndiv))
 
-biogeme  = bio.BIOGEME(database,logprob)
+# The seed is fixed so that 15panelDiscrete_conditional.py generates
+# the same draws
+biogeme  = bio.BIOGEME(database,logprob,seed=10)
 biogeme.modelName = "15panelDiscrete"
 results = biogeme.estimate()
 print("Results=",results)
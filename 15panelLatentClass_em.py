@@ -0,0 +1,89 @@
+# Latent class logit on the panel of 15panelDiscrete.py, estimated by
+# EM. This is NOT the model of 15panelDiscrete.py: its error components
+# EC_CAR, EC_SM and EC_TRAIN are left out (the EM estimator of
+# latentclass.py has no draws), so that the correlation between the
+# choices of an individual comes from the latent classes only. The
+# class membership also depends on the season ticket (GA).
+
+import pandas as pd
+import biogeme.database as db
+from latentclass import LatentClass, estimateEM
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+database.panel("ID")
+
+# The Pandas data structure is available as database.data. Use all the
+# Pandas functions to invesigate the database
+#print(database.data.describe())
+
+from headers import *
+
+# Removing some observations can be done directly using pandas.
+#remove = (((database.data.PURPOSE != 1) & (database.data.PURPOSE != 3)) | (database.data.CHOICE == 0))
+#database.data.drop(database.data[remove].index,inplace=True)
+
+# Here we use the "biogeme" way for backward compatibility
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+
+
+ASC_CAR = Beta('ASC_CAR',0.136,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',-1,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',-6.3,None,0,0)
+B_COST = Beta('B_COST',-3.29,None,0,0)
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+# For latent class 1, whete the time coefficient is zero
+V11 = ASC_TRAIN + B_COST * TRAIN_COST_SCALED
+V12 = ASC_SM + B_COST * SM_COST_SCALED
+V13 = ASC_CAR + B_COST * CAR_CO_SCALED
+
+V1 = {1: V11,
+      2: V12,
+      3: V13}
+
+# For latent class 2, whete the time coefficient is estimated
+V21 = ASC_TRAIN + B_TIME * TRAIN_TT_SCALED + B_COST * TRAIN_COST_SCALED
+V22 = ASC_SM + B_TIME * SM_TT_SCALED + B_COST * SM_COST_SCALED
+V23 = ASC_CAR + B_TIME * CAR_TT_SCALED + B_COST * CAR_CO_SCALED
+
+V2 = {1: V21,
+      2: V22,
+      3: V23}
+
+
+# Associate the availability conditions with the alternatives
+
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+
+# Class membership model, with the season ticket (GA) as covariate
+CLASS_OTHER = Beta('CLASS_OTHER',1.37,None,None,0)
+CLASS_OTHER_GA = Beta('CLASS_OTHER_GA',0,None,None,0)
+membership = [0, CLASS_OTHER + CLASS_OTHER_GA * GA]
+
+# Estimation by EM. The class of an individual is the same for all
+# the observations of the individual (panel ID).
+model = LatentClass([V1,V2],av,CHOICE,database.data,membership,
+                    panel="ID",modelName="15panelLatentClass_em")
+results = estimateEM(model)
+print("Results=",results)
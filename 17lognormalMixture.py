@@ -79,7 +79,9 @@ prob = models.logit(V,av,CHOICE)
 logprob = log(MonteCarlo(prob))
 
 
-biogeme = bio.BIOGEME(database,logprob,numberOfDraws=1000)
+# The seed is fixed so that 17lognormalMixture_wtp.py generates the
+# same draws
+biogeme = bio.BIOGEME(database,logprob,numberOfDraws=1000,seed=10)
 
 biogeme.modelName = '17lognormalMixture'
 results = biogeme.estimate()
@@ -2,6 +2,7 @@ import pandas as pd
 import biogeme.database as db
 import biogeme.biogeme as bio
 import biogeme.distributions as dist
+from threadtuning import BiogemeLikelihood, tuneThreads
 
 pandas = pd.read_table("swissmetro.dat")
 database = db.Database("swissmetro",pandas)
@@ -49,7 +50,13 @@ ChoiceProba = {
 
 logprob = log(Elem(ChoiceProba,CHOICE))
 
-biogeme  = bio.BIOGEME(database,logprob,numberOfThreads=1)
+# The number of threads is chosen by timing a few evaluations of
+# biogeme with 1, 2, 4... threads, kept in threads.json for the next
+# runs on this machine.
+numberOfThreads, _ = tuneThreads(BiogemeLikelihood(database,logprob,
+                                                   modelName="18ordinalLogit"))
+print("Number of threads=",numberOfThreads)
+biogeme  = bio.BIOGEME(database,logprob,numberOfThreads=numberOfThreads)
 biogeme.modelName = "18ordinalLogit"
 results = biogeme.estimate()
 print("Results=",results)
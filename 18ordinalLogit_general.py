@@ -0,0 +1,40 @@
+import pandas as pd
+import biogeme.database as db
+from ordinal import OrderedModel
+from estimation import estimate
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+from headers import *
+
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+
+#  Utility
+
+U = B_TIME * TRAIN_TT_SCALED + B_COST * TRAIN_COST_SCALED 
+
+# Same model as 18ordinalLogit.py. The thresholds tau1 and
+# tau2 = tau1 + delta2 are generated from the categories, so that
+# the same code applies to a response with 5 or 7 levels.
+model = OrderedModel(U,CHOICE,database.data,categories=[1,2,3],
+                     distribution='logit',modelName="18ordinalLogit_general")
+results = estimate(model)
+print("Results=",results)
+
+# Ordinal probit on the same data
+model = OrderedModel(U,CHOICE,database.data,categories=[1,2,3],
+                     distribution='probit',modelName="18ordinalProbit_general")
+results = estimate(model)
+print("Results=",results)
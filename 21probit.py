@@ -1,6 +1,7 @@
 import pandas as pd
 import biogeme.database as db
 import biogeme.biogeme as bio
+from threadtuning import BiogemeLikelihood, tuneThreads
 
 pandas = pd.read_table("swissmetro.dat")
 database = db.Database("swissmetro",pandas)
@@ -65,7 +66,13 @@ P = {1: bioNormalCdf(V1-V3),
 
 prob = Elem(P,CHOICE)
 
-biogeme  = bio.BIOGEME(database,log(prob),numberOfThreads=1)
+# The number of threads is chosen by timing a few evaluations of
+# biogeme with 1, 2, 4... threads, kept in threads.json for the next
+# runs on this machine.
+numberOfThreads, _ = tuneThreads(BiogemeLikelihood(database,log(prob),
+                                                   modelName="21probit"))
+print("Number of threads=",numberOfThreads)
+biogeme  = bio.BIOGEME(database,log(prob),numberOfThreads=numberOfThreads)
 biogeme.modelName = "21probit"
 #results = biogeme.checkDerivatives(logg=True)
 results = biogeme.estimate()
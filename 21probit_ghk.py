@@ -0,0 +1,74 @@
+import pandas as pd
+import biogeme.database as db
+from probit import Probit
+from estimation import estimate
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+from headers import *
+
+# Contrary to 21probit.py, the three alternatives are kept, and the
+# observations where some of them are not available are not
+# removed. The availability conditions are accounted for by the
+# estimator.
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,1)
+ASC_SM = Beta('ASC_SM',0,None,None,0)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+V1 = ASC_TRAIN + \
+     B_TIME * TRAIN_TT_SCALED + \
+     B_COST * TRAIN_COST_SCALED
+V2 = ASC_SM + \
+     B_TIME * SM_TT_SCALED + \
+     B_COST * SM_COST_SCALED
+V3 = ASC_CAR + \
+     B_TIME * CAR_TT_SCALED + \
+     B_COST * CAR_CO_SCALED
+
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+# The error covariance of (e1-e3, e2-e3) is L L', with the Cholesky
+# factor L estimated as CHOL_2_1 and CHOL_2_2. Observations with two
+# available alternatives are computed exactly, the others with the GHK
+# simulator.
+model = Probit(V,av,CHOICE,database.data,numberOfDraws=200,seed=10,
+               modelName="21probit_ghk")
+results = estimate(model)
+print("Results=",results)
+
+# The binary model of 21probit.py: train and car only.
+Vbinary = {1: B_TIME * TRAIN_TT_SCALED + B_COST * TRAIN_COST_SCALED,
+           3: V3}
+binary = database.data[(database.data.TRAIN_AV_SP != 0) &
+                       (database.data.CAR_AV_SP != 0) &
+                       (database.data.CHOICE != 2)]
+model = Probit(Vbinary,None,CHOICE,binary,modelName="21probit_binary")
+results = estimate(model)
+print("Results=",results)
@@ -0,0 +1,126 @@
+import pandas as pd
+import biogeme.database as db
+import biogeme.models as models
+import numpy as np
+from estimation import estimate
+from family import ModelFamily
+
+#database = db.Database("tiny.dat")
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+
+# The Pandas data structure is available as database.data. Use all the
+# Pandas functions to invesigate the database
+#print(database.data.describe())
+
+from headers import *
+
+# Removing some observations can be done directly using pandas.
+#remove = (((database.data.PURPOSE != 1) & (database.data.PURPOSE != 3)) | (database.data.CHOICE == 0))
+#database.data.drop(database.data[remove].index,inplace=True)
+
+# Here we use the "biogeme" way for backward compatibility
+exclude = (( PURPOSE != 1 ) * (  PURPOSE   !=  3  ) +  ( CHOICE == 0 )) > 0
+database.remove(exclude)
+
+
+ASC_CAR = Beta('ASC_CAR',0,None,None,0)
+ASC_TRAIN = Beta('ASC_TRAIN',0,None,None,0)
+ASC_SM = Beta('ASC_SM',0,None,None,1)
+B_TIME = Beta('B_TIME',0,None,None,0)
+B_TIME_S = Beta('B_TIME_S',0,None,None,0)
+B_COST = Beta('B_COST',0,None,None,0)
+
+# Define a random parameter with a triangular distribution, designed to be used
+# for Monte-Carlo simulation
+
+# Provide my own random number generator to the database.
+# See the numpy.random documentation to obtain a list of other distributions.
+def theTriangularGenerator(size):
+    return np.random.triangular(-1,0,1,size=size)
+
+myRandomNumberGenerators = {'TRIANGULAR':theTriangularGenerator}
+database.setRandomNumberGenerators(myRandomNumberGenerators)
+
+B_TIME_RND = B_TIME + B_TIME_S * bioDraws('B_TIME_RND','TRIANGULAR')
+
+# Utility functions
+
+#If the person has a GA (season ticket) her incremental cost is actually 0 
+#rather than the cost value gathered from the
+# network data. 
+SM_COST =  SM_CO   * (  GA   ==  0  ) 
+TRAIN_COST =  TRAIN_CO   * (  GA   ==  0  )
+
+# For numerical reasons, it is good practice to scale the data to
+# that the values of the parameters are around 1.0. 
+# A previous estimation with the unscaled data has generated
+# parameters around -0.01 for both cost and time. Therefore, time and
+# cost are multipled my 0.01.
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+V1 = ASC_TRAIN + B_TIME_RND * TRAIN_TT_SCALED + B_COST * TRAIN_COST_SCALED
+V2 = ASC_SM + B_TIME_RND * SM_TT_SCALED + B_COST * SM_COST_SCALED
+V3 = ASC_CAR + B_TIME_RND * CAR_TT_SCALED + B_COST * CAR_CO_SCALED
+
+# Associate utility functions with the numbering of alternatives
+V = {1: V1,
+     2: V2,
+     3: V3}
+
+# Associate the availability conditions with the alternatives
+
+CAR_AV_SP =  DefineVariable('CAR_AV_SP',CAR_AV  * (  SP   !=  0  ),database)
+TRAIN_AV_SP =  DefineVariable('TRAIN_AV_SP',TRAIN_AV  * (  SP   !=  0  ),database)
+
+av = {1: TRAIN_AV_SP,
+      2: SM_AV,
+      3: CAR_AV_SP}
+
+# The choice model is a logit, with availability conditions
+prob = models.logit(V,av,CHOICE)
+logprob = log(MonteCarlo(prob))
+
+
+
+# With 1000 draws, the terms inside MonteCarlo are arrays of rows x
+# 1000 draws, as are their derivatives. With a memory budget, they are
+# computed by blocks of draws (and the rows by chunks if needed), the
+# sums of the blocks being accumulated.
+budget = 64 * 2**20
+family = ModelFamily(database.data,numberOfDraws=1000,
+                     drawGenerators=myRandomNumberGenerators,
+                     memoryBudget=budget)
+family.add("25triangularMixture_chunked",logprob)
+family.compile()
+model = family.members["25triangularMixture_chunked"]
+
+# Same draws, evaluated all at once, for comparison at the starting
+# values. The triangular draws come from the global generator of numpy,
+# seeded before the draws of each family are generated.
+reference = ModelFamily(database.data,numberOfDraws=1000,
+                        drawGenerators=myRandomNumberGenerators)
+reference.add("25triangularMixture",logprob)
+reference.compile()
+np.random.seed(1)
+L0, g0 = reference.members["25triangularMixture"].loglikelihood(model.start)
+np.random.seed(1)
+L, g = model.loglikelihood(model.start)
+print(f"Difference with the evaluation without budget: "
+      f"log likelihood {abs(L-L0):.2e}, gradient {np.max(np.abs(g-g0)):.2e}")
+print(f"Peak memory: {family.peakMemory/2**20:.1f} MB with a budget of "
+      f"{budget/2**20:.0f} MB, {reference.peakMemory/2**20:.1f} MB without")
+print(family.statistics())
+del reference
+
+results = estimate(model)
+print(results)
+print(f"Peak memory: {family.peakMemory/2**20:.1f} MB")
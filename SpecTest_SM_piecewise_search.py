@@ -0,0 +1,94 @@
+import pandas as pd
+import biogeme.database as db
+import biogeme.models as models
+from biogeme.models import piecewise
+from specsearch import gridCandidates, specificationSearch
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+pd.options.display.float_format = '{:.3g}'.format
+
+from headers import *
+
+exclude = ((  PURPOSE   !=  1  ) * (  PURPOSE   !=  3  ) + (  CHOICE   ==  0  ) + (  AGE == 6  ))>0
+database.remove(exclude)
+  
+#Parameters to be estimated
+# Arguments:
+#   1  Name for report. Typically, the same as the variable
+#   2  Starting value
+#   3  Lower bound
+#   4  Upper bound
+#   5  0: estimate the parameter, 1: keep it fixed
+ASC_CAR	 = Beta('ASC_CAR',0,None,None,0)
+ASC_SBB	 = Beta('ASC_SBB',0,None,None,1)
+ASC_SM	 = Beta('ASC_SM',0,None,None,0)
+B_CAR_COST	 = Beta('B_CAR_COST',0,None,None,0)
+B_CAR_TIME	 = Beta('B_CAR_TIME',0,None,None,0)
+B_GA	 = Beta('B_GA',0,None,None,0)
+B_HE	 = Beta('B_HE',0,None,None,0)
+B_SM_COST	 = Beta('B_SM_COST',0,None,None,0)
+B_SM_TIME	 = Beta('B_SM_TIME',0,None,None,0)
+B_TRAIN_COST	 = Beta('B_TRAIN_COST',0,None,None,0)
+LAMBDA = Beta('LAMBDA',1,0.0001,5,0)
+
+# Define here arithmetic expressions for name that are not directly 
+# available from the data
+
+SENIOR  = DefineVariable('SENIOR', AGE   ==  5 ,database)
+CAR_AV_SP  = DefineVariable('CAR_AV_SP', CAR_AV    *  (  SP   !=  0  ),database)
+SM_COST  = DefineVariable('SM_COST', SM_CO   * (  GA   ==  0  ),database)
+TRAIN_AV_SP  = DefineVariable('TRAIN_AV_SP', TRAIN_AV    *  (  SP   !=  0  ),database)
+TRAIN_COST  = DefineVariable('TRAIN_COST', TRAIN_CO   * (  GA   ==  0  ),database)
+TRAIN_HE_SCALED = DefineVariable('TRAIN_HE_SCALED',\
+                                 TRAIN_HE / 100.0,database)
+SM_HE_SCALED = DefineVariable('SM_HE_SCALED',\
+                                 SM_HE / 100.0,database)
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+
+av = {3: CAR_AV_SP,1: TRAIN_AV_SP,2: SM_AV}
+
+# Each candidate is a set of thresholds for the piecewise linear train
+# travel time, a Box-Cox transform of the car and Swissmetro travel
+# times or not, and a segmentation variable or none. The pieces of
+# TRAIN_TT are expressions, not DefineVariable, so that each process
+# computes them once per set of thresholds. GA is not a segmentation:
+# B_GA * GA is constant within its segments, and TRAIN_COST and SM_COST
+# are zero for GA == 1, so that these parameters are not identified.
+space = {'thresholds': [(60,120,240),(90,180,270),(120,240,360)],
+         'boxcox CAR_TT': [False,True],
+         'boxcox SM_TT': [False,True],
+         'segment': [None,'MALE']}
+
+def transform(time,boxcox):
+    return models.boxcox(time,LAMBDA) if boxcox else time
+
+def build(candidate):
+    pw_tt = piecewise(TRAIN_TT,list(candidate['thresholds']))
+    train_time = 0
+    for i,piece in enumerate(pw_tt):
+        train_time += Beta(f'B_TRAIN_TIME{i+1}',0,None,None,0) * piece / 100
+    Car_SP = ASC_CAR + B_CAR_TIME * transform(CAR_TT_SCALED,candidate['boxcox CAR_TT']) + B_CAR_COST * CAR_CO_SCALED
+    SBB_SP = ASC_SBB + train_time + B_TRAIN_COST * TRAIN_COST_SCALED + B_HE * TRAIN_HE_SCALED + B_GA * GA
+    SM_SP = ASC_SM + B_SM_TIME * transform(SM_TT_SCALED,candidate['boxcox SM_TT']) + B_SM_COST * SM_COST_SCALED + B_HE * SM_HE_SCALED + B_GA * GA
+    logprob = bioLogLogit({3: Car_SP,1: SBB_SP,2: SM_SP},av,CHOICE)
+    segment = candidate['segment']
+    if segment is None:
+        return logprob
+    return logprob,{f'{segment}={v}': Variable(segment) == v for v in (0,1)}
+
+if __name__ == '__main__':
+    # The results are written to the file as they arrive, and ranked by
+    # BIC at the end. Candidates with a singular Hessian are not ranked.
+    table = specificationSearch(build,database.data,gridCandidates(space),
+                                output="SpecTest_SM_piecewise_search.csv")
+    print(table[['thresholds','boxcox CAR_TT','boxcox SM_TT','segment',
+                 'logLike','nparam','bayesian','rhoBarSquare',
+                 'singular Hessian','rank']])
@@ -0,0 +1,74 @@
+import pandas as pd
+import biogeme.database as db
+from family import ModelFamily
+
+pandas = pd.read_table("swissmetro.dat")
+database = db.Database("swissmetro",pandas)
+pd.options.display.float_format = '{:.3g}'.format
+
+from headers import *
+
+exclude = ((  PURPOSE   !=  1  ) * (  PURPOSE   !=  3  ) + (  CHOICE   ==  0  ) + (  AGE == 6  ))>0
+database.remove(exclude)
+
+
+#Parameters to be estimated
+# Arguments:
+#   1  Name for report. Typically, the same as the variable
+#   2  Starting value
+#   3  Lower bound
+#   4  Upper bound
+#   5  0: estimate the parameter, 1: keep it fixed
+ASC_CAR	 = Beta('ASC_CAR',0,None,None,0)
+ASC_SBB	 = Beta('ASC_SBB',0,None,None,1)
+ASC_SM	 = Beta('ASC_SM',0,None,None,0)
+B_CAR_COST	 = Beta('B_CAR_COST',0,None,None,0)
+B_HE	 = Beta('B_HE',0,None,None,0)
+B_SM_COST	 = Beta('B_SM_COST',0,None,None,0)
+B_TIME	 = Beta('B_TIME',0,None,None,0)
+B_TRAIN_COST	 = Beta('B_TRAIN_COST',0,None,None,0)
+B_SENIOR	 = Beta('B_SENIOR',0,None,None,0)
+B_GA	 = Beta('B_GA',0,None,None,0)
+
+# Define here arithmetic expressions for name that are not directly 
+# available from the data
+
+SENIOR  = DefineVariable('SENIOR', AGE   ==  5 ,database)
+CAR_AV_SP  = DefineVariable('CAR_AV_SP', CAR_AV    *  (  SP   !=  0  ),database)
+SM_COST  = DefineVariable('SM_COST', SM_CO   * (  GA   ==  0  ),database)
+TRAIN_AV_SP  = DefineVariable('TRAIN_AV_SP', TRAIN_AV    *  (  SP   !=  0  ),database)
+TRAIN_COST  = DefineVariable('TRAIN_COST', TRAIN_CO   * (  GA   ==  0  ),database)
+
+TRAIN_TT_SCALED = DefineVariable('TRAIN_TT_SCALED',\
+                                 TRAIN_TT / 100.0,database)
+TRAIN_COST_SCALED = DefineVariable('TRAIN_COST_SCALED',\
+                                   TRAIN_COST / 100,database)
+SM_TT_SCALED = DefineVariable('SM_TT_SCALED', SM_TT / 100.0,database)
+SM_COST_SCALED = DefineVariable('SM_COST_SCALED', SM_COST / 100,database)
+CAR_TT_SCALED = DefineVariable('CAR_TT_SCALED', CAR_TT / 100,database)
+CAR_CO_SCALED = DefineVariable('CAR_CO_SCALED', CAR_CO / 100,database)
+TRAIN_HE_SCALED = DefineVariable('TRAIN_HE_SCALED', TRAIN_HE / 100,database)
+SM_HE_SCALED = DefineVariable('SM_HE_SCALED', SM_HE / 100,database)
+
+#Utilities
+Car_SP = ASC_CAR + B_TIME * CAR_TT_SCALED + B_CAR_COST * CAR_CO_SCALED + B_SENIOR * SENIOR
+SBB_SP = ASC_SBB + B_TIME * TRAIN_TT_SCALED + B_TRAIN_COST * TRAIN_COST_SCALED + B_HE * TRAIN_HE_SCALED + B_GA * GA
+SM_SP = ASC_SM + B_TIME * SM_TT_SCALED + B_SM_COST * SM_COST_SCALED + B_HE * SM_HE_SCALED + B_GA * GA + B_SENIOR * SENIOR
+
+V = {3: Car_SP,1: SBB_SP,2: SM_SP}
+av = {3: CAR_AV_SP,1: TRAIN_AV_SP,2: SM_AV}
+
+logprob = bioLogLogit(V,av,CHOICE)
+
+# The segments are selected by a condition instead of copies of the
+# database. The three models are compiled into one program, so that
+# the derived columns are computed once for all of them. The pooled
+# model is tested against the two segments.
+family = ModelFamily(database.data)
+family.addSegmentation("fullSample",logprob,{'females': MALE == 0,
+                                             'males': MALE == 1})
+results = family.estimate()
+
+for name,r in results.items():
+    print(f"{name}: LL {r.data.logLike:.3f}  Observations: {r.data.sampleSize}  Parameters: {r.data.nparam}")
+print(family.lrTests())
@@ -0,0 +1,150 @@
+########################################
+#
+# @file aggregation.py
+#
+# Sample enumeration by origin-destination pair.
+#
+# The group index (sorted codes and offsets) is built once for a
+# sample. Aggregating the output of a simulation is then a single
+# segmented reduction over the stacked per-row quantities, whatever
+# the number of alternatives and scenarios.
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """Rows of a sample sorted by group, with the offset of each group.
+
+    The groups are defined by one or several integer code columns,
+    typically ORIGIN and DEST.
+    """
+
+    def __init__(self, *keys, names=None):
+        if len(keys) == 0:
+            raise ValueError("At least one key is needed to define groups")
+        keys = [np.asarray(k) for k in keys]
+        n = len(keys[0])
+        for k in keys:
+            if len(k) != n:
+                raise ValueError("All keys must have the same length")
+        if names is None:
+            names = [f"key{i}" for i in range(len(keys))]
+        self.names = list(names)
+        self.size = n
+        # np.lexsort sorts on the last key first
+        self.order = np.lexsort(keys[::-1], axis=0)
+        sortedKeys = np.column_stack([k[self.order] for k in keys])
+        if n == 0:
+            self.offsets = np.zeros(0, dtype=np.intp)
+        else:
+            change = np.any(sortedKeys[1:] != sortedKeys[:-1], axis=1)
+            self.offsets = np.concatenate(([0], np.flatnonzero(change) + 1))
+        self.codes = sortedKeys[self.offsets]
+        self.counts = np.diff(np.append(self.offsets, n))
+
+    @classmethod
+    def fromData(cls, data, columns=("ORIGIN", "DEST")):
+        """Build the index from columns of a pandas data frame, such as
+        database.data."""
+        return cls(*[data[c].values for c in columns], names=list(columns))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def sum(self, values):
+        """Sum of the rows of values within each group.
+
+        values has one row per observation, in the original order of
+        the sample. It may have any number of columns.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] != self.size:
+            raise ValueError(f"Expected {self.size} rows, got {values.shape[0]}")
+        if len(self) == 0:
+            return np.zeros((0,) + values.shape[1:])
+        return np.add.reduceat(values[self.order], self.offsets, axis=0)
+
+    def groupFrame(self):
+        """Data frame with one row per group, identified by its codes."""
+        return pd.DataFrame(self.codes, columns=self.names)
+
+
+def logsum(utilities, av=None):
+    """Expected maximum utility log sum_j av_j exp(V_j), row by row.
+
+    utilities and av are arrays with one row per observation and one
+    column per alternative.
+    """
+    V = np.asarray(utilities, dtype=float)
+    if av is None:
+        av = np.ones_like(V)
+    av = np.asarray(av) != 0
+    Vav = np.where(av, V, -np.inf)
+    m = np.max(Vav, axis=1, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0.0)
+    with np.errstate(divide='ignore'):
+        return (m + np.log(np.sum(np.exp(Vav - m), axis=1, keepdims=True)))[:, 0]
+
+
+def aggregate(index, probabilities, weights=None, utilities=None, av=None,
+              costCoefficient=None, alternatives=None):
+    """Expansion-weighted shares, log sums and consumer surplus per group.
+
+    probabilities: array (observations x alternatives) produced by a
+    simulation.
+    weights: expansion weight of each observation. Default is 1.
+    utilities, av: arrays (observations x alternatives). If provided,
+    the average log sum of each group is reported.
+    costCoefficient: marginal utility of cost (e.g. B_COST). If
+    provided with the utilities, the consumer surplus -logsum/B_COST
+    is reported, in the units of the cost variable associated with the
+    coefficient.
+
+    All quantities are stacked and reduced in one pass.
+    """
+    P = np.asarray(probabilities, dtype=float)
+    if P.ndim == 1:
+        P = P[:, np.newaxis]
+    n, J = P.shape
+    if alternatives is None:
+        alternatives = list(range(1, J + 1))
+    w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+
+    columns = [w[:, np.newaxis], w[:, np.newaxis] * P]
+    if utilities is not None:
+        columns.append((w * logsum(utilities, av))[:, np.newaxis])
+    totals = index.sum(np.hstack(columns))
+
+    frame = index.groupFrame()
+    frame['observations'] = index.counts
+    frame['weight'] = totals[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j, alt in enumerate(alternatives):
+            frame[f'demand {alt}'] = totals[:, 1 + j]
+        for j, alt in enumerate(alternatives):
+            frame[f'share {alt}'] = totals[:, 1 + j] / totals[:, 0]
+        if utilities is not None:
+            frame['logsum'] = totals[:, 1 + J] / totals[:, 0]
+            if costCoefficient is not None:
+                frame['consumer surplus'] = -frame['logsum'] / costCoefficient
+    return frame
+
+
+def compareScenarios(index, base, scenario, costCoefficient=None):
+    """Difference between two scenarios aggregated on the same group
+    index. The change of consumer surplus per unit of weight is
+    -(logsum_1 - logsum_0)/B_COST, and its total is multiplied by the
+    weight of the group."""
+    diff = base[index.names].copy()
+    for c in base.columns:
+        if c.startswith('share ') or c.startswith('demand '):
+            diff[c] = scenario[c] - base[c]
+    if 'logsum' in base.columns and costCoefficient is not None:
+        diff['delta consumer surplus'] = \
+            -(scenario['logsum'] - base['logsum']) / costCoefficient
+        diff['total delta consumer surplus'] = \
+            diff['delta consumer surplus'] * base['weight']
+    return diff
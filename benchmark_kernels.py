@@ -0,0 +1,146 @@
+########################################
+#
+# @file benchmark_kernels.py
+#
+# Compares the time to evaluate the formulas of the tutorial models
+# with the vectorized evaluator (interpreted) and with the generated
+# kernels (compiled, see kernels.py).
+#
+# Each script is run until it creates its first BIOGEME object, which
+# is intercepted: the database and the formulas are recorded and the
+# script stops there, so that nothing is estimated.
+#
+# Usage: python3 benchmark_kernels.py [--draws R] [--repeat N]
+#            [--output file.csv] [script.py ...]
+#
+#######################################
+
+import argparse
+import contextlib
+import glob
+import io
+import runpy
+import time
+
+import numpy as np
+import pandas as pd
+import biogeme.biogeme as bio
+
+from evaluator import Evaluator
+from kernels import CompiledEvaluator, _Generator, numexpr
+
+
+class _Captured(Exception):
+    def __init__(self, database, formulas, numberOfDraws):
+        super().__init__()
+        self.database = database
+        self.formulas = formulas
+        self.numberOfDraws = numberOfDraws
+
+
+class _Capture:
+    """Replaces bio.BIOGEME while a script runs."""
+
+    def __init__(self, database, formulas, numberOfDraws=1000, **kwargs):
+        raise _Captured(database, formulas, numberOfDraws)
+
+
+def captureModel(script):
+    """Database, formulas and number of draws of the first BIOGEME
+    object created by a script."""
+    original = bio.BIOGEME
+    bio.BIOGEME = _Capture
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(script, run_name='__main__')
+    except _Captured as captured:
+        return captured
+    finally:
+        bio.BIOGEME = original
+    raise ValueError(f"{script} does not create a BIOGEME object")
+
+
+def _drawGenerators(database):
+    # biogeme 3.2: userRandomNumberGenerators, with (function,
+    # description) tuples. biogeme 3.1: randomNumberGenerators.
+    generators = getattr(database, 'userRandomNumberGenerators', None)
+    if generators is None:
+        generators = getattr(database, 'randomNumberGenerators', None) or {}
+    return {name: g[0] if isinstance(g, tuple) else g
+            for name, g in generators.items()}
+
+
+def _time(evaluator, data, repeat):
+    start = time.perf_counter()
+    values = evaluator.evaluate(data)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        evaluator.evaluate(data)
+    return values, first, (time.perf_counter() - start) / repeat
+
+
+def benchmark(script, numberOfDraws=None, repeat=5):
+    """One row of the benchmark table."""
+    row = {'model': script}
+    captured = captureModel(script)
+    data = captured.database.data
+    kwargs = {'numberOfDraws': numberOfDraws or captured.numberOfDraws,
+              'seed': 1,
+              'panel': getattr(captured.database, 'panelColumn', None),
+              'drawGenerators': _drawGenerators(captured.database)}
+    interpreted = Evaluator(captured.formulas, **kwargs)
+    compiled = CompiledEvaluator(captured.formulas, **kwargs)
+    source = _Generator(compiled, True, numexpr is not None).source()
+    row['rows'] = len(data)
+    row['draws'] = kwargs['numberOfDraws'] if interpreted.drawTypes else 0
+    # Operations after common subexpression elimination, and number of
+    # nodes shared or merged
+    row.update(interpreted.statistics())
+    row['statements'] = source.count('\n') - 5
+    a, _, row['interpreted [s]'] = _time(interpreted, data, repeat)
+    b, row['first call [s]'], row['compiled [s]'] = _time(compiled, data,
+                                                          repeat)
+    row['speedup'] = row['interpreted [s]'] / row['compiled [s]']
+    row['max abs diff'] = max(
+        float(np.nanmax(np.abs(np.asarray(a[k]) - np.asarray(b[k])),
+                        initial=0.0)) for k in a)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Interpreted and compiled evaluation of the tutorial "
+                    "models")
+    parser.add_argument('scripts', nargs='*')
+    parser.add_argument('--draws', type=int, default=None,
+                        help='number of draws (default: as in the script)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='benchmark_kernels.csv')
+    args = parser.parse_args()
+    scripts = args.scripts or [
+        s for s in sorted(glob.glob('[0-9][0-9]*.py') +
+                          glob.glob('SpecTest_*.py'))
+        if 'bio.BIOGEME(' in open(s).read()]
+    rows = []
+    for script in scripts:
+        try:
+            row = benchmark(script, args.draws, args.repeat)
+        except Exception as e:
+            message = str(e).splitlines()[0][:120] if str(e) else ''
+            row = {'model': script, 'error': f'{type(e).__name__}: {message}'}
+        rows.append(row)
+        if 'error' in row:
+            print(f"{script}: {row['error']}")
+        else:
+            print(f"{script}: speedup {row['speedup']:.2f}")
+    table = pd.DataFrame(rows)
+    print(table.to_string(index=False))
+    table.to_csv(args.output, index=False)
+    if 'speedup' in table:
+        print(f"Median speedup: {table['speedup'].median():.2f} "
+              f"({table['speedup'].notna().sum()} models)")
+
+
+if __name__ == '__main__':
+    main()
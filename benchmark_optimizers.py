@@ -0,0 +1,244 @@
+########################################
+#
+# @file benchmark_optimizers.py
+#
+# Compares the optimization algorithms of estimation.estimate (scipy
+# and BHHH) on the tutorial models. This is not a benchmark of
+# biogeme's own estimate, whose optimizer is fixed in biogeme 3.1.
+#
+# The model of each script is captured as in benchmark_kernels.py, and
+# its log likelihood is evaluated by the vectorized evaluator (a
+# ModelFamily with one member, whose scores are the gradients of the
+# observations or individuals). The BIOGEME object of the script is
+# also created: it generates the draws, used by the evaluator as well,
+# and provides the exact second derivatives of the same likelihood
+# (calculateLikelihoodAndDerivatives). The model is then estimated by
+# each algorithm:
+#
+# - BFGS: line search BFGS, without bounds (skipped for the models with
+#   bounds, where estimate would run L-BFGS-B instead),
+# - L-BFGS-B: limited memory BFGS with simple bounds,
+# - TNC: truncated Newton with simple bounds,
+# - trust-constr: trust region with the analytic Hessian of biogeme,
+# - BHHH: outer product of the scores (see estimation.bhhh).
+#
+# Each estimation runs in its own process, so that its peak resident
+# memory can be measured. The iterations, the evaluations of the
+# function (with its gradient), of the scores and of the Hessian
+# (including the one for the covariance matrix at the end), the wall
+# time, the peak memory and the final log likelihood are written to a
+# CSV file (or JSON if the output file ends with .json). The errors are
+# reported with their traceback, and the benchmark fails if most runs
+# fail.
+#
+# Usage: python3 benchmark_optimizers.py [--algorithms A B ...]
+#            [--draws R] [--timeout s] [--output file.csv] [script.py ...]
+#
+#######################################
+
+import argparse
+import glob
+import multiprocessing
+import resource
+import sys
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+import biogeme.biogeme as bio
+
+from benchmark_kernels import _drawGenerators, captureModel
+from estimation import BOUNDED_ALGORITHMS, estimate
+from family import ModelFamily
+
+ALGORITHMS = ['BFGS', 'L-BFGS-B', 'TNC', 'trust-constr', 'BHHH']
+
+
+class _Counted:
+    """Model counting the evaluations of its functions. The second
+    derivatives are those of biogeme."""
+
+    def __init__(self, model, biogeme):
+        self.model = model
+        self.biogeme = biogeme
+        # Position of each parameter of the model in those of biogeme
+        self.order = [list(biogeme.freeBetaNames).index(name)
+                      for name in model.names]
+        self.names = model.names
+        self.start = model.start
+        self.bounds = model.bounds
+        self.size = model.size
+        self.modelName = model.modelName
+        self.functionEvaluations = 0
+        self.scoreEvaluations = 0
+        self.hessianEvaluations = 0
+
+    def loglikelihood(self, x):
+        self.functionEvaluations += 1
+        return self.model.loglikelihood(x)
+
+    def scores(self, x):
+        self.scoreEvaluations += 1
+        return self.model.scores(x)
+
+    def hessian(self, x):
+        self.hessianEvaluations += 1
+        y = np.empty(len(x))
+        y[self.order] = x
+        try:
+            h = self.biogeme.calculateLikelihoodAndDerivatives(
+                y, hessian=True)[2]
+        except TypeError:
+            # biogeme 3.2: scaled argument
+            h = self.biogeme.calculateLikelihoodAndDerivatives(
+                y, scaled=False, hessian=True)[2]
+        return np.asarray(h)[np.ix_(self.order, self.order)]
+
+
+def captureLogLikelihood(script, numberOfDraws=None):
+    """Model of a script, evaluated by the vectorized evaluator with
+    the draws of biogeme, and the BIOGEME object of the script."""
+    captured = captureModel(script)
+    formulas = captured.formulas
+    if isinstance(formulas, dict):
+        if 'loglike' not in formulas:
+            raise ValueError(f"{script} does not estimate a model")
+        loglike = formulas['loglike']
+        if 'weight' in formulas:
+            loglike = loglike * formulas['weight']
+    else:
+        loglike = formulas
+    database = captured.database
+    numberOfDraws = numberOfDraws or captured.numberOfDraws
+    # The seed gives the same draws to all the algorithms
+    biogeme = bio.BIOGEME(database, captured.formulas,
+                          numberOfDraws=numberOfDraws, numberOfThreads=1,
+                          seed=1)
+    family = ModelFamily(database.data,
+                         panel=getattr(database, 'panelColumn', None),
+                         numberOfDraws=numberOfDraws,
+                         seed=1,
+                         drawGenerators=_drawGenerators(database))
+    family.add(script, loglike)
+    family.compile()
+    if family.evaluator.drawTypes:
+        family.evaluator.useDatabaseDraws(database)
+    return family.members[script], biogeme
+
+
+def _peakMemory():
+    """Peak resident memory of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def benchmark(script, algorithm, numberOfDraws=None):
+    """One row of the table: estimation of the model of script with
+    algorithm."""
+    row = {'model': script, 'algorithm': algorithm}
+    model = _Counted(*captureLogLikelihood(script, numberOfDraws))
+    row['parameters'] = len(model.names)
+    if algorithm not in BOUNDED_ALGORITHMS and \
+            any(b != (None, None) for b in model.bounds):
+        row['skipped'] = f'{algorithm} does not handle the bounds'
+        return row
+    start = time.perf_counter()
+    results = estimate(model, algorithm=algorithm)
+    row['wall time [s]'] = time.perf_counter() - start
+    d = results.data
+    messages = d.optimizationMessages
+    row['algorithm used'] = messages['Algorithm']
+    row['message'] = str(messages['Message'])
+    row['iterations'] = messages['Number of iterations']
+    row['function evaluations'] = model.functionEvaluations
+    row['score evaluations'] = model.scoreEvaluations
+    row['hessian evaluations'] = model.hessianEvaluations
+    row['peak memory [MB]'] = _peakMemory()
+    row['final logLike'] = d.logLike
+    row['gradient norm'] = d.gradientNorm
+    return row
+
+
+def _child(script, algorithm, numberOfDraws, queue):
+    try:
+        queue.put(benchmark(script, algorithm, numberOfDraws))
+    except Exception as e:
+        message = str(e).splitlines()[0][:120] if str(e) else ''
+        queue.put({'model': script, 'algorithm': algorithm,
+                   'error': f'{type(e).__name__}: {message}',
+                   'traceback': traceback.format_exc()})
+
+
+def runIsolated(script, algorithm, numberOfDraws=None, timeout=None):
+    """benchmark in a new process."""
+    context = multiprocessing.get_context()
+    queue = context.Queue()
+    process = context.Process(target=_child,
+                              args=(script, algorithm, numberOfDraws, queue))
+    process.start()
+    try:
+        row = queue.get(timeout=timeout)
+    except Exception:
+        process.terminate()
+        row = {'model': script, 'algorithm': algorithm,
+               'error': f'no result after {timeout} s'}
+    process.join()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Optimization algorithms on the tutorial models")
+    parser.add_argument('scripts', nargs='*')
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS)
+    parser.add_argument('--draws', type=int, default=None,
+                        help='number of draws (default: as in the script)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='maximum time of one estimation [s]')
+    parser.add_argument('--output', default='benchmark_optimizers.csv')
+    args = parser.parse_args()
+    scripts = args.scripts or [
+        s for s in sorted(glob.glob('[0-9][0-9]*.py') +
+                          glob.glob('SpecTest_*.py'))
+        if 'bio.BIOGEME(' in open(s).read()]
+    rows = []
+    for script in scripts:
+        for algorithm in args.algorithms:
+            row = runIsolated(script, algorithm, args.draws, args.timeout)
+            rows.append(row)
+            if 'error' in row:
+                print(f"{script} {algorithm}: {row['error']}")
+                if 'traceback' in row:
+                    print(row['traceback'])
+            elif 'skipped' in row:
+                print(f"{script} {algorithm}: skipped, {row['skipped']}")
+            else:
+                print(f"{script} {algorithm}: {row['final logLike']:.3f} "
+                      f"in {row['wall time [s]']:.2f} s")
+    table = pd.DataFrame(rows)
+    print(table.drop(columns='traceback', errors='ignore').to_string(
+        index=False))
+    if args.output.endswith('.json'):
+        table.to_json(args.output, orient='records', indent=1)
+    else:
+        table.to_csv(args.output, index=False)
+    if 'final logLike' in table:
+        # Among the algorithms reaching the best log likelihood
+        done = table.dropna(subset=['final logLike'])
+        best = done.groupby('model')['final logLike'].transform('max')
+        done = done[np.abs(done['final logLike'] - best) <= 1e-2]
+        fastest = done.sort_values('wall time [s]').groupby(
+            'model')['algorithm'].first()
+        print("Fastest algorithm per model:")
+        print(fastest.to_string())
+    runs = table[table['skipped'].isna()] if 'skipped' in table else table
+    failed = int(runs['error'].notna().sum()) if 'error' in runs else 0
+    if failed > len(runs) / 2:
+        sys.exit(f"{failed} of {len(runs)} runs failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+########################################
+#
+# @file bootstrap.py
+#
+# Bootstrap standard errors, as biogeme.estimate(bootstrap=...), for
+# the likelihoods evaluated by the vectorized evaluator.
+#
+# Each replicate is a sample of the individuals (all the observations
+# of an individual, so that the panel of 12panel.py is kept), drawn
+# with replacement. Its sample and its draws are generated from the
+# seed of the bootstrap and the number of the replicate only, so that
+# they are the same when the bootstrap is restarted.
+#
+# With a checkpoint directory, the estimates of each replicate are
+# written there when it is done, and the state of the optimizer during
+# its estimation (see checkpoint.py). A bootstrap that is killed is
+# restarted by calling it again: the replicates already done are read,
+# and the interrupted one resumes from its last iteration.
+#
+#######################################
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import loadCheckpoint, saveCheckpoint
+from estimation import estimate
+from family import ModelFamily
+
+
+def bootstrapSample(data, group, seed, replicate):
+    """Rows of a bootstrap replicate: individuals drawn with
+    replacement. An individual drawn several times appears as several
+    individuals, with new identifiers."""
+    codes = np.asarray(data[group])
+    individuals, counts = np.unique(codes, return_counts=True)
+    rng = np.random.default_rng([seed, replicate])
+    drawn = rng.integers(len(individuals), size=len(individuals))
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], individuals)
+    rows = np.concatenate([order[starts[i]:starts[i] + counts[i]]
+                           for i in drawn])
+    sample = data.iloc[rows].copy()
+    sample[group] = np.repeat(np.arange(len(drawn)), counts[drawn])
+    return sample.reset_index(drop=True)
+
+
+def bootstrap(loglike, data, results, numberOfReplications=10, group='ID',
+              seed=None, checkpoint=None, algorithm='L-BFGS-B', **kwargs):
+    """Estimate loglike on numberOfReplications bootstrap samples.
+
+    data: the data frame, e.g. database.data.
+    results: EstimationResults on the full sample. The replicates start
+    from its estimates, and its bootstrap covariance matrix is set
+    (results.data.bootstrap_varCovar).
+    group: column identifying the individuals.
+    checkpoint: directory of the checkpoints, or None.
+    kwargs: passed to ModelFamily (panel, numberOfDraws...).
+
+    Returns a data frame with the estimates of each replicate.
+    """
+    state = None
+    if checkpoint is not None:
+        os.makedirs(checkpoint, exist_ok=True)
+        state = loadCheckpoint(os.path.join(checkpoint, 'bootstrap.pickle'))
+    if state is not None:
+        seed = state['seed']
+    else:
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy)
+        if checkpoint is not None:
+            saveCheckpoint(os.path.join(checkpoint, 'bootstrap.pickle'),
+                           {'seed': seed,
+                            'numberOfReplications': numberOfReplications})
+    start = results.getBetaValues()
+    rows = []
+    for r in range(numberOfReplications):
+        done = None
+        if checkpoint is not None:
+            done = os.path.join(checkpoint, f'replicate_{r:03d}.pickle')
+            replicate = loadCheckpoint(done)
+            if replicate is not None:
+                rows.append(replicate)
+                continue
+        # Unless a seed is given, the draws of the replicate are also
+        # derived from the seed of the bootstrap
+        drawSeed = kwargs.get('seed', int(np.random.SeedSequence(
+            [seed, r]).generate_state(1)[0]))
+        family = ModelFamily(bootstrapSample(data, group, seed, r),
+                             **dict(kwargs, seed=drawSeed))
+        family.add(f'replicate {r}', loglike)
+        family.compile()
+        model = family.members[f'replicate {r}']
+        x0 = [start.get(name, v) for name, v in zip(model.names, model.start)]
+        progress = None if checkpoint is None else \
+            os.path.join(checkpoint, f'replicate_{r:03d}.ckpt')
+        estimated = estimate(model, x0, algorithm=algorithm, hessian='bhhh',
+                             checkpoint=progress, resume=True)
+        replicate = dict(estimated.getBetaValues(),
+                         logLike=estimated.data.logLike)
+        if checkpoint is not None:
+            saveCheckpoint(done, replicate)
+            if os.path.exists(progress):
+                os.remove(progress)
+        rows.append(replicate)
+    table = pd.DataFrame(rows)
+    table.index.name = 'replicate'
+    names = results.data.betaNames
+    results.data.bootstrap = table[names].to_numpy()
+    results.data.bootstrap_varCovar = np.atleast_2d(
+        np.cov(results.data.bootstrap, rowvar=False))
+    return table
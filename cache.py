@@ -0,0 +1,152 @@
+########################################
+#
+# @file cache.py
+#
+# Bounded LRU cache of predictions.
+#
+# The key of an observation is made of its attributes, rounded on a
+# grid (so that 112 and 112.0000001 minutes share an entry), and of a
+# hash of the parameter values. Only the observations missing from
+# the cache are scored, as one batch. The cache is emptied when the
+# pickle file of the model is replaced by a newer one.
+#
+# The prediction of an entry is computed at the point of the grid,
+# not at the attributes of the first observation that hit it, so that
+# it does not depend on the order of the requests. A prediction
+# through the cache is therefore the prediction for the attributes
+# rounded to the resolution.
+#
+#######################################
+
+import hashlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def parameterHash(betas):
+    """Hash of a dict of parameter values, independent of its order."""
+    text = ';'.join(f"{k}={float(v)!r}" for k, v in sorted(betas.items()))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class PredictionCache:
+    """LRU cache in front of a PredictionModel (see serving.py).
+
+    maxSize: maximum number of observations kept.
+    resolution: step of the grid on which the attributes are rounded.
+    Either a number, or a dict associating the name of an attribute
+    with its step. Default is 1e-6.
+    checkInterval: minimum time in seconds between two checks of the
+    modification time of the pickle file.
+    """
+
+    def __init__(self, model, maxSize=100000, resolution=1e-6,
+                 checkInterval=1.0):
+        self.model = model
+        self.maxSize = maxSize
+        self.attributes = sorted(model.evaluator.variables)
+        if isinstance(resolution, dict):
+            self.resolution = np.array([resolution.get(a, 1e-6)
+                                        for a in self.attributes])
+        else:
+            self.resolution = np.full(len(self.attributes), resolution)
+        # Steps such as 1e-6 or 0.1 are applied as divisions by their
+        # (integer) inverse, so that integer attributes stay integers
+        inverse = 1 / self.resolution
+        self._divisor = np.where((inverse >= 1) &
+                                 np.isclose(inverse, np.round(inverse)),
+                                 np.round(inverse), np.nan)
+        self.checkInterval = checkInterval
+        self._lastCheck = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.paramHash = parameterHash(model.betas)
+        self.names = list(model.evaluator.outputs)
+
+    def clear(self):
+        self.entries.clear()
+
+    def _checkModel(self):
+        now = time.monotonic()
+        if self._lastCheck is not None and \
+           now - self._lastCheck < self.checkInterval:
+            return
+        self._lastCheck = now
+        if hasattr(self.model, 'refresh') and self.model.refresh():
+            self.paramHash = parameterHash(self.model.betas)
+            self.invalidations += 1
+            self.clear()
+
+    def _grid(self, data):
+        """Index of each attribute of each row of data on the grid."""
+        x = np.column_stack([np.asarray(data[a], dtype=float)
+                             for a in self.attributes])
+        return np.round(x / self.resolution).astype(np.int64)
+
+    def _gridPoint(self, q):
+        """Attributes at the points of the grid of indices q."""
+        return np.where(np.isnan(self._divisor), q * self.resolution,
+                        q / self._divisor)
+
+    def _keys(self, q):
+        prefix = self.paramHash.encode()
+        return [prefix + row.tobytes() for row in q]
+
+    def keys(self, data):
+        """Key of each row of data."""
+        return self._keys(self._grid(data))
+
+    def score(self, data):
+        """Same as the score method of the model, through the cache."""
+        self._checkModel()
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data)
+        q = self._grid(data)
+        keys = self._keys(q)
+        found = [self.entries.get(k) for k in keys]
+        missing = [i for i, f in enumerate(found) if f is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        for k, f in zip(keys, found):
+            if f is not None:
+                self.entries.move_to_end(k)
+        if missing:
+            # Rows repeated in the batch are scored once.
+            unique = {}
+            for i in missing:
+                unique.setdefault(keys[i], i)
+            rows = list(unique.values())
+            batch = data.iloc[rows].copy()
+            batch[self.attributes] = self._gridPoint(q[rows])
+            values = self.model.score(batch)
+            scored = np.column_stack([values[n] for n in self.names])
+            for j, i in enumerate(rows):
+                self.entries[keys[i]] = scored[j]
+            for i in missing:
+                found[i] = self.entries[keys[i]]
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        table = np.vstack(found) if found else \
+            np.zeros((0, len(self.names)))
+        return {n: table[:, j] for j, n in enumerate(self.names)}
+
+    def scoreRecords(self, records):
+        values = self.score(pd.DataFrame.from_records(records))
+        return [{k: float(v[i]) for k, v in values.items()}
+                for i in range(len(records))]
+
+    def statistics(self):
+        total = self.hits + self.misses
+        return {'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hitRate': self.hits / total if total else 0.0}
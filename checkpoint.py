@@ -0,0 +1,173 @@
+########################################
+#
+# @file checkpoint.py
+#
+# Checkpoints of long estimations, such as the simulated likelihoods
+# of 12panel.py or of the mixtures with 1000 draws, so that a job that
+# is killed can be restarted where it stopped.
+#
+# After each iteration, the state of the optimizer is written to a
+# small pickle file: parameters, log likelihood and gradient,
+# iteration, inverse Hessian approximation (BFGS) or trust region
+# radius (trust-constr), and seed and number of draws. The file is
+# written under a temporary name and renamed, so that a checkpoint is
+# never left half written.
+#
+# On restart (estimate(..., resume=True)), the draws are generated
+# again from the recorded seed, so that the resumed estimation
+# maximizes the same simulated likelihood. L-BFGS-B and TNC restart
+# from the parameters only, their internal memory being rebuilt in a
+# few iterations. BHHH has no memory, and restarts exactly.
+#
+#######################################
+
+import os
+import pickle
+import time
+
+import numpy as np
+
+
+def saveCheckpoint(path, state):
+    """Write state (a dict) to path atomically."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def loadCheckpoint(path):
+    """State written by saveCheckpoint, or None if there is no file."""
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def drawSettings(model):
+    """Seed and number of draws of a model evaluated by a ModelFamily
+    (None, None for other models)."""
+    family = getattr(model, 'family', None)
+    if family is None or family.evaluator is None:
+        return None, None
+    ev = family.evaluator
+    if not ev.drawTypes:
+        return None, None
+    # The seed is chosen when the draws are generated
+    family._prepare()
+    return ev.seed, ev.numberOfDraws
+
+
+def restoreState(model, state):
+    """Check that state is a checkpoint of model, and generate the
+    draws of the model from its seed."""
+    if list(state['names']) != list(model.names):
+        raise ValueError(f"The checkpoint is for the parameters "
+                         f"{state['names']}, not {list(model.names)}")
+    seed = state.get('drawSeed')
+    if seed is None:
+        return
+    family = getattr(model, 'family', None)
+    if family is None:
+        raise ValueError("The checkpoint has draws, the model has none")
+    if family.evaluator is None:
+        family.compile()
+    if family.evaluator.numberOfDraws != state['numberOfDraws']:
+        raise ValueError(f"The checkpoint uses {state['numberOfDraws']} "
+                         f"draws, the model "
+                         f"{family.evaluator.numberOfDraws}")
+    family.setDrawSeed(seed)
+
+
+class Tracker:
+    """Follows the iterations of an optimizer (see estimation.estimate)
+    and writes a checkpoint after each of them.
+
+    The evaluations of the log likelihood go through loglikelihood, so
+    that the gradient at the new iterate is known without evaluating
+    it again. For BFGS, the inverse Hessian approximation is updated
+    as in scipy, so that it can be given back (hess_inv0) on restart.
+    """
+
+    def __init__(self, model, path, algorithm, state=None):
+        self.model = model
+        self.path = path
+        self.algorithm = algorithm
+        self.iteration = 0
+        self.inverseHessian = None
+        self.trustRadius = None
+        self.previous = None
+        if state is not None:
+            self.iteration = state['iteration']
+            self.inverseHessian = state.get('inverseHessian')
+            self.trustRadius = state.get('trustRadius')
+            self.previous = (np.asarray(state['x'], dtype=float),
+                             np.asarray(state['gradient'], dtype=float))
+        self.recent = []
+
+    def loglikelihood(self, x):
+        L, g = self.model.loglikelihood(x)
+        x = np.array(x, dtype=float)
+        if self.previous is None:
+            # First evaluation, at the starting point
+            self.previous = (x, np.array(g, dtype=float))
+        self.recent = ([(x, L, np.asarray(g))] + self.recent)[:4]
+        return L, g
+
+    def _at(self, x):
+        for y, L, g in self.recent:
+            if np.array_equal(x, y):
+                return L, g
+        return self.loglikelihood(x)
+
+    def _updateInverseHessian(self, x, g):
+        # Minimization of -L: the gradient is -g
+        if self.previous is not None:
+            s = x - self.previous[0]
+            y = self.previous[1] - g
+            H = self.inverseHessian
+            if H is None:
+                H = np.eye(len(x))
+            yTs = float(y @ s)
+            rho = 1000.0 if yTs == 0 else 1.0 / yTs
+            A1 = np.eye(len(x)) - rho * np.outer(s, y)
+            A2 = np.eye(len(x)) - rho * np.outer(y, s)
+            self.inverseHessian = A1 @ H @ A2 + rho * np.outer(s, s)
+
+    def callback(self, intermediate_result):
+        """Callback of scipy.optimize.minimize and estimation.bhhh."""
+        x = np.array(intermediate_result.x, dtype=float)
+        if 'gradient' in intermediate_result:
+            # estimation.bhhh
+            L, g = -intermediate_result.fun, intermediate_result.gradient
+        elif 'grad' in intermediate_result:
+            # trust-constr: gradient of the objective, -L
+            L, g = -intermediate_result.fun, -intermediate_result.grad
+        else:
+            L, g = self._at(x)
+        g = np.asarray(g, dtype=float)
+        if self.algorithm == 'BFGS':
+            self._updateInverseHessian(x, g)
+        if 'tr_radius' in intermediate_result:
+            self.trustRadius = float(intermediate_result.tr_radius)
+        self.previous = (x, g)
+        self.iteration += 1
+        seed, numberOfDraws = drawSettings(self.model)
+        saveCheckpoint(self.path, {
+            'modelName': getattr(self.model, 'modelName', None),
+            'names': list(self.model.names),
+            'algorithm': self.algorithm,
+            'iteration': self.iteration,
+            'x': x,
+            'logLike': float(L),
+            'gradient': g,
+            'inverseHessian': self.inverseHessian,
+            'trustRadius': self.trustRadius,
+            'drawSeed': seed,
+            'numberOfDraws': numberOfDraws,
+            'time': time.time()})
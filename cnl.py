@@ -0,0 +1,164 @@
+########################################
+#
+# @file cnl.py
+#
+# Cross-nested logit with the allocation parameters stored as a
+# matrix (alternatives x nests).
+#
+# The nests are given as in biogeme.models.logcnl_avail: a tuple of
+# (MU, alpha), where alpha is a dict associating alternatives with
+# their allocation to the nest. MU and the entries of alpha may be
+# numbers, Beta or expressions of Beta (e.g. 1 - ALPHA_EXISTING). They
+# are evaluated once per iteration, with their derivatives, and the
+# generating function is evaluated for all rows with array operations
+# over (rows x alternatives x nests):
+#
+#   S_m = sum_j av_j alpha_jm^mu_m exp(mu_m V_j),
+#   P(m) = S_m^(1/mu_m) / sum_l S_l^(1/mu_l),
+#   P(i|m) = alpha_im^mu_m exp(mu_m V_i) / S_m,
+#   P(i) = sum_m P(m) P(i|m).
+#
+#######################################
+
+import numpy as np
+
+from design import UtilitySpecification
+from evaluator import Evaluator
+
+
+class CrossNestedLogit:
+    """Cross-nested logit model.
+
+    V, av, nests, choice: as for biogeme.models.logcnl_avail.
+    """
+
+    def __init__(self, V, av, nests, choice, data, definitions=None,
+                 modelName='cnl'):
+        self.modelName = modelName
+        self.spec = UtilitySpecification(V, av, choice, data, definitions)
+        self.size = self.spec.size
+        alts = self.spec.alternatives
+        J = len(alts)
+        N = len(nests)
+        self.K = len(self.spec.names)
+
+        formulas = {}
+        for m, (mu, alpha) in enumerate(nests):
+            formulas[('mu', m)] = mu
+            for i, a in alpha.items():
+                formulas[('alpha', alts.index(i), m)] = a
+        self.nestParameters = Evaluator(formulas)
+        pnames = self.nestParameters.freeBetas()
+        betas = self.nestParameters.betas
+        self.names = list(self.spec.names)
+        start = list(self.spec.start)
+        self.bounds = list(self.spec.bounds)
+        for name in pnames:
+            if name not in self.names:
+                self.names.append(name)
+                start.append(betas[name].initValue)
+                self.bounds.append((betas[name].lb, betas[name].ub))
+        self.start = np.array(start, dtype=float)
+        self.pindex = np.array([self.names.index(p) for p in pnames],
+                               dtype=np.intp)
+        self.J = J
+        self.N = N
+        self._dummy = {'_': np.zeros(1)}
+        self._last = None
+
+    def allocations(self, x):
+        """Scales mu (nests), allocation matrix alpha (alternatives x
+        nests), and their derivatives with respect to the parameters of
+        the nests."""
+        betaValues = dict(zip(self.names, x))
+        values, grads = self.nestParameters.evaluate(self._dummy, betaValues,
+                                                     gradient=True)
+        P = len(self.pindex)
+        mu = np.zeros(self.N)
+        dmu = np.zeros((self.N, P))
+        alpha = np.zeros((self.J, self.N))
+        dalpha = np.zeros((self.J, self.N, P))
+        for key, v in values.items():
+            if key[0] == 'mu':
+                mu[key[1]] = v[0]
+                dmu[key[1]] = grads[key][0]
+            else:
+                alpha[key[1], key[2]] = v[0]
+                dalpha[key[1], key[2]] = grads[key][0]
+        return mu, dmu, alpha, dalpha
+
+    def _evaluate(self, x):
+        x = np.asarray(x, dtype=float)
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1]
+        n = self.size
+        rows = np.arange(n)
+        i = self.spec.choice
+        av = self.spec.av
+        V, dV = self.spec.utilities(x[:self.K], jacobian=True)
+        mu, dmu, alpha, dalpha = self.allocations(x)
+
+        # The probabilities are invariant to a shift of the utilities.
+        shift = np.max(np.where(av, V, -np.inf), axis=1)
+        Vs = V - shift[:, None]
+        positive = alpha > 0
+        with np.errstate(divide='ignore'):
+            logAlpha = np.where(positive, np.log(alpha), 0.0)
+        W = np.where(positive, alpha ** mu[None, :], 0.0)
+        E = np.exp(Vs[:, :, None] * mu[None, None, :]) * W[None, :, :] * \
+            av[:, :, None]
+        S = np.sum(E, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = np.nan_to_num(E / S[:, None, :])
+            logS = np.log(S)
+            Lm = logS / mu
+            top = np.max(Lm, axis=1, keepdims=True)
+            logG = top[:, 0] + np.log(np.sum(np.exp(Lm - top), axis=1))
+            Q = np.nan_to_num(np.exp(Lm - logG[:, None]))
+        P = np.einsum('nm,njm->nj', Q, q)
+        Pi = P[rows, i]
+        logP = np.log(Pi)
+        # Probability of each nest given the chosen alternative
+        r = Q * q[rows, i, :] / Pi[:, None]
+
+        scores = np.zeros((n, len(self.names)))
+        # Utilities
+        GV = np.einsum('nm,njm->nj', r * (1 - mu)[None, :], q) - P
+        GV[rows, i] += r @ mu
+        scores[:, :self.K] = np.einsum('nj,njk->nk', GV, dV)
+
+        # Nest scales
+        B = np.einsum('njm,njm->nm', q,
+                      logAlpha[None, :, :] + Vs[:, :, None])
+        finiteS = S > 0
+        D = np.where(finiteS, -np.where(finiteS, logS, 0.0) / mu ** 2 +
+                     B / mu, 0.0)
+        own = np.where(positive[i], logAlpha[i] + Vs[rows, i][:, None] - B,
+                       0.0)
+        gmu = r * D - Q * D + r * own
+
+        # Allocations
+        with np.errstate(divide='ignore', invalid='ignore'):
+            invAlpha = np.where(positive, 1.0 / alpha, 0.0)
+        galpha = ((r * (1 - mu) - Q)[:, None, :] * q)
+        galpha[rows, i, :] += r * mu
+        galpha *= invAlpha[None, :, :]
+
+        gp = gmu @ dmu + np.einsum('njm,jmp->np', galpha, dalpha)
+        for k, p in enumerate(self.pindex):
+            scores[:, p] += gp[:, k]
+
+        result = (logP, scores, P)
+        self._last = (x.copy(), result)
+        return result
+
+    def loglikelihood(self, x):
+        logP, scores, _ = self._evaluate(x)
+        return np.sum(logP), np.sum(scores, axis=0)
+
+    def scores(self, x):
+        return self._evaluate(x)[1]
+
+    def probabilities(self, x):
+        """Probability of each alternative (rows x alternatives)."""
+        return self._evaluate(x)[2]
@@ -0,0 +1,129 @@
+########################################
+#
+# @file conditional.py
+#
+# Individual level estimates of the random parameters, conditional on
+# the observed choices.
+#
+# With draws b_ir of the random parameters of individual i, and the
+# likelihood L_ir of the choices of i for each draw, the posterior
+# moments are
+#
+#   E[b | y_i] = sum_r L_ir b_ir / sum_r L_ir,
+#
+# computed for all the individuals, draws and parameters with one
+# weighted reduction over an array (individuals x parameters x draws).
+# When a biogeme database is given, the draws that bio.BIOGEME
+# generated in it (database.theDraws) are used: they are those of the
+# estimation if BIOGEME was given the seed of the estimation. With a
+# data frame, the draws are generated by the vectorized evaluator.
+#
+# For latent classes, the posterior probability of class c is
+#
+#   P(c | y_i) = sum_r pi_irc L_irc / sum_r sum_l pi_irl L_irl.
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+
+from evaluator import Evaluator
+
+
+def _simulate(formulas, data, betaValues, panel, drawNames=None,
+              **kwargs):
+    """Values of the formulas for each statistical unit (individual
+    for a panel, row otherwise) and each draw, and the identifiers of
+    the units. Row level formulas are taken at the first row of each
+    individual.
+
+    data: a data frame, or a biogeme database whose draws are used
+    (see Evaluator.useDatabaseDraws)."""
+    database = None
+    if hasattr(data, 'panelColumn'):
+        database, data = data, data.data
+        if panel is None:
+            panel = database.panelColumn
+    evaluator = Evaluator(formulas, panel=panel, **kwargs)
+    if database is not None and evaluator.drawTypes:
+        evaluator.useDatabaseDraws(database, drawNames)
+    values = evaluator.evaluate(data, betaValues)
+    if panel is None:
+        rows = np.arange(len(data))
+        index = pd.Index(data.index, name='row')
+    else:
+        rows = evaluator.panelOffsets(data)
+        index = pd.Index(np.asarray(data[panel])[rows], name=panel)
+    R = evaluator.numberOfDraws if evaluator.drawTypes else 1
+    units = len(rows)
+    result = {}
+    for k, v in values.items():
+        v = np.asarray(v)
+        if v.ndim == 1:
+            v = v[:, None]
+        if v.shape[0] != units:
+            v = v[rows]
+        result[k] = np.broadcast_to(v, (units, R))
+    return result, index
+
+
+def conditionalMoments(likelihood, parameters, data, betaValues,
+                       panel=None, **kwargs):
+    """Posterior mean and standard deviation of each random parameter
+    for each individual.
+
+    likelihood: expression of the likelihood of the choices of an
+    individual given the draws, e.g. PanelLikelihoodTrajectory(obsprob)
+    for a panel, or obsprob otherwise (without MonteCarlo).
+    parameters: dict associating names with expressions of the random
+    parameters, such as B_TIME + B_TIME_S * bioDraws('B_TIME_RND',
+    'NORMAL').
+    data: the biogeme database of the estimation, after bio.BIOGEME
+    has generated its draws, or a data frame.
+    betaValues: estimated values, e.g. results.getBetaValues().
+    panel: column identifying individuals, as in database.panel. By
+    default, the panel column of the database.
+    kwargs: drawNames, the draw variables of database.theDraws (see
+    Evaluator.useDatabaseDraws), and numberOfDraws, seed,
+    drawGenerators, definitions, passed to the Evaluator.
+
+    Returns a data frame with one row per individual, and columns
+    '<name> mean' and '<name> std'.
+    """
+    formulas = {('likelihood',): likelihood}
+    formulas.update({('parameter', name): f for name, f in
+                     parameters.items()})
+    values, index = _simulate(formulas, data, betaValues, panel, **kwargs)
+    L = values[('likelihood',)]
+    weights = L / np.sum(L, axis=1, keepdims=True)
+    names = list(parameters.keys())
+    B = np.stack([values[('parameter', name)] for name in names], axis=1)
+    mean = np.einsum('ir,ipr->ip', weights, B)
+    second = np.einsum('ir,ipr->ip', weights, B * B)
+    std = np.sqrt(np.maximum(second - mean * mean, 0.0))
+    columns = {}
+    for p, name in enumerate(names):
+        columns[f'{name} mean'] = mean[:, p]
+        columns[f'{name} std'] = std[:, p]
+    return pd.DataFrame(columns, index=index)
+
+
+def classPosteriors(classes, data, betaValues, panel=None, **kwargs):
+    """Posterior probability of each latent class for each individual.
+
+    classes: dict associating the name of each class with a tuple
+    (probability of the class, likelihood of the choices of the
+    individual given the class), e.g. (probClass1, prob1) in
+    15panelDiscrete.py, where prob1 is a PanelLikelihoodTrajectory.
+    Draws (e.g. error components) are integrated out.
+
+    Returns a data frame with one row per individual and one column per
+    class.
+    """
+    formulas = {name: p * L for name, (p, L) in classes.items()}
+    values, index = _simulate(formulas, data, betaValues, panel, **kwargs)
+    names = list(classes.keys())
+    joint = np.stack([values[name] for name in names], axis=1)
+    joint = np.mean(joint, axis=2)
+    posterior = joint / np.sum(joint, axis=1, keepdims=True)
+    return pd.DataFrame(posterior, index=index, columns=names)
@@ -0,0 +1,111 @@
+########################################
+#
+# @file crossvalidation.py
+#
+# Out-of-sample validation by grouped k-fold cross-validation.
+#
+# The groups (individuals, identified by ID) are assigned to k folds,
+# so that all the observations of an individual, and in particular the
+# panel of 12panel.py, are in the same fold. For each fold, the model
+# is estimated on the other folds, and the estimates are used to score
+# the held-out fold.
+#
+# The k estimations are the members of one ModelFamily on the same
+# data frame: each member is restricted to its training rows by a
+# boolean mask, the derived columns are computed once for all the
+# folds, and the members are estimated in parallel threads, all
+# starting from the full sample estimates. The held-out folds are
+# scored by the vectorized evaluator: log likelihood, hit rate (share
+# of observations where the chosen alternative has the highest
+# probability), and calibration (predicted and observed market shares).
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+
+from evaluator import Evaluator
+from family import ModelFamily
+
+# Options of the ModelFamily that the Evaluator does not take
+_familyOptions = ('chunkSize', 'columnCache', 'memoryBudget')
+
+
+def groupFolds(data, group='ID', k=5, seed=None):
+    """Fold (0 to k-1) of each row. The groups are shuffled, and
+    assigned in turn to the fold with the fewest rows so far, so that
+    the folds have about the same number of observations."""
+    codes, counts = np.unique(np.asarray(data[group]), return_inverse=True,
+                              return_counts=True)[1:]
+    rng = np.random.default_rng(seed)
+    foldOfGroup = np.empty(len(counts), dtype=int)
+    sizes = np.zeros(k)
+    for g in rng.permutation(len(counts)):
+        f = int(np.argmin(sizes))
+        foldOfGroup[g] = f
+        sizes[f] += counts[g]
+    return foldOfGroup[codes]
+
+
+def crossValidate(loglike, probabilities, choice, data, group='ID', k=5,
+                  seed=None, start=None, numberOfThreads=None, **kwargs):
+    """Grouped k-fold cross-validation.
+
+    loglike: log likelihood of each row (or individual for a panel),
+    as estimated.
+    probabilities: dict associating each alternative with the
+    expression of its choice probability (unconditional on the draws,
+    e.g. MonteCarlo(models.logit(V, av, 1))), used for the hit rate and
+    the calibration.
+    choice: expression of the chosen alternative, e.g. CHOICE.
+    data: the data frame, e.g. database.data.
+    group: column identifying the groups kept in the same fold.
+    start: dict of starting values, typically the full sample
+    estimates (results.getBetaValues()).
+    numberOfThreads: number of folds estimated in parallel (k if None).
+    kwargs: passed to ModelFamily (chunkSize, memoryBudget...) and,
+    except the options of the family, to the Evaluator scoring the
+    held-out folds (definitions, panel, numberOfDraws, seed...).
+
+    Returns a data frame with one row per fold, and the dict of the
+    EstimationResults of the folds.
+    """
+    folds = groupFolds(data, group, k, seed)
+    family = ModelFamily(data, **kwargs)
+    for f in range(k):
+        family.add(f'fold {f}', loglike, sample=folds != f)
+    results = family.estimate(numberOfThreads or k, start=start)
+    alternatives = list(probabilities)
+    formulas = {'loglike': loglike, 'choice': choice}
+    formulas.update({('P', j): p for j, p in probabilities.items()})
+    scoring = Evaluator(formulas, **{k: v for k, v in kwargs.items()
+                                     if k not in _familyOptions})
+    panel = kwargs.get('panel')
+    table = []
+    for f in range(k):
+        heldOut = data[folds == f]
+        values = scoring.evaluate(heldOut,
+                                  results[f'fold {f}'].getBetaValues())
+        P = np.column_stack([values[('P', j)] for j in alternatives])
+        chosen = np.asarray(values['choice'])[:, None] == \
+            np.asarray(alternatives)[None, :]
+        logLike = float(np.sum(values['loglike']))
+        units = len(values['loglike'])
+        row = {'fold': f,
+               'training observations': int(np.sum(folds != f)),
+               'held-out observations': len(heldOut),
+               'training logLike': results[f'fold {f}'].data.logLike,
+               'held-out logLike': logLike,
+               'held-out logLike per observation': logLike / len(heldOut),
+               'hit rate': float(np.mean(
+                   chosen[np.arange(len(P)), np.argmax(P, axis=1)]))}
+        if panel is not None:
+            row['held-out individuals'] = units
+        for j, alternative in enumerate(alternatives):
+            row[f'predicted share {alternative}'] = float(np.mean(P[:, j]))
+            row[f'observed share {alternative}'] = float(
+                np.mean(chosen[:, j]))
+        row['calibration error'] = float(np.sum(np.abs(
+            np.mean(P, axis=0) - np.mean(chosen, axis=0))))
+        table.append(row)
+    return pd.DataFrame(table).set_index('fold'), results
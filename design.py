@@ -0,0 +1,108 @@
+########################################
+#
+# @file design.py
+#
+# Utilities, availabilities and choices of a model as arrays.
+#
+# The specialized estimators (probit.py, ordinal.py, ...) take the
+# same dictionaries V and av as the functions of biogeme.models, and
+# work on the arrays V (rows x alternatives) and dV/dbeta (rows x
+# alternatives x parameters) computed here by the vectorized
+# evaluator.
+#
+#######################################
+
+import numpy as np
+
+from evaluator import Evaluator
+
+
+class FormulaArrays:
+    """Formulas depending on the parameters, evaluated on data as an
+    array (rows x formulas), with their Jacobian (rows x formulas x
+    parameters).
+
+    When the Jacobian does not depend on the parameters (formulas
+    linear in the parameters, as most utilities of the tutorial), it is
+    computed once and reused.
+    """
+
+    def __init__(self, formulas, data, definitions=None):
+        self.keys = list(formulas.keys())
+        self.evaluator = Evaluator(formulas, definitions=definitions)
+        self.data = data
+        betas = self.evaluator.betas
+        self.names = self.evaluator.freeBetas()
+        self.start = np.array([betas[n].initValue for n in self.names],
+                              dtype=float)
+        self.bounds = [(betas[n].lb, betas[n].ub) for n in self.names]
+        self._jacobian = None
+        self.linear = self._isLinear()
+
+    def _evaluate(self, beta, jacobian):
+        betaValues = dict(zip(self.names, beta))
+        result = self.evaluator.evaluate(self.data, betaValues,
+                                         gradient=jacobian)
+        values, grads = result if jacobian else (result, None)
+        F = np.column_stack([values[k] for k in self.keys])
+        if not jacobian:
+            return F, None
+        dF = np.stack([grads[k] for k in self.keys], axis=1)
+        return F, dF
+
+    def _isLinear(self):
+        _, dF0 = self._evaluate(self.start, True)
+        _, dF1 = self._evaluate(self.start + 0.5 + np.arange(len(self.names)),
+                                True)
+        if np.array_equal(dF0, dF1):
+            self._jacobian = dF0
+            return True
+        return False
+
+    def __call__(self, beta, jacobian=False):
+        if jacobian and self._jacobian is not None:
+            F, _ = self._evaluate(beta, False)
+            return F, self._jacobian
+        return self._evaluate(beta, jacobian)
+
+
+class UtilitySpecification:
+    """V, av and choice of a model, evaluated on data.
+
+    V: dict associating each alternative with its utility.
+    av: dict associating each alternative with its availability, or
+    None if all alternatives are always available.
+    choice: expression of the chosen alternative (e.g. CHOICE).
+    data: pandas data frame, typically database.data.
+    """
+
+    def __init__(self, V, av, choice, data, definitions=None):
+        self.alternatives = list(V.keys())
+        self.formulas = FormulaArrays(V, data, definitions)
+        fixed = {('choice',): choice}
+        if av is not None:
+            fixed.update({('av', i): av[i] for i in self.alternatives})
+        values = Evaluator(fixed, definitions=definitions).evaluate(data)
+        self.data = data
+        self.size = len(values[('choice',)])
+        chosen = values[('choice',)]
+        self.choice = np.full(self.size, -1, dtype=np.intp)
+        for j, i in enumerate(self.alternatives):
+            self.choice[chosen == i] = j
+        if np.any(self.choice < 0):
+            raise ValueError("Some observations choose an alternative "
+                             "that is not in V")
+        if av is None:
+            self.av = np.ones((self.size, len(self.alternatives)), dtype=bool)
+        else:
+            self.av = np.column_stack([values[('av', i)] != 0
+                                       for i in self.alternatives])
+        self.names = self.formulas.names
+        self.start = self.formulas.start
+        self.bounds = self.formulas.bounds
+        self.linear = self.formulas.linear
+
+    def utilities(self, beta, jacobian=False):
+        """Array of utilities (rows x alternatives) and, if requested,
+        their derivatives (rows x alternatives x parameters)."""
+        return self.formulas(beta, jacobian)
@@ -0,0 +1,352 @@
+########################################
+#
+# @file estimation.py
+#
+# Maximum likelihood estimation for the specialized estimators.
+#
+# A model is an object with
+#   names: list of the parameters,
+#   start: starting values (numpy array),
+#   bounds: list of (lower, upper), None meaning unbounded,
+#   loglikelihood(x): log likelihood and its gradient,
+#   scores(x): per observation gradients (observations x parameters),
+#              optional, used for the robust covariance matrix,
+#   hessian(x): analytic second derivatives, optional. Otherwise,
+#               they are obtained by finite differences of the gradient.
+#   exactHessian: False if hessian(x) is an approximation, good enough
+#               for the optimizer but not for the covariance matrix.
+#               Optional, True by default.
+#
+# The results mimic those of biogeme.estimate(): results.data holds
+# the statistics and getEstimatedParameters() the table of estimates.
+#
+#######################################
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, stats
+
+from checkpoint import Tracker, loadCheckpoint, restoreState
+
+# Algorithms handling bounds. The others are replaced by L-BFGS-B for
+# models with bounds.
+BOUNDED_ALGORITHMS = ('L-BFGS-B', 'TNC', 'SLSQP', 'trust-constr', 'BHHH')
+
+
+def finiteDifferenceHessian(gradient, x, step=1e-6, numberOfThreads=None):
+    """Hessian obtained by central differences of the analytic
+    gradient, symmetrized. With numberOfThreads larger than 1, the
+    columns are computed in parallel threads (gradient must then be
+    thread safe)."""
+    k = len(x)
+
+    def column(i):
+        h = step * max(1.0, abs(x[i]))
+        xp = x.copy()
+        xm = x.copy()
+        xp[i] += h
+        xm[i] -= h
+        return (gradient(xp) - gradient(xm)) / (2 * h)
+
+    if numberOfThreads is not None and numberOfThreads > 1:
+        with ThreadPoolExecutor(numberOfThreads) as executor:
+            columns = list(executor.map(column, range(k)))
+    else:
+        columns = [column(i) for i in range(k)]
+    H = np.column_stack(columns) if k else np.zeros((0, 0))
+    return 0.5 * (H + H.T)
+
+
+def _inverse(M):
+    try:
+        return np.linalg.inv(M)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(M)
+
+
+class EstimationResults:
+    """Estimates, statistics and covariance matrices."""
+
+    def __init__(self, model, x, logLike, g, H, scores=None,
+                 initLogLike=None, **info):
+        d = SimpleNamespace()
+        d.modelName = getattr(model, 'modelName', None)
+        d.betaNames = list(model.names)
+        d.betaValues = np.asarray(x, dtype=float)
+        d.nparam = len(x)
+        d.logLike = float(logLike)
+        d.initLogLike = initLogLike
+        d.g = g
+        d.gradientNorm = float(np.linalg.norm(g))
+        d.H = H
+        d.varCovar = _inverse(-H)
+        d.bhhh = None
+        d.bhhh_varCovar = None
+        d.robust_varCovar = None
+        if scores is not None:
+            d.bhhh = scores.T @ scores
+            d.bhhh_varCovar = _inverse(d.bhhh)
+            d.robust_varCovar = d.varCovar @ d.bhhh @ d.varCovar
+            d.sampleSize = scores.shape[0]
+        else:
+            d.sampleSize = getattr(model, 'size', None)
+        if initLogLike is not None:
+            d.rhoSquare = 1 - d.logLike / initLogLike
+            d.rhoBarSquare = 1 - (d.logLike - d.nparam) / initLogLike
+        d.akaike = 2 * d.nparam - 2 * d.logLike
+        if d.sampleSize:
+            d.bayesian = d.nparam * np.log(d.sampleSize) - 2 * d.logLike
+        for k, v in info.items():
+            setattr(d, k, v)
+        self.data = d
+
+    def getBetaValues(self):
+        return dict(zip(self.data.betaNames, self.data.betaValues))
+
+    def getVarCovar(self):
+        return pd.DataFrame(self.data.varCovar, index=self.data.betaNames,
+                            columns=self.data.betaNames)
+
+    def getEstimatedParameters(self):
+        d = self.data
+        stdErr = np.sqrt(np.maximum(np.diag(d.varCovar), 0))
+        table = pd.DataFrame({'Value': d.betaValues, 'Std err': stdErr},
+                             index=d.betaNames)
+        table['t-test'] = table['Value'] / table['Std err']
+        table['p-value'] = 2 * stats.norm.sf(np.abs(table['t-test']))
+        if d.robust_varCovar is not None:
+            robErr = np.sqrt(np.maximum(np.diag(d.robust_varCovar), 0))
+            table['Rob. Std err'] = robErr
+            table['Rob. t-test'] = table['Value'] / robErr
+            table['Rob. p-value'] = 2 * stats.norm.sf(
+                np.abs(table['Rob. t-test']))
+        if getattr(d, 'bootstrap_varCovar', None) is not None:
+            bootErr = np.sqrt(np.maximum(np.diag(d.bootstrap_varCovar), 0))
+            table['Bootstrap std err'] = bootErr
+            table['Bootstrap t-test'] = table['Value'] / bootErr
+            table['Bootstrap p-value'] = 2 * stats.norm.sf(
+                np.abs(table['Bootstrap t-test']))
+        return table
+
+    def __str__(self):
+        d = self.data
+        lines = [f"Model: {d.modelName}",
+                 f"Sample size: {d.sampleSize}",
+                 f"Final log likelihood: {d.logLike:.3f}",
+                 f"Number of parameters: {d.nparam}",
+                 f"Gradient norm: {d.gradientNorm:.3g}"]
+        if d.initLogLike is not None:
+            lines.append(f"Rho-square-bar: {d.rhoBarSquare:.3f}")
+        lines.append(str(self.getEstimatedParameters()))
+        return '\n'.join(lines)
+
+
+def _limits(bounds, k):
+    if bounds is None:
+        return np.full(k, -np.inf), np.full(k, np.inf)
+    lower = np.array([-np.inf if b[0] is None else b[0] for b in bounds],
+                     dtype=float)
+    upper = np.array([np.inf if b[1] is None else b[1] for b in bounds],
+                     dtype=float)
+    return lower, upper
+
+
+def relativeGradient(x, L, g):
+    """Stopping criterion of biogeme: largest relative derivative."""
+    return float(np.max(np.abs(g) * np.maximum(np.abs(x), 1.0),
+                        initial=0.0) / max(abs(L), 1.0))
+
+
+def bhhh(model, x0, bounds=None, options=None, callback=None):
+    """Maximize the log likelihood with the BHHH algorithm: the outer
+    product of the scores (model.scores) replaces minus the Hessian in
+    Newton steps, followed by a backtracking line search. Bounds are
+    handled by projection, and the parameters at a bound with a
+    gradient pointing outside are fixed for the iteration.
+
+    options: maxiter (default 1000), gtol (relative gradient, default
+    6.06e-6 as in biogeme).
+    callback: called after each iteration with an OptimizeResult, as
+    by scipy.optimize.minimize: x, fun, and gradient, the gradient of
+    the log likelihood (not jac, which is a list of constraint
+    Jacobians for trust-constr).
+
+    Returns a scipy.optimize.OptimizeResult (of the minimization of
+    minus the log likelihood)."""
+    options = {} if options is None else options
+    maxiter = options.get('maxiter', 1000)
+    gtol = options.get('gtol', 6.06e-6)
+    lower, upper = _limits(bounds, len(x0))
+    x = np.clip(np.asarray(x0, dtype=float), lower, upper)
+    L, g = model.loglikelihood(x)
+    nfev = 1
+    nscores = 0
+    message = 'Maximum number of iterations reached'
+    success = False
+    nit = 0
+    for nit in range(1, maxiter + 1):
+        if relativeGradient(x, L, g) <= gtol:
+            message = 'Relative gradient below tolerance'
+            success = True
+            break
+        S = model.scores(x)
+        nscores += 1
+        free = ~(((x <= lower) & (g < 0)) | ((x >= upper) & (g > 0)))
+        B = S[:, free].T @ S[:, free]
+        d = np.zeros(len(x))
+        d[free] = np.linalg.lstsq(B, g[free], rcond=None)[0]
+        step = 1.0
+        while True:
+            y = np.clip(x + step * d, lower, upper)
+            Ly, gy = model.loglikelihood(y)
+            nfev += 1
+            if np.isfinite(Ly) and Ly >= L + 1e-4 * g @ (y - x):
+                break
+            step /= 2
+            if step < 1e-12:
+                break
+        if step < 1e-12:
+            message = 'Line search failed'
+            break
+        x, L, g = y, Ly, gy
+        if callback is not None:
+            callback(optimize.OptimizeResult(x=x, fun=-L, gradient=g))
+    return optimize.OptimizeResult(x=x, fun=-L, jac=-g, nit=nit, nfev=nfev,
+                                   nscores=nscores, success=success,
+                                   message=message)
+
+
+def estimate(model, x0=None, algorithm='L-BFGS-B', options=None,
+             hessian=None, numberOfThreads=None, checkpoint=None,
+             resume=False, monitor=None):
+    """Maximize the log likelihood of model, starting from x0 (default:
+    model.start), with a scipy.optimize algorithm, or 'BHHH' (see
+    bhhh, the model must provide scores).
+
+    The second derivatives, for the covariance matrix, are computed
+    once, at the optimum:
+    hessian: 'analytic' (model.hessian), 'finite' (finite differences
+    of the analytic gradient, computed by numberOfThreads threads) or
+    'bhhh' (outer product of the scores, no second derivatives). By
+    default, 'analytic' if the model provides exact second derivatives,
+    'finite' otherwise.
+
+    The scores at the optimum give both the classical and the robust
+    (sandwich) covariance matrices.
+
+    checkpoint: file where the state of the optimizer is written after
+    each iteration (see checkpoint.py).
+    resume: True to restart from the state in the checkpoint file, if
+    it exists, or the name of another checkpoint file. The draws are
+    generated from the seed of the checkpoint.
+
+    monitor: instrumentation.Monitor recording the evaluations and the
+    iterations, or None."""
+    if monitor is not None:
+        model = monitor.wrap(model)
+    x0 = np.array(model.start if x0 is None else x0, dtype=float)
+    bounds = getattr(model, 'bounds', None)
+    if bounds is not None and all(b == (None, None) for b in bounds):
+        bounds = None
+    method = algorithm
+    if bounds is not None and method not in BOUNDED_ALGORITHMS:
+        method = 'L-BFGS-B'
+    state = None
+    if resume:
+        state = loadCheckpoint(checkpoint if resume is True else resume)
+    options = {} if options is None else dict(options)
+    if state is not None:
+        restoreState(model, state)
+        x0 = np.asarray(state['x'], dtype=float)
+        if 'maxiter' in options:
+            options['maxiter'] = max(options['maxiter'] - state['iteration'],
+                                     0)
+        if method == state['algorithm'] == 'BFGS' and \
+                state['inverseHessian'] is not None:
+            H = state['inverseHessian']
+            # scipy requires an exactly symmetric matrix
+            options['hess_inv0'] = 0.5 * (H + H.T)
+        if method == state['algorithm'] == 'trust-constr' and \
+                state['trustRadius'] is not None:
+            options['initial_tr_radius'] = state['trustRadius']
+    tracker = None
+    if checkpoint is not None:
+        tracker = Tracker(model, checkpoint, method,
+                          state if state is not None and
+                          state['algorithm'] == method else None)
+    loglikelihood = model.loglikelihood if tracker is None \
+        else tracker.loglikelihood
+    callbacks = [c.callback if c is tracker else c.iteration
+                 for c in (tracker, monitor) if c is not None]
+
+    def _callback(intermediate_result):
+        for c in callbacks:
+            c(intermediate_result)
+    callback = _callback if callbacks else None
+    start = time.perf_counter()
+    # As in biogeme, the initial log likelihood is at the starting
+    # values of the model, even if the estimation starts elsewhere
+    initLogLike, _ = model.loglikelihood(np.asarray(model.start,
+                                                    dtype=float))
+
+    def f(x):
+        L, g = loglikelihood(x)
+        return -L, -g
+
+    def _hess(x):
+        return -model.hessian(x)
+    hess = _hess if hasattr(model, 'hessian') and method in (
+        'Newton-CG', 'dogleg', 'trust-ncg', 'trust-krylov', 'trust-exact',
+        'trust-constr') else None
+    if monitor is not None:
+        monitor.begin(x0)
+    if method == 'BHHH':
+        opt = bhhh(model, x0, bounds, options, callback)
+    else:
+        opt = optimize.minimize(f, x0, jac=True, hess=hess, method=method,
+                                bounds=bounds, options=options,
+                                callback=callback)
+    optimizationTime = time.perf_counter() - start
+    x = opt.x
+    L, g = model.loglikelihood(x)
+    scores = model.scores(x) if hasattr(model, 'scores') else None
+    if hessian is None:
+        exact = hasattr(model, 'hessian') and \
+            getattr(model, 'exactHessian', True)
+        hessian = 'analytic' if exact else 'finite'
+    start = time.perf_counter()
+    if hessian == 'analytic':
+        H = model.hessian(x)
+    elif hessian == 'finite':
+        H = finiteDifferenceHessian(lambda y: model.loglikelihood(y)[1], x,
+                                    numberOfThreads=numberOfThreads)
+    elif hessian == 'bhhh':
+        if scores is None:
+            raise ValueError("The BHHH matrix requires the scores")
+        H = -scores.T @ scores
+    else:
+        raise ValueError(f"Unknown type of second derivatives: {hessian}")
+    hessianTime = time.perf_counter() - start
+    return EstimationResults(model, x, L, g, H, scores,
+                             initLogLike=initLogLike,
+                             optimizationMessages={
+                                 'Algorithm': method,
+                                 'Message': opt.message,
+                                 'Number of iterations':
+                                 None if opt.get('nit') is None else
+                                 opt.get('nit') + (0 if state is None else
+                                                   state['iteration']),
+                                 'Resumed from iteration':
+                                 None if state is None else
+                                 state['iteration'],
+                                 'Number of function evaluations':
+                                 opt.get('nfev'),
+                                 'Optimization time': optimizationTime,
+                                 'Second derivatives': hessian,
+                                 'Second derivatives time': hessianTime},
+                             numberOfThreads=getattr(model,
+                                                     'numberOfThreads', 1))
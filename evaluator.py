@@ -0,0 +1,603 @@
+########################################
+#
+# @file evaluator.py
+#
+# Vectorized evaluation of biogeme expressions with numpy.
+#
+# The formulas are compiled once into a flat program: a list of
+# operations in topological order, each reading the results of
+# earlier operations. Evaluating the program on a data frame applies
+# one numpy operation per node over all the rows (and draws) at once.
+# A node shared by several formulas (the same Python object) is
+# compiled once. Moreover, operations are hash-consed: an operation
+# with the same kind, arguments and payload as an earlier one (e.g.
+# SM_CO * (GA == 0) written in several utilities) reuses its slot, so
+# that each distinct subexpression of all the formulas is evaluated
+# once.
+#
+# Row-level quantities have shape (rows, 1), quantities involving
+# draws have shape (rows, draws). MonteCarlo averages over the draws
+# and PanelLikelihoodTrajectory multiplies the rows of each
+# individual.
+#
+#######################################
+
+import numpy as np
+
+
+class Op:
+    """One node of a compiled program."""
+
+    __slots__ = ('kind', 'args', 'payload')
+
+    def __init__(self, kind, args=(), payload=None):
+        self.kind = kind
+        self.args = tuple(args)
+        self.payload = payload
+
+    def __repr__(self):
+        return f"Op({self.kind}, {self.args}, {self.payload!r})"
+
+
+_binary = {'Plus': 'add',
+           'Minus': 'sub',
+           'Times': 'mul',
+           'Divide': 'div',
+           'Power': 'pow',
+           'And': 'and',
+           'Or': 'or',
+           'Equal': 'eq',
+           'NotEqual': 'ne',
+           'Less': 'lt',
+           'LessOrEqual': 'le',
+           'Greater': 'gt',
+           'GreaterOrEqual': 'ge',
+           'bioMin': 'min',
+           'bioMax': 'max'}
+
+_logitClasses = {'LogitLike', 'LogLogit', 'bioLogLogit'}
+
+_unary = {'UnaryMinus': 'neg',
+          'exp': 'exp',
+          'log': 'log',
+          'bioNormalCdf': 'normcdf',
+          'MonteCarlo': 'mc',
+          'PanelLikelihoodTrajectory': 'panel'}
+
+
+def _expressionKind(expr):
+    """Name of the biogeme class of expr, without a leading underscore.
+    The logit classes (bioLogLogit in biogeme 3.1, _bioLogLogit and
+    _bioLogLogitFullChoiceSet in 3.2) are identified by their base
+    class, as 'LogLogit'."""
+    if any(c.__name__ in _logitClasses for c in type(expr).__mro__):
+        return 'LogLogit'
+    return type(expr).__name__.lstrip('_')
+
+
+def _normcdf(x):
+    from scipy.special import ndtr
+    return ndtr(x)
+
+
+_functions = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'div': np.divide,
+    'pow': np.power,
+    'and': lambda a, b: 1.0 * ((a != 0) & (b != 0)),
+    'or': lambda a, b: 1.0 * ((a != 0) | (b != 0)),
+    'eq': lambda a, b: 1.0 * (a == b),
+    'ne': lambda a, b: 1.0 * (a != b),
+    'lt': lambda a, b: 1.0 * (a < b),
+    'le': lambda a, b: 1.0 * (a <= b),
+    'gt': lambda a, b: 1.0 * (a > b),
+    'ge': lambda a, b: 1.0 * (a >= b),
+    'min': np.minimum,
+    'max': np.maximum,
+    'neg': np.negative,
+    'exp': np.exp,
+    'log': np.log,
+    'normcdf': _normcdf,
+}
+
+
+def _uniformSym(rng, size):
+    return rng.uniform(-1, 1, size=size)
+
+
+defaultDrawGenerators = {
+    'NORMAL': lambda rng, size: rng.standard_normal(size),
+    'UNIFORM': lambda rng, size: rng.uniform(0, 1, size=size),
+    'UNIFORMSYM': _uniformSym,
+}
+
+
+_commutative = {'add', 'mul', 'and', 'or', 'eq', 'ne', 'min', 'max'}
+
+
+def _hashable(payload):
+    if isinstance(payload, list):
+        return tuple(payload)
+    return payload
+
+
+def numberOfRows(data):
+    if hasattr(data, 'shape'):
+        return data.shape[0]
+    return len(next(iter(data.values()))) if len(data) > 0 else 0
+
+
+def isNumeric(x):
+    return isinstance(x, (int, float, np.integer, np.floating))
+
+
+class Evaluator:
+    """Compile biogeme formulas and evaluate them on data.
+
+    formulas: an expression, or a dict associating names with
+    expressions (like the argument of bio.BIOGEME).
+    definitions: dict associating the name of a DefineVariable with
+    its defining expression. Without it, the column must be present in
+    the data, as it is in database.data after DefineVariable.
+    drawGenerators: dict associating a draw type with a function of
+    the size, as passed to database.setRandomNumberGenerators.
+    panel: name of the column identifying individuals, when the data
+    is organized as a panel (see database.panel). The rows of each
+    individual must be contiguous.
+    cse: if True, structurally identical subexpressions are evaluated
+    once (common subexpression elimination).
+    """
+
+    def __init__(self, formulas, definitions=None, numberOfDraws=1000,
+                 seed=None, drawGenerators=None, panel=None, cse=True):
+        if not isinstance(formulas, dict):
+            formulas = {'loglike': formulas}
+        self.definitions = {} if definitions is None else definitions
+        self.numberOfDraws = numberOfDraws
+        self.seed = seed
+        self.drawGenerators = {} if drawGenerators is None else drawGenerators
+        self.panel = panel
+        self.ops = []
+        self.betas = {}
+        self.variables = set()
+        self.drawTypes = {}
+        self.cse = cse
+        self._slots = {}
+        self._structures = {}
+        self.sharedNodes = 0
+        self.mergedNodes = 0
+        self.outputs = {k: self._compile(f) for k, f in formulas.items()}
+        self._draws = None
+        # True if the draws come from biogeme (see useDatabaseDraws)
+        self.givenDraws = False
+        self._subgraphs = {}
+        # NodeProfiler timing the operations (see profiler.py), or None
+        self.profiler = None
+
+    # Compilation
+
+    def _emit(self, op):
+        if self.cse:
+            args = op.args
+            if op.kind in _commutative:
+                args = tuple(sorted(args))
+            key = (op.kind, args, _hashable(op.payload))
+            if key in self._structures:
+                self.mergedNodes += 1
+                return self._structures[key]
+            op.args = args
+        self.ops.append(op)
+        slot = len(self.ops) - 1
+        if self.cse:
+            self._structures[key] = slot
+        return slot
+
+    def _compile(self, expr):
+        if isNumeric(expr):
+            return self._emit(Op('const', payload=float(expr)))
+        key = id(expr)
+        if key in self._slots:
+            self.sharedNodes += 1
+            return self._slots[key]
+        slot = self._compileNode(expr)
+        self._slots[key] = slot
+        return slot
+
+    def _compileNode(self, expr):
+        kind = _expressionKind(expr)
+        if kind == 'Numeric':
+            return self._emit(Op('const', payload=float(expr.value)))
+        if kind == 'Beta':
+            self.betas[expr.name] = expr
+            return self._emit(Op('beta', payload=expr.name))
+        if kind in ('Variable', 'DefineVariable'):
+            if expr.name in self.definitions:
+                return self._compile(self.definitions[expr.name])
+            self.variables.add(expr.name)
+            return self._emit(Op('var', payload=expr.name))
+        if kind == 'bioDraws':
+            # type up to biogeme 3.2.5, drawType since 3.2.6
+            self.drawTypes[expr.name] = (getattr(expr, 'type', None) or
+                                         expr.drawType)
+            return self._emit(Op('draw', payload=expr.name))
+        if kind in _binary:
+            a = self._compile(expr.left)
+            b = self._compile(expr.right)
+            return self._emit(Op(_binary[kind], (a, b)))
+        if kind in _unary:
+            a = self._compile(expr.child)
+            return self._emit(Op(_unary[kind], (a,)))
+        if kind == 'Elem':
+            keys = list(expr.dictOfExpressions.keys())
+            k = self._compile(expr.keyExpression)
+            args = [self._compile(expr.dictOfExpressions[i]) for i in keys]
+            return self._emit(Op('elem', [k] + args, keys))
+        if kind == 'LogLogit':
+            keys = list(expr.util.keys())
+            choice = self._compile(expr.choice)
+            util = [self._compile(expr.util[i]) for i in keys]
+            if expr.av is None:
+                av = [self._compile(1.0) for i in keys]
+            else:
+                av = [self._compile(expr.av[i]) for i in keys]
+            return self._emit(Op('loglogit', [choice] + util + av, keys))
+        if kind == 'Derive':
+            a = self._compile(expr.child)
+            # literalName in biogeme 3.1, elementaryName since 3.2
+            name = getattr(expr, 'elementaryName', None) or expr.literalName
+            return self._emit(Op('derive', (a,), name))
+        if kind == 'bioMultSum':
+            return self._emit(Op('sum', [self._compile(t)
+                                         for t in expr.children]))
+        raise ValueError(f"Expression {kind} is not supported by the "
+                         f"vectorized evaluator: {expr}")
+
+    def statistics(self):
+        """Number of operations of the program, and number of nodes of
+        the formulas that did not need one: references to a Python
+        object already compiled (shared), and subexpressions identical
+        to an earlier one (merged)."""
+        return {'operations': len(self.ops),
+                'shared': self.sharedNodes,
+                'merged': self.mergedNodes}
+
+    # Data
+
+    def panelOffsets(self, data):
+        """First row of each individual of a panel (the rows of each
+        individual being contiguous)."""
+        ids = np.asarray(data[self.panel])
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate(([0], np.flatnonzero(ids[1:] != ids[:-1]) + 1))
+
+    def useDatabaseDraws(self, database, names=None):
+        """Use the draws generated by biogeme in database (by
+        bio.BIOGEME, for an estimation or a simulation) instead of
+        generating new ones.
+
+        database.theDraws is an array (units x draws x variables).
+        names: the draw variables of its last dimension, in order. By
+        default, the sorted names of the draws of this evaluator, which
+        is the order of biogeme when the formulas given to BIOGEME
+        involve the same draws.
+        """
+        theDraws = getattr(database, 'theDraws', None)
+        if theDraws is None:
+            raise ValueError("The database has no draws: they are "
+                             "generated by bio.BIOGEME")
+        names = sorted(self.drawTypes) if names is None else list(names)
+        if len(names) != theDraws.shape[2]:
+            raise ValueError(f"The database has {theDraws.shape[2]} draw "
+                             f"variables, and {len(names)} names are given")
+        missing = set(self.drawTypes) - set(names)
+        if missing:
+            raise ValueError(f"No draws in the database for {missing}")
+        self.numberOfDraws = theDraws.shape[1]
+        self._draws = (theDraws.shape[0],
+                       {name: theDraws[:, :, k]
+                        for k, name in enumerate(names)})
+        self.givenDraws = True
+
+    def generateDraws(self, n):
+        """Draws for n statistical units (individuals for a panel,
+        rows otherwise). They are kept and reused as long as the
+        number of units does not change, so that the simulated
+        likelihood is a smooth function of the parameters."""
+        if self._draws is not None and self._draws[0] == n:
+            return self._draws[1]
+        if self.givenDraws:
+            raise ValueError(f"The draws of the database are for "
+                             f"{self._draws[0]} units, not {n}")
+        if self.seed is None:
+            # Random draws, but the seed is kept so that they can be
+            # generated again (see checkpoint.py)
+            self.seed = int(np.random.SeedSequence().entropy)
+        rng = np.random.default_rng(self.seed)
+        draws = {}
+        for name, drawType in sorted(self.drawTypes.items()):
+            size = (n, self.numberOfDraws)
+            if drawType in self.drawGenerators:
+                draws[name] = np.asarray(self.drawGenerators[drawType](size))
+            elif drawType in defaultDrawGenerators:
+                draws[name] = defaultDrawGenerators[drawType](rng, size)
+            else:
+                raise ValueError(f"Unknown type of draws: {drawType}")
+        self._draws = (n, draws)
+        return draws
+
+    def _context(self, data, betaValues):
+        betas = {name: float(b.initValue) for name, b in self.betas.items()}
+        if betaValues is not None:
+            betas.update({k: float(v) for k, v in betaValues.items()
+                          if k in betas})
+        rows = numberOfRows(data)
+        offsets = None
+        units = rows
+        if self.panel is not None:
+            offsets = self.panelOffsets(data)
+            units = len(offsets)
+        draws = {}
+        if self.drawTypes:
+            allDraws = self.generateDraws(units)
+            if offsets is not None:
+                unitOfRow = np.repeat(np.arange(units),
+                                      np.diff(np.append(offsets, rows)))
+                draws = {k: d[unitOfRow] for k, d in allDraws.items()}
+            else:
+                draws = allDraws
+        return {'data': data, 'betas': betas, 'draws': draws,
+                'offsets': offsets, 'rows': rows}
+
+    # Evaluation
+
+    def _apply(self, op, values, ctx):
+        kind = op.kind
+        if kind == 'const':
+            return op.payload
+        if kind == 'beta':
+            return ctx['betas'][op.payload]
+        if kind == 'var':
+            return np.asarray(ctx['data'][op.payload],
+                              dtype=float).reshape(-1, 1)
+        if kind == 'draw':
+            return ctx['draws'][op.payload]
+        args = [values[a] for a in op.args]
+        if kind in _functions:
+            return _functions[kind](*args)
+        if kind == 'mc':
+            return np.mean(args[0], axis=-1, keepdims=True)
+        if kind == 'panel':
+            x = np.broadcast_to(args[0], (ctx['rows'], np.shape(args[0])[-1]))
+            return np.multiply.reduceat(x, ctx['offsets'], axis=0)
+        if kind == 'elem':
+            key = args[0]
+            return np.select([key == k for k in op.payload], args[1:],
+                             default=np.nan)
+        if kind == 'loglogit':
+            return loglogit(op.payload, args)
+        if kind == 'sum':
+            return sum(args)
+        if kind == 'derive':
+            seeds = {s: 1.0 for s in self.subgraph(op.args[0])
+                     if self.ops[s].kind in ('var', 'beta')
+                     and self.ops[s].payload == op.payload}
+            t = self.tangent(op.args[0], values, ctx, seeds)
+            return 0.0 if t is None else t
+        raise ValueError(f"Unknown operation {kind}")
+
+    def _value(self, i, values, ctx):
+        """Value of slot i, through the profiler if any."""
+        if self.profiler is None:
+            return self._apply(self.ops[i], values, ctx)
+        return self.profiler.apply(i, values, ctx)
+
+    def run(self, ctx):
+        """Execute the program and return the value of each slot."""
+        values = [None] * len(self.ops)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for i in range(len(self.ops)):
+                values[i] = self._value(i, values, ctx)
+        return values
+
+    def evaluate(self, data, betaValues=None, gradient=False):
+        """Value of each formula on each row of data (a pandas data
+        frame or a dict of columns), for the given values of the
+        parameters. The initial values of the Beta are used for the
+        parameters that are not provided.
+
+        If gradient is True, the derivatives with respect to the free
+        parameters (see freeBetas) are also returned, as a second
+        dict."""
+        ctx = self._context(data, betaValues)
+        values = self.run(ctx)
+        result = {k: self._output(values[s], ctx)
+                  for k, s in self.outputs.items()}
+        if gradient:
+            return result, self.gradient(values, ctx)
+        return result
+
+    @staticmethod
+    def _output(value, ctx):
+        n = ctx['rows'] if ctx['offsets'] is None else len(ctx['offsets'])
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 2 and value.shape[1] == 1:
+            value = value[:, 0]
+        if value.ndim == 0 and n is not None:
+            value = np.full(n, float(value))
+        return value
+
+    # Derivatives
+
+    def subgraph(self, slot):
+        """Slots on which slot depends, itself included, in the order
+        of the program."""
+        if slot not in self._subgraphs:
+            reached = {slot}
+            for i in range(slot, -1, -1):
+                if i in reached:
+                    reached.update(self.ops[i].args)
+            self._subgraphs[slot] = sorted(reached)
+        return self._subgraphs[slot]
+
+    def tangent(self, slot, values, ctx, seeds):
+        """Directional derivative of a slot, by forward propagation.
+
+        seeds: dict associating leaf slots (variables or parameters)
+        with their tangent. None is returned if the slot does not
+        depend on any of them."""
+        return self.tangents([slot], values, ctx, seeds).get(slot)
+
+    def tangents(self, slots, values, ctx, seeds, order=None):
+        """Same as tangent, for several slots in one pass. Returns a
+        dict associating each slot depending on the seeds with its
+        tangent. order: slots to propagate through (default: the
+        subgraphs of slots), e.g. to start from seeds inside the graph."""
+        if order is not None:
+            pass
+        elif len(slots) == 1:
+            order = self.subgraph(slots[0])
+        else:
+            order = sorted(set().union(*[self.subgraph(s) for s in slots]))
+        tangents = {}
+        for i in order:
+            if i in seeds:
+                tangents[i] = seeds[i]
+                continue
+            op = self.ops[i]
+            targs = [tangents.get(a) for a in op.args]
+            if all(t is None for t in targs):
+                continue
+            if op.kind == 'derive':
+                raise ValueError("Nested derivatives are not supported")
+            args = [values[a] for a in op.args]
+            with np.errstate(divide='ignore', invalid='ignore',
+                             over='ignore'):
+                if self.profiler is None:
+                    t = _tangentRule(op, args, targs, values[i], ctx)
+                else:
+                    t = self.profiler.tangent(i, args, targs, values[i],
+                                              ctx)
+            if t is not None:
+                tangents[i] = t
+        return tangents
+
+    def freeBetas(self):
+        """Names of the parameters to be estimated (status 0), sorted."""
+        return sorted(name for name, b in self.betas.items()
+                      if b.status == 0)
+
+    def gradient(self, values, ctx, names=None):
+        """Derivatives of each formula with respect to the parameters,
+        given the values computed by run. Returns a dict associating
+        each formula with an array (rows x parameters)."""
+        if names is None:
+            names = self.freeBetas()
+        slots = list(self.outputs.values())
+        n = ctx['rows'] if ctx['offsets'] is None else len(ctx['offsets'])
+        grads = {k: np.zeros((n, len(names))) for k in self.outputs}
+        for j, name in enumerate(names):
+            seeds = {i: 1.0 for i, op in enumerate(self.ops)
+                     if op.kind == 'beta' and op.payload == name}
+            if not seeds:
+                continue
+            t = self.tangents(slots, values, ctx, seeds)
+            for k, s in self.outputs.items():
+                if s in t:
+                    grads[k][:, j] = self._output(t[s], ctx)
+        return grads
+
+
+def _tangentRule(op, args, targs, value, ctx):
+    """Tangent of an operation, given the values and the tangents of
+    its arguments. A tangent None stands for zero."""
+    kind = op.kind
+    z = [0.0 if t is None else t for t in targs]
+    if kind == 'add':
+        return z[0] + z[1]
+    if kind == 'sub':
+        return z[0] - z[1]
+    if kind == 'mul':
+        return z[0] * args[1] + args[0] * z[1]
+    if kind == 'div':
+        return (z[0] - value * z[1]) / args[1]
+    if kind == 'pow':
+        a, b = args
+        t = 0.0
+        if targs[0] is not None:
+            t = t + b * np.power(a, b - 1) * targs[0]
+        if targs[1] is not None:
+            # a**b is constant in b when a is zero
+            t = t + np.where(value == 0, 0.0, value * np.log(a) * targs[1])
+        return t
+    if kind in ('and', 'or', 'eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+        return None
+    if kind == 'min':
+        return np.where(args[0] <= args[1], z[0], z[1])
+    if kind == 'max':
+        return np.where(args[0] >= args[1], z[0], z[1])
+    if kind == 'neg':
+        return -z[0]
+    if kind == 'exp':
+        return value * z[0]
+    if kind == 'log':
+        return z[0] / args[0]
+    if kind == 'normcdf':
+        return np.exp(-0.5 * args[0] ** 2) / np.sqrt(2 * np.pi) * z[0]
+    if kind == 'mc':
+        return np.mean(z[0], axis=-1, keepdims=True)
+    if kind == 'panel':
+        shape = (ctx['rows'], np.shape(value)[-1])
+        ratio = np.broadcast_to(z[0] / args[0], shape)
+        return value * np.add.reduceat(ratio, ctx['offsets'], axis=0)
+    if kind == 'elem':
+        key = args[0]
+        return np.select([key == k for k in op.payload],
+                         np.broadcast_arrays(*z[1:]), default=0.0)
+    if kind == 'loglogit':
+        return loglogitTangent(op.payload, args, z)
+    if kind == 'sum':
+        return sum(z)
+    raise ValueError(f"No derivative for operation {kind}")
+
+
+def loglogit(keys, args):
+    """Log of the logit probability of the chosen alternative, -inf
+    if it is not available.
+
+    args: the choice, the utilities and the availabilities, in the
+    order of keys."""
+    J = len(keys)
+    choice = args[0]
+    V = np.broadcast_arrays(*args[1:1 + J])
+    av = [np.asarray(a) != 0 for a in args[1 + J:]]
+    Vav = np.stack([np.where(a, v, -np.inf) for a, v in zip(av, V)])
+    m = np.max(Vav, axis=0)
+    m = np.where(np.isfinite(m), m, 0.0)
+    lse = m + np.log(np.sum(np.exp(Vav - m), axis=0))
+    chosen = np.select([choice == k for k in keys], Vav, default=np.nan)
+    return chosen - lse
+
+
+def loglogitTangent(keys, args, targs):
+    """Tangent of loglogit: the tangent of the chosen utility minus the
+    tangents of all utilities weighted by their probabilities."""
+    J = len(keys)
+    choice = args[0]
+    V = np.broadcast_arrays(*args[1:1 + J])
+    av = [np.asarray(a) != 0 for a in args[1 + J:]]
+    Vav = np.stack([np.where(a, v, -np.inf) for a, v in zip(av, V)])
+    m = np.max(Vav, axis=0)
+    m = np.where(np.isfinite(m), m, 0.0)
+    e = np.exp(Vav - m)
+    P = e / np.sum(e, axis=0)
+    tV = targs[1:1 + J]
+    chosen = np.select([choice == k for k in keys],
+                       np.broadcast_arrays(*tV), default=np.nan)
+    available = np.select([choice == k for k in keys], av, default=True)
+    # The utilities of unavailable alternatives may be undefined (e.g.
+    # the log of an empty nest in biogeme.models.lognested)
+    weighted = sum(np.where(av[j], P[j] * tV[j], 0.0) for j in range(J))
+    return np.where(available, chosen - weighted, 0.0)
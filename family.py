@@ -0,0 +1,656 @@
+########################################
+#
+# @file family.py
+#
+# Joint estimation of a family of specifications on the same data, as
+# in SpecTest_SM_piecewise.py (restricted and unrestricted models) and
+# SpecTest_SM_segmentation.py (pooled and segment models).
+#
+# The log likelihoods of all the members are compiled into one program
+# of the vectorized evaluator, so that the subexpressions common to
+# several members (derived columns, utilities written identically such
+# as M1_Car_SP and M2_Car_SP) are one slot. The slots that do not
+# depend on any parameter are computed once for each chunk of rows,
+# and kept. Each evaluation of the likelihood of a member then only
+# computes the slots of its own program that depend on its parameters.
+#
+# The values of the slots computed on each chunk are kept, each with
+# the values of the parameters it was computed with. The next
+# evaluation, of the same member or of another one, only recomputes the
+# slots of its program depending on a parameter that has changed (see
+# incremental.py), e.g. one column of a finite difference Hessian, or a
+# member sharing utilities with the previous one.
+#
+# A ColumnCache shared by several families on the same data (e.g. the
+# candidates of a specification search) keeps the values of these
+# parameter free subexpressions, identified by their structure, so
+# that a derived column is computed once for all of them.
+#
+# A segment is a member whose likelihood is restricted to the rows
+# where a condition holds (e.g. MALE == 1), so that the data does not
+# need to be copied for each segment.
+#
+# With a memoryBudget, the arrays of rows x draws (the terms inside the
+# MonteCarlo operators) are computed by blocks of draws, so that the
+# intermediate values of a chunk, and their derivatives, fit in the
+# budget. The sums of each block and of its derivatives are
+# accumulated, and divided by the number of draws once all the blocks
+# are done: the result is the one of the evaluation with all the draws
+# at once, up to rounding. The rows are cut into smaller chunks if a
+# block of a few draws does not fit.
+#
+# Likelihood ratio tests are produced for the pairs of nested members:
+# declared (nestedIn), pooled models against the union of their
+# segments, and members estimated on the same sample whose parameters
+# are a subset of the parameters of another member, provided that the
+# other member with its additional parameters at 0 has the same log
+# likelihood. Names alone do not make a restriction: the same
+# parameter may enter the two specifications differently.
+#
+#######################################
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from estimation import estimate
+from evaluator import _hashable
+from incremental import IncrementalEvaluator
+
+
+def _bytes(arrays):
+    """Memory used by the distinct arrays of an iterable."""
+    sizes = {id(a): a.nbytes for a in arrays if isinstance(a, np.ndarray)}
+    return sum(sizes.values())
+
+
+class ColumnCache:
+    """Values of the parameter free subexpressions of one data frame,
+    shared by several families. Subexpressions involving draws are not
+    kept."""
+
+    def __init__(self):
+        self.structures = {}
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def structure(self, op, argStructures):
+        """Identifier of the subexpression computed by op, independent
+        of the program it belongs to."""
+        key = (op.kind, tuple(argStructures), _hashable(op.payload))
+        return self.structures.setdefault(key, len(self.structures))
+
+
+class FamilyMember:
+    """One specification of a family, with the interface expected by
+    estimation.estimate."""
+
+    def __init__(self, family, name, slot, sample, mask=None):
+        ev = family.evaluator
+        self.family = family
+        self.modelName = name
+        self.slot = slot
+        self.sample = sample
+        self.mask = mask
+        graph = ev.subgraph(slot)
+        self.names = sorted({ev.ops[i].payload for i in graph
+                             if ev.ops[i].kind == 'beta' and
+                             ev.betas[ev.ops[i].payload].status == 0})
+        self.start = np.array([float(ev.betas[n].initValue)
+                               for n in self.names])
+        self.bounds = [(ev.betas[n].lb, ev.betas[n].ub) for n in self.names]
+        # Slots to compute at each evaluation, the others being shared
+        self.program = [i for i in graph if family.dependencies[i]]
+        self.seeds = {name: {i: 1.0 for i in graph
+                             if ev.ops[i].kind == 'beta' and
+                             ev.ops[i].payload == name}
+                      for name in self.names}
+        # Evaluation by blocks of draws (see ModelFamily, memoryBudget):
+        # slots with a draw dimension, MonteCarlo operators averaging
+        # them, slots above these operators depending on the draws, and
+        # slots computed once for all the blocks
+        shaped, random = family.drawShaped, family.random
+        self.averages = [i for i in graph if ev.ops[i].kind == 'mc' and
+                         shaped[ev.ops[i].args[0]]]
+        self.lower = [i for i in graph if shaped[i]]
+        self.upper = [i for i in graph if random[i] and not shaped[i] and
+                      i not in self.averages]
+        self.upperOrder = [i for i in graph if not shaped[i]]
+        self.rowProgram = [i for i in self.program if not random[i]]
+        self.blockable = not shaped[slot] and all(
+            ev.ops[i].kind != 'derive' and
+            not any(random[a] and not shaped[a] for a in ev.ops[i].args)
+            for i in self.lower)
+        self.size = None
+        # Scores of the last evaluation, (x, S), reused by scores(x), so
+        # that BHHH iterations and the covariance matrices cost no
+        # additional pass over the data
+        self.lastScores = None
+
+    def loglikelihood(self, x):
+        x = np.array(x, dtype=float)
+        L, g, S = self.family._evaluate(self, x, scores=True)
+        self.lastScores = (x, S)
+        return L, g
+
+    @property
+    def numberOfThreads(self):
+        return self.family.numberOfThreads
+
+    @numberOfThreads.setter
+    def numberOfThreads(self, n):
+        self.family.setNumberOfThreads(n)
+
+    def scores(self, x):
+        last = self.lastScores
+        if last is not None and np.array_equal(last[0], x):
+            return last[1]
+        return self.family._evaluate(self, x, scores=True)[2]
+
+
+class ModelFamily:
+    """Several specifications estimated on the same data.
+
+    data: the data frame, e.g. database.data.
+    definitions, numberOfDraws, seed, drawGenerators, panel: as for the
+    Evaluator. With a panel, chunks contain whole individuals.
+    chunkSize: approximate number of rows of each chunk (all the rows
+    if None).
+    columnCache: ColumnCache shared with other families on the same
+    data, or None.
+    numberOfThreads: number of chunks evaluated in parallel. Without a
+    chunkSize, the rows are cut into that number of chunks.
+    memoryBudget: bytes available to the intermediate values of the
+    draws of each chunk (None: no limit). The draws are evaluated by
+    blocks fitting in it, and the chunks are made smaller if needed.
+
+    peakMemory: estimate of the memory used by the last evaluation, in
+    bytes (prepared values of all the chunks, and intermediate values
+    of the chunks evaluated at the same time).
+    """
+
+    def __init__(self, data, chunkSize=None, columnCache=None,
+                 numberOfThreads=1, memoryBudget=None, **kwargs):
+        self.data = data
+        self.chunkSize = chunkSize
+        self.memoryBudget = memoryBudget
+        self.drawBlock = None
+        self.preparedMemory = 0
+        self.peakMemory = None
+        self.columnCache = columnCache
+        self.numberOfThreads = max(int(numberOfThreads), 1)
+        self.kwargs = kwargs
+        self.formulas = {}
+        self.samples = {}
+        self.declared = []
+        self.segmentations = {}
+        self.evaluator = None
+        self.results = {}
+
+    def add(self, name, loglike, sample=None, nestedIn=None):
+        """Register a member.
+
+        loglike: log likelihood of each row (or individual), such as
+        bioLogLogit(V, av, CHOICE).
+        sample: expression of the data selecting the rows of the
+        member (e.g. MALE == 1), boolean array over the rows of the
+        data, or None for all the rows.
+        nestedIn: name of a member of which this one is a restriction,
+        for the likelihood ratio test.
+        """
+        if name in self.formulas:
+            raise ValueError(f"Member {name} already registered")
+        self.formulas[name] = loglike
+        self.samples[name] = sample
+        if nestedIn is not None:
+            self.declared.append((name, nestedIn))
+        self.evaluator = None
+
+    def addSegmentation(self, name, loglike, segments, sample=None):
+        """Register a pooled model and one member per segment, named
+        '<name>_<segment>', with the same specification.
+
+        segments: dict associating the name of each segment with the
+        expression selecting its rows. The segments must form a
+        partition of the rows of the pooled model.
+        """
+        self.add(name, loglike, sample)
+        members = []
+        for segment, condition in segments.items():
+            member = f'{name}_{segment}'
+            self.add(member, loglike,
+                     condition if sample is None else sample * condition)
+            members.append(member)
+        self.segmentations[name] = members
+
+    # Compilation
+
+    def compile(self):
+        """Compile all the members into one program."""
+        formulas = {('loglike', name): f for name, f in self.formulas.items()}
+        masks = {name: np.asarray(s, dtype=bool)
+                 for name, s in self.samples.items()
+                 if isinstance(s, (np.ndarray, pd.Series))}
+        formulas.update({('sample', name): s for name, s in self.samples.items()
+                         if s is not None and name not in masks})
+        ev = IncrementalEvaluator(formulas, **self.kwargs)
+        self.evaluator = ev
+        self.dependencies = ev.dependencies
+        # Slots depending on the draws, and those with a draw dimension
+        # (the MonteCarlo operators remove it)
+        self.random = []
+        self.drawShaped = []
+        for op in ev.ops:
+            self.random.append(op.kind == 'draw' or
+                               any(self.random[a] for a in op.args))
+            self.drawShaped.append(op.kind == 'draw' or (
+                op.kind != 'mc' and any(self.drawShaped[a] for a in op.args)))
+        self.members = {}
+        for name in self.formulas:
+            sample = ev.outputs.get(('sample', name))
+            if sample is not None and self.dependencies[sample]:
+                raise ValueError(f"The sample of {name} depends on "
+                                 f"parameters")
+            if name in masks and len(masks[name]) != len(self.data):
+                raise ValueError(f"The sample of {name} does not have one "
+                                 f"value per row")
+            self.members[name] = FamilyMember(self, name,
+                                              ev.outputs[('loglike', name)],
+                                              sample, masks.get(name))
+        self._chunks = None
+        return self
+
+    def setDrawSeed(self, seed):
+        """Generate the draws from seed, e.g. to resume an estimation
+        with the draws of a checkpoint."""
+        if self.evaluator is None:
+            self.compile()
+        ev = self.evaluator
+        self.kwargs['seed'] = seed
+        if ev.seed != seed:
+            ev.seed = seed
+            ev._draws = None
+            self._chunks = None
+
+    def setNumberOfThreads(self, n):
+        """Number of chunks evaluated in parallel (see threadtuning.py)."""
+        n = max(int(n), 1)
+        if n != self.numberOfThreads:
+            self.numberOfThreads = n
+            if self.chunkSize is None:
+                self._chunks = None
+
+    def setMemoryBudget(self, memoryBudget):
+        """Bytes available to the intermediate values of the draws of
+        each chunk (None: no limit)."""
+        if memoryBudget != self.memoryBudget:
+            self.memoryBudget = memoryBudget
+            self._chunks = None
+
+    def _layout(self, rows):
+        """Approximate number of rows of each chunk, and number of draws
+        of each block (None: all the draws at once)."""
+        ev = self.evaluator
+        if self.chunkSize is not None:
+            size = max(int(self.chunkSize), 1)
+        else:
+            size = max(-(-rows // self.numberOfThreads), 1)
+        if self.memoryBudget is None or not ev.drawTypes:
+            return size, None
+        R = ev.numberOfDraws
+        # Value and derivative of each slot with a draw dimension, for
+        # one row and one draw
+        cell = 16 * max(sum(self.drawShaped), 1)
+        if self.chunkSize is None:
+            size = min(size, max(int(self.memoryBudget //
+                                     (cell * min(R, 16))), 1))
+        block = int(np.clip(self.memoryBudget // (cell * size), 1, R))
+        return size, None if block >= R else block
+
+    def _bounds(self):
+        """Row boundaries of the chunks, and of the units (individuals
+        for a panel, rows otherwise)."""
+        rows = len(self.data)
+        ev = self.evaluator
+        if ev.panel is None:
+            units = np.arange(rows)
+        else:
+            units = ev.panelOffsets(self.data)
+        size, self.drawBlock = self._layout(rows)
+        cuts = [0]
+        while cuts[-1] < rows:
+            k = np.searchsorted(units, cuts[-1] + size)
+            cuts.append(int(units[k]) if k < len(units) else rows)
+        return cuts, units
+
+    def _prepare(self):
+        """Context of each chunk, with the values of the slots that do
+        not depend on the parameters, and the sample weights of the
+        members."""
+        if self.evaluator is None:
+            self.compile()
+        if self._chunks is not None:
+            return self._chunks
+        ev = self.evaluator
+        cuts, units = self._bounds()
+        draws = ev.generateDraws(len(units)) if ev.drawTypes else {}
+        betas = {name: float(b.initValue) for name, b in ev.betas.items()}
+        cache = self.columnCache
+        structures = []
+        for op in ev.ops:
+            structures.append(None if cache is None else cache.structure(
+                op, [structures[a] for a in op.args]))
+        random = self.random
+        blocked = self.drawBlock is not None
+        self._chunks = []
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for a, b in zip(cuts[:-1], cuts[1:]):
+                first, last = np.searchsorted(units, [a, b])
+                offsets = None
+                chunkDraws = {k: d[first:last] for k, d in draws.items()}
+                counts = None
+                if ev.panel is not None:
+                    offsets = units[first:last] - a
+                    counts = np.diff(np.append(offsets, b - a))
+                # cache: values of the slots computed on the chunk, and
+                # the parameters of each (see IncrementalEvaluator.update),
+                # updated under the lock
+                ctx = {'data': self.data.iloc[a:b], 'betas': betas,
+                       'offsets': offsets, 'rows': b - a,
+                       'cache': None, 'lock': threading.Lock()}
+                if blocked:
+                    # Draws of the individuals, repeated over their rows
+                    # block by block
+                    ctx.update(draws=None, unitDraws=chunkDraws,
+                               counts=counts)
+                else:
+                    if counts is not None:
+                        chunkDraws = {k: np.repeat(d, counts, axis=0)
+                                      for k, d in chunkDraws.items()}
+                    ctx['draws'] = chunkDraws
+                values = [None] * len(ev.ops)
+                for i, op in enumerate(ev.ops):
+                    if self.dependencies[i] or (blocked and random[i]):
+                        continue
+                    if cache is None or random[i] or op.kind == 'const':
+                        values[i] = ev._value(i, values, ctx)
+                        continue
+                    key = (structures[i], ev.panel, a, b)
+                    if key in cache.values:
+                        cache.hits += 1
+                    else:
+                        cache.misses += 1
+                        cache.values[key] = ev._value(i, values, ctx)
+                    values[i] = cache.values[key]
+                n = last - first
+                weights = {}
+                for name, member in self.members.items():
+                    if member.mask is not None:
+                        w = member.mask[a:b]
+                    elif member.sample is not None:
+                        w = ev._output(values[member.sample], ctx) != 0
+                    else:
+                        w = np.ones(n)
+                    # With a panel, the first row of each individual
+                    if offsets is not None and len(w) != n:
+                        w = w[offsets]
+                    weights[name] = np.asarray(w, dtype=float)
+                self._chunks.append((ctx, values, weights))
+        for name, member in self.members.items():
+            member.size = int(sum(np.sum(w[name] != 0)
+                                  for _, _, w in self._chunks))
+        self.preparedMemory = _bytes(
+            [v for _, values, _ in self._chunks for v in values] +
+            [d for ctx, _, _ in self._chunks
+             for d in (ctx['draws'] or {}).values()] + list(draws.values()))
+        return self._chunks
+
+    def _blockDraws(self, ctx, first, last):
+        """Draws first to last of a chunk prepared with a memoryBudget."""
+        draws = {k: d[:, first:last] for k, d in ctx['unitDraws'].items()}
+        if ctx['counts'] is not None:
+            draws = {k: np.repeat(d, ctx['counts'], axis=0)
+                     for k, d in draws.items()}
+        return draws
+
+    # Evaluation
+
+    def _evaluate(self, member, x, scores=False):
+        """Log likelihood of a member, its gradient and, if requested,
+        the scores of its observations."""
+        ev = self.evaluator
+        betas = {name: float(b.initValue) for name, b in ev.betas.items()}
+        betas.update(zip(member.names, np.asarray(x, dtype=float)))
+        chunks = self._prepare()
+        evaluateChunk = self._evaluateChunk
+        if self.drawBlock is not None:
+            evaluateChunk = self._evaluateBlocks
+        threads = min(self.numberOfThreads, len(chunks))
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as executor:
+                done = list(executor.map(
+                    lambda c: evaluateChunk(member, betas, *c), chunks))
+        else:
+            done = [evaluateChunk(member, betas, *c) for c in chunks]
+        self.peakMemory = self.preparedMemory + threads * max(
+            (peak for _, _, peak in done), default=0)
+        L = sum(l for l, _, _ in done)
+        g = np.zeros(len(member.names))
+        for _, G, _ in done:
+            g += np.sum(G, axis=0)
+        if not scores:
+            return L, g, None
+        return L, g, np.concatenate([G for _, G, _ in done])
+
+    def _evaluateChunk(self, member, betas, ctx, shared, weights):
+        """Log likelihood of a member on a chunk, the scores of its
+        observations (or individuals), and the memory used. The slots
+        computed on the chunk, by this member or another one, with the
+        current values of their parameters are reused, unless the chunk
+        is being evaluated by another thread."""
+        ev = self.evaluator
+        chunk = ctx
+        ctx = dict(ctx, betas=betas)
+        if chunk['lock'].acquire(blocking=False):
+            try:
+                cache = chunk['cache']
+                if cache is None:
+                    values, stamps = list(shared), [None] * len(shared)
+                else:
+                    values, stamps = list(cache[0]), list(cache[1])
+                ev.update(member.program, values, stamps, ctx)
+                chunk['cache'] = (values, stamps)
+            finally:
+                chunk['lock'].release()
+        else:
+            values = ev.update(member.program, list(shared),
+                               [None] * len(shared), ctx)
+        return self._chunkResult(member, values, ctx, weights)
+
+    def _evaluateBlocks(self, member, betas, ctx, shared, weights):
+        """Same as _evaluateChunk, the terms of the MonteCarlo operators
+        being computed by blocks of draws."""
+        ev = self.evaluator
+        R = ev.numberOfDraws
+        ctx = dict(ctx, betas=betas)
+        values = list(shared)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for i in member.rowProgram:
+                values[i] = ev._value(i, values, ctx)
+            if not member.blockable:
+                # All the draws at once
+                ctx['draws'] = self._blockDraws(ctx, 0, R)
+                for i in sorted(member.lower + member.averages +
+                                member.upper):
+                    values[i] = ev._value(i, values, ctx)
+                return self._chunkResult(member, values, ctx, weights)
+            arguments = [ev.ops[m].args[0] for m in member.averages]
+            sums = [0.0] * len(arguments)
+            tangentSums = [{} for _ in member.names]
+            peak = 0
+            for first in range(0, R, self.drawBlock):
+                last = min(first + self.drawBlock, R)
+                block = dict(ctx, draws=self._blockDraws(ctx, first, last))
+                blockValues = list(values)
+                for i in member.lower:
+                    blockValues[i] = ev._value(i, blockValues, block)
+                for k, a in enumerate(arguments):
+                    sums[k] = sums[k] + np.sum(blockValues[a], axis=-1,
+                                               keepdims=True)
+                live = _bytes(blockValues)
+                for j, name in enumerate(member.names):
+                    t = ev.tangents(arguments, blockValues, block,
+                                    member.seeds[name])
+                    peak = max(peak, live + _bytes(t.values()))
+                    for k, a in enumerate(arguments):
+                        if a not in t:
+                            continue
+                        s = np.sum(np.broadcast_to(
+                            t[a], np.shape(blockValues[a])), axis=-1,
+                            keepdims=True)
+                        tangentSums[j][k] = tangentSums[j].get(k, 0.0) + s
+            for m, s in zip(member.averages, sums):
+                values[m] = s / R
+            for i in member.upper:
+                values[i] = ev._value(i, values, ctx)
+        seeds = [{**member.seeds[name],
+                  **{member.averages[k]: s / R
+                     for k, s in tangentSums[j].items()}}
+                 for j, name in enumerate(member.names)]
+        L, G, chunkPeak = self._chunkResult(member, values, ctx, weights,
+                                            seeds, member.upperOrder)
+        return L, G, max(peak, chunkPeak)
+
+    def _chunkResult(self, member, values, ctx, weights, seeds=None,
+                     order=None):
+        """Log likelihood and scores of a member on a chunk from the
+        values of its slots, and the memory used by the values and the
+        derivatives. seeds: tangents of the leaves for each parameter
+        (default: the parameter itself)."""
+        ev = self.evaluator
+        w = weights[member.modelName]
+        selected = w != 0
+        v = ev._output(values[member.slot], ctx)
+        L = float(np.sum(v[selected] * w[selected]))
+        G = np.zeros((len(w), len(member.names)))
+        live = _bytes(values)
+        peak = live
+        for j, name in enumerate(member.names):
+            t = ev.tangents([member.slot], values, ctx,
+                            member.seeds[name] if seeds is None else seeds[j],
+                            order)
+            peak = max(peak, live + _bytes(t.values()))
+            if member.slot in t:
+                G[:, j] = ev._output(t[member.slot], ctx)
+        return L, G[selected] * w[selected, None], peak
+
+    def statistics(self):
+        """Operations of the joint program, of the members compiled
+        separately, and operations computed once for all the members."""
+        if self.evaluator is None:
+            self.compile()
+        separate = sum(len(self.evaluator.subgraph(m.slot))
+                       for m in self.members.values())
+        shared = sum(1 for d in self.dependencies if not d)
+        return {'members': len(self.members),
+                'operations': len(self.evaluator.ops),
+                'separate operations': separate,
+                'parameter free operations': shared,
+                'chunks': len(self._bounds()[0]) - 1,
+                'draws per block': self.drawBlock,
+                'peak memory [MB]': None if self.peakMemory is None
+                else self.peakMemory / 2 ** 20}
+
+    # Estimation
+
+    def estimate(self, numberOfThreads=None, start=None, **kwargs):
+        """Estimate all the members, in parallel threads if
+        numberOfThreads is larger than 1. start: dict of values of the
+        parameters from which each member starts (e.g. the estimates of
+        another member), instead of their initial values. kwargs are
+        passed to estimation.estimate. Returns a dict of
+        EstimationResults."""
+        self._prepare()
+        names = list(self.members)
+        start = {} if start is None else start
+
+        def run(name):
+            member = self.members[name]
+            x0 = [start.get(n, s) for n, s in zip(member.names, member.start)]
+            return estimate(member, x0, **kwargs)
+
+        if numberOfThreads is not None and numberOfThreads > 1:
+            with ThreadPoolExecutor(numberOfThreads) as executor:
+                results = list(executor.map(run, names))
+        else:
+            results = [run(n) for n in names]
+        self.results = dict(zip(names, results))
+        return self.results
+
+    def _sameSample(self, a, b):
+        a, b = self.members[a], self.members[b]
+        return a.sample == b.sample and a.mask is b.mask
+
+    def _restricts(self, a, b):
+        """True if member b with its parameters that are not in a at 0
+        has the log likelihood of a, at a point away from the initial
+        values (often 0, where many specifications coincide)."""
+        ma, mb = self.members[a], self.members[b]
+        rng = np.random.default_rng(0)
+        x = ma.start + rng.uniform(-0.5, 0.5, len(ma.names))
+        x = np.clip(x, [-np.inf if lb is None else lb for lb, _ in ma.bounds],
+                    [np.inf if ub is None else ub for _, ub in ma.bounds])
+        values = dict(zip(ma.names, x))
+        y = np.array([values.get(name, 0.0) for name in mb.names])
+        La = self._evaluate(ma, x)[0]
+        Lb = self._evaluate(mb, y)[0]
+        return bool(np.isclose(La, Lb, rtol=1e-10, atol=1e-8))
+
+    def nestedPairs(self):
+        """Pairs (restricted, unrestricted) of members, and pooled
+        models with the list of their segments. Pairs that are not
+        declared are checked with _restricts."""
+        if self.evaluator is None:
+            self.compile()
+        pairs = list(self.declared)
+        for a, ma in self.members.items():
+            for b, mb in self.members.items():
+                if (a, b) not in pairs and self._sameSample(a, b) and \
+                        set(ma.names) < set(mb.names) and \
+                        self._restricts(a, b):
+                    pairs.append((a, b))
+        pairs += [(pooled, segments)
+                  for pooled, segments in self.segmentations.items()]
+        return pairs
+
+    def lrTests(self):
+        """Likelihood ratio test for each pair of nested members (see
+        nestedPairs), with the estimates of the last call to
+        estimate."""
+        rows = []
+        for restricted, unrestricted in self.nestedPairs():
+            if isinstance(unrestricted, str):
+                unrestricted = [unrestricted]
+            elif self._chunks is not None:
+                total = sum(self.members[s].size for s in unrestricted)
+                if total != self.members[restricted].size:
+                    raise ValueError(f"The segments of {restricted} do not "
+                                     f"form a partition of its sample")
+            r = self.results[restricted].data
+            u = [self.results[s].data for s in unrestricted]
+            logLike = sum(d.logLike for d in u)
+            df = sum(d.nparam for d in u) - r.nparam
+            lr = 2 * (logLike - r.logLike)
+            rows.append({'Restricted': restricted,
+                         'Unrestricted': ' + '.join(unrestricted),
+                         'LL restricted': r.logLike,
+                         'LL unrestricted': logLike,
+                         'LR': lr,
+                         'df': df,
+                         'p-value': stats.chi2.sf(lr, df) if df > 0
+                         else np.nan})
+        return pd.DataFrame(rows)
@@ -0,0 +1,125 @@
+########################################
+#
+# @file incremental.py
+#
+# Incremental evaluation of the program of the vectorized evaluator.
+#
+# Each slot of the program depends on a set of parameters (the Beta
+# in its subtree). The values of all the slots are kept between calls
+# on the same data, with the values of the parameters each of them was
+# computed with. At the next call, only the slots depending on a
+# parameter whose value has changed are recomputed. During a line
+# search or a finite difference step along one parameter (LAMBDA in
+# 08boxcox.py, MU in 09nested.py), most of the program is reused, in
+# particular the parts involving draws that do not depend on it.
+#
+# ModelFamily (family.py) evaluates its members this way, chunk by
+# chunk.
+#
+#######################################
+
+import numpy as np
+
+from evaluator import Evaluator
+
+
+class IncrementalEvaluator(Evaluator):
+    """Evaluator reusing the values of the slots that do not depend on
+    the parameters changed since the previous call.
+
+    The cached values are associated with the data object and the
+    draws. If the content of the data frame is modified in place,
+    invalidate() must be called.
+    """
+
+    def __init__(self, formulas, **kwargs):
+        super().__init__(formulas, **kwargs)
+        self.dependencies = []
+        for op in self.ops:
+            if op.kind == 'beta':
+                self.dependencies.append(frozenset([op.payload]))
+            else:
+                self.dependencies.append(frozenset().union(
+                    *[self.dependencies[a] for a in op.args]))
+        self._dependencyNames = [tuple(sorted(d)) for d in self.dependencies]
+        self._cache = None
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.calls = 0
+        self.fullEvaluations = 0
+        self.hits = 0
+        self.misses = 0
+        self.reusedElements = 0
+        self.computedElements = 0
+
+    def invalidate(self):
+        """Forget the cached values."""
+        self._cache = None
+
+    def run(self, ctx):
+        self.calls += 1
+        # References, not ids, so that the objects cannot be replaced
+        # by others at the same address.
+        token = (ctx['data'], None if self._draws is None else self._draws[1])
+        betas = ctx['betas']
+        if self._cache is None or \
+                any(a is not b for a, b in zip(self._cache[0], token)):
+            self.fullEvaluations += 1
+            values = super().run(ctx)
+            self.misses += len(values)
+            self.computedElements += sum(np.size(v) for v in values)
+            self._cache = (token, values, self.stamps(ctx))
+            return values
+        _, cached, stamps = self._cache
+        values, stamps = list(cached), list(stamps)
+        self.update(range(len(self.ops)), values, stamps, ctx)
+        self._cache = (token, values, stamps)
+        return values
+
+    def stamps(self, ctx, slots=None):
+        """Values in ctx['betas'] of the parameters each slot depends
+        on, for all the slots, None for those not in slots."""
+        betas = ctx['betas']
+        slots = range(len(self.ops)) if slots is None else set(slots)
+        return [tuple(betas[n] for n in names) if i in slots else None
+                for i, names in enumerate(self._dependencyNames)]
+
+    def update(self, slots, values, stamps, ctx):
+        """Compute in values the slots (in increasing order) that have no
+        value, or depend on a parameter whose value in ctx['betas']
+        differs from the one the slot was computed with. stamps[i]: the
+        values of the parameters slot i depends on when it was computed
+        (see stamps), updated. Used by ModelFamily for each chunk, whose
+        members share slots but compute each only their own."""
+        betas = ctx['betas']
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for i in slots:
+                stamp = tuple(betas[n] for n in self._dependencyNames[i])
+                if values[i] is None or stamps[i] != stamp:
+                    values[i] = self._value(i, values, ctx)
+                    stamps[i] = stamp
+                    self.misses += 1
+                    self.computedElements += np.size(values[i])
+                else:
+                    self.hits += 1
+                    self.reusedElements += np.size(values[i])
+        return values
+
+    def statistics(self):
+        """Statistics of the program (see Evaluator.statistics), and of
+        the cache: operations and array elements reused (hits) or
+        computed (misses)."""
+        stats = super().statistics()
+        total = self.hits + self.misses
+        elements = self.reusedElements + self.computedElements
+        stats.update({'calls': self.calls,
+                      'full evaluations': self.fullEvaluations,
+                      'hits': self.hits,
+                      'misses': self.misses,
+                      'hit rate': self.hits / total if total else 0.0,
+                      'reused elements': self.reusedElements,
+                      'computed elements': self.computedElements,
+                      'element hit rate':
+                      self.reusedElements / elements if elements else 0.0})
+        return stats
@@ -0,0 +1,172 @@
+########################################
+#
+# @file instrumentation.py
+#
+# What an estimation does while it runs.
+#
+# A Monitor given to estimation.estimate (monitor=...) times each
+# evaluation of the log likelihood, of the scores and of the Hessian,
+# and produces an event after each iteration of the optimizer: log
+# likelihood, gradient norm, step size, number and time of the
+# evaluations, number of threads of the model and draws evaluated per
+# second.
+# The events are kept, passed to a callback if any, and can be
+# exported as JSON lines or as a Chrome trace (chrome://tracing or
+# https://ui.perfetto.dev), where each evaluation is a span on the
+# thread that ran it.
+#
+# Without a monitor, estimate calls the model directly: the
+# instrumentation costs nothing.
+#
+#######################################
+
+import json
+import threading
+import time
+
+import numpy as np
+
+from checkpoint import drawSettings
+
+
+class _Monitored:
+    """Model whose evaluations are timed by a Monitor. Everything else
+    is the model itself."""
+
+    def __init__(self, model, monitor):
+        self.model = model
+        self.monitor = monitor
+
+    def __getattr__(self, name):
+        attribute = getattr(self.model, name)
+        if name in ('loglikelihood', 'scores', 'hessian'):
+            return self.monitor.timed(name, attribute)
+        return attribute
+
+
+class Monitor:
+    """Events of an estimation.
+
+    callback: function called with each iteration event (a dict), or
+    None.
+
+    events: evaluation events (name, start and duration in seconds
+    since the creation of the monitor, thread) and iteration events.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.origin = time.perf_counter()
+        self.events = []
+        self.iterations = 0
+        self.model = None
+        self._first = 0
+        self._previous = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def wrap(self, model):
+        """Model whose evaluations are recorded."""
+        self.model = model
+        return _Monitored(model, self)
+
+    def begin(self, x0):
+        """Starting point of the optimizer, for the first step size."""
+        self._previous = np.array(x0, dtype=float)
+
+    def timed(self, name, function):
+        def timedFunction(x, *args):
+            start = time.perf_counter()
+            value = function(x, *args)
+            end = time.perf_counter()
+            event = {'type': 'evaluation', 'name': name,
+                     'start': start - self.origin, 'duration': end - start,
+                     'thread': threading.get_ident()}
+            with self._lock:
+                self.events.append(event)
+                if name == 'loglikelihood':
+                    self._last = (np.array(x, dtype=float), value)
+            return value
+        return timedFunction
+
+    def iteration(self, intermediate_result):
+        """Callback of the optimizer (see estimation.estimate)."""
+        now = time.perf_counter() - self.origin
+        x = np.array(intermediate_result.x, dtype=float)
+        with self._lock:
+            evaluations = [e for e in self.events[self._first:]
+                           if e['type'] == 'evaluation']
+            self._first = len(self.events)
+            last = self._last
+        self.iterations += 1
+        event = {'type': 'iteration', 'iteration': self.iterations,
+                 'time': now, 'logLike': -float(intermediate_result.fun)}
+        if 'gradient' in intermediate_result:
+            # estimation.bhhh
+            event['gradient norm'] = float(np.linalg.norm(
+                intermediate_result.gradient))
+        elif 'grad' in intermediate_result:
+            # trust-constr
+            event['gradient norm'] = float(np.linalg.norm(
+                intermediate_result.grad))
+        elif last is not None and np.array_equal(last[0], x):
+            event['gradient norm'] = float(np.linalg.norm(last[1][1]))
+        if self._previous is not None:
+            event['step size'] = float(np.linalg.norm(x - self._previous))
+        self._previous = x
+        for name in ('loglikelihood', 'scores', 'hessian'):
+            durations = [e['duration'] for e in evaluations
+                         if e['name'] == name]
+            event[f'{name} evaluations'] = len(durations)
+            event[f'{name} time'] = float(np.sum(durations))
+        # Threads of the evaluation of the model, not the threads
+        # calling it (one, except for the finite difference Hessian)
+        event['threads'] = getattr(self.model, 'numberOfThreads', 1)
+        seed, numberOfDraws = drawSettings(self.model)
+        size = getattr(self.model, 'size', None)
+        if numberOfDraws and size and event['loglikelihood time'] > 0:
+            event['draws per second'] = (numberOfDraws * size *
+                                         event['loglikelihood evaluations'] /
+                                         event['loglikelihood time'])
+        with self._lock:
+            self.events.append(event)
+        if self.callback is not None:
+            self.callback(event)
+
+    def iterationEvents(self):
+        return [e for e in self.events if e['type'] == 'iteration']
+
+    def writeJsonl(self, path):
+        """One JSON object per line and per event."""
+        with open(path, 'w') as f:
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+    def writeChromeTrace(self, path):
+        """Trace in the Chrome trace event format: evaluations are
+        complete events on their thread, iterations are instant events
+        with their statistics, log likelihood and gradient norm are
+        counters."""
+        threads = {}
+        trace = []
+        for e in self.events:
+            if e['type'] == 'evaluation':
+                tid = threads.setdefault(e['thread'], len(threads))
+                trace.append({'name': e['name'], 'ph': 'X', 'pid': 0,
+                              'tid': tid, 'ts': e['start'] * 1e6,
+                              'dur': e['duration'] * 1e6})
+            else:
+                args = {k: v for k, v in e.items()
+                        if k not in ('type', 'time')}
+                trace.append({'name': f"iteration {e['iteration']}",
+                              'ph': 'i', 's': 'p', 'pid': 0, 'tid': 0,
+                              'ts': e['time'] * 1e6, 'args': args})
+                counters = {k: e[k] for k in ('logLike', 'gradient norm')
+                            if k in e}
+                trace.append({'name': 'convergence', 'ph': 'C', 'pid': 0,
+                              'ts': e['time'] * 1e6, 'args': counters})
+        for thread, tid in threads.items():
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 0,
+                          'tid': tid, 'args': {'name': f'thread {tid}'}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,330 @@
+########################################
+#
+# @file kernels.py
+#
+# Compilation of the program of the vectorized evaluator into Python
+# source code.
+#
+# The evaluator interprets its program one operation at a time. Here,
+# the program is lowered into a Python function with one statement per
+# operation, after
+#
+# - constant folding: operations on numbers and on fixed parameters
+#   (status 1) are computed once at compile time, and additions of 0
+#   or multiplications by 1 disappear,
+# - fusion: chains of elementwise operations whose intermediate
+#   results are used once are written as one expression. With numexpr
+#   (optional), each such expression is evaluated in a single pass
+#   over the rows and draws.
+#
+# The generated source is stored on disk, in a file named after the
+# hash of the program, and reused by later runs.
+#
+#######################################
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from evaluator import Evaluator, _functions, loglogit
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Bump when the generated code changes, to invalidate the cache.
+VERSION = 2
+
+_numpy = {'add': '({0} + {1})',
+          'sub': '({0} - {1})',
+          'mul': '({0} * {1})',
+          'div': 'np.divide({0}, {1})',
+          'pow': 'np.power({0}, {1})',
+          'and': '(1.0 * ((np.asarray({0}) != 0) & (np.asarray({1}) != 0)))',
+          'or': '(1.0 * ((np.asarray({0}) != 0) | (np.asarray({1}) != 0)))',
+          'eq': '(1.0 * np.equal({0}, {1}))',
+          'ne': '(1.0 * np.not_equal({0}, {1}))',
+          'lt': '(1.0 * np.less({0}, {1}))',
+          'le': '(1.0 * np.less_equal({0}, {1}))',
+          'gt': '(1.0 * np.greater({0}, {1}))',
+          'ge': '(1.0 * np.greater_equal({0}, {1}))',
+          'min': 'np.minimum({0}, {1})',
+          'max': 'np.maximum({0}, {1})',
+          'neg': '(-{0})',
+          'exp': 'np.exp({0})',
+          'log': 'np.log({0})',
+          'normcdf': '_ndtr({0})'}
+
+_numexpr = {'add': '({0} + {1})',
+            'sub': '({0} - {1})',
+            'mul': '({0} * {1})',
+            'div': '({0} / {1})',
+            'pow': '({0} ** {1})',
+            'and': 'where(({0} != 0) & ({1} != 0), 1.0, 0.0)',
+            'or': 'where(({0} != 0) | ({1} != 0), 1.0, 0.0)',
+            'eq': 'where({0} == {1}, 1.0, 0.0)',
+            'ne': 'where({0} != {1}, 1.0, 0.0)',
+            'lt': 'where({0} < {1}, 1.0, 0.0)',
+            'le': 'where({0} <= {1}, 1.0, 0.0)',
+            'gt': 'where({0} > {1}, 1.0, 0.0)',
+            'ge': 'where({0} >= {1}, 1.0, 0.0)',
+            'min': 'where({0} <= {1}, {0}, {1})',
+            'max': 'where({0} >= {1}, {0}, {1})',
+            'neg': '(-{0})',
+            'exp': 'exp({0})',
+            'log': 'log({0})'}
+
+
+def _ndtr(x):
+    from scipy.special import ndtr
+    return ndtr(x)
+
+
+def _panel(x, ctx):
+    x = np.broadcast_to(x, (ctx['rows'], np.shape(x)[-1]))
+    return np.multiply.reduceat(x, ctx['offsets'], axis=0)
+
+
+def _elem(keys, key, args):
+    return np.select([key == k for k in keys], args, default=np.nan)
+
+
+def _literal(value):
+    value = float(value)
+    if np.isfinite(value):
+        return repr(value)
+    return f"float('{value}')"
+
+
+class _Generator:
+    """Source of the kernel for one program."""
+
+    def __init__(self, evaluator, fuse, useNumexpr):
+        self.ev = evaluator
+        self.ops = evaluator.ops
+        self.useNumexpr = useNumexpr
+        self.templates = _numexpr if useNumexpr else _numpy
+        self.fuse = fuse and not any(op.kind == 'derive' for op in self.ops)
+        self.constants = {}
+        self.aliases = {}
+        self._fold()
+        self.uses = np.zeros(len(self.ops), dtype=int)
+        # Operation using each slot (the last one if several)
+        self.users = {}
+        for i, op in enumerate(self.ops):
+            for a in op.args:
+                self.uses[self._resolve(a)] += 1
+                self.users[self._resolve(a)] = i
+        for s in evaluator.outputs.values():
+            self.uses[self._resolve(s)] += 2
+
+    def _resolve(self, slot):
+        while slot in self.aliases:
+            slot = self.aliases[slot]
+        return slot
+
+    def _fold(self):
+        betas = self.ev.betas
+        for i, op in enumerate(self.ops):
+            if op.kind == 'const':
+                self.constants[i] = float(op.payload)
+            elif op.kind == 'beta' and betas[op.payload].status != 0:
+                self.constants[i] = float(betas[op.payload].initValue)
+            elif op.kind in _functions or op.kind == 'sum':
+                args = [self._resolve(a) for a in op.args]
+                if all(a in self.constants for a in args):
+                    values = [self.constants[a] for a in args]
+                    with np.errstate(all='ignore'):
+                        if op.kind == 'sum':
+                            self.constants[i] = float(sum(values))
+                        else:
+                            self.constants[i] = float(
+                                _functions[op.kind](*values))
+                    continue
+                c = [self.constants.get(a) for a in args]
+                if op.kind == 'add' and c[0] == 0:
+                    self.aliases[i] = args[1]
+                elif op.kind in ('add', 'sub') and c[1] == 0:
+                    self.aliases[i] = args[0]
+                elif op.kind == 'mul' and c[0] == 1:
+                    self.aliases[i] = args[1]
+                elif op.kind in ('mul', 'div') and c[1] == 1:
+                    self.aliases[i] = args[0]
+
+    def _fusible(self, slot):
+        if slot is None:
+            return False
+        kind = self.ops[slot].kind
+        return kind in self.templates or kind == 'sum'
+
+    def _inlined(self, slot):
+        # With numexpr, an expression is only valid inside the
+        # numexpr.evaluate of a fusible operation: the argument of
+        # another operation (MonteCarlo, loglogit...) is a statement
+        if self.useNumexpr and not self._fusible(self.users.get(slot)):
+            return False
+        return self.fuse and self._fusible(slot) and self.uses[slot] == 1
+
+    def expression(self, slot):
+        """Expression of the value of a slot."""
+        slot = self._resolve(slot)
+        if slot in self.constants:
+            value = self.constants[slot]
+            if np.isfinite(value) or not self.useNumexpr:
+                return _literal(value)
+        if self._inlined(slot) and slot not in self.constants:
+            return self._render(slot)
+        return f'v{slot}'
+
+    def _render(self, slot):
+        op = self.ops[slot]
+        args = [self.expression(a) for a in op.args]
+        if op.kind == 'sum':
+            return '(' + ' + '.join(args) + ')'
+        return self.templates[op.kind].format(*args)
+
+    def _statement(self, slot):
+        op = self.ops[slot]
+        kind = op.kind
+        if slot in self.constants:
+            return _literal(self.constants[slot])
+        if slot in self.aliases:
+            return self.expression(slot)
+        args = [self.expression(a) for a in op.args]
+        if kind == 'beta':
+            return f'betas[{op.payload!r}]'
+        if kind == 'var':
+            return f'np.asarray(data[{op.payload!r}], dtype=float)' \
+                '.reshape(-1, 1)'
+        if kind == 'draw':
+            return f'draws[{op.payload!r}]'
+        if self._fusible(slot):
+            code = self._render(slot)
+            if self.useNumexpr:
+                names = sorted(set(re.findall(r'\bv\d+\b', code)))
+                localDict = ', '.join(f"'{n}': {n}" for n in names)
+                return f'numexpr.evaluate({code!r}, ' \
+                    f'local_dict={{{localDict}}})'
+            return code
+        if kind == 'mc':
+            return f'np.mean({args[0]}, axis=-1, keepdims=True)'
+        if kind == 'panel':
+            return f'_panel({args[0]}, ctx)'
+        if kind == 'elem':
+            return f'_elem({op.payload!r}, {args[0]}, [{", ".join(args[1:])}])'
+        if kind == 'loglogit':
+            return f'loglogit({op.payload!r}, [{", ".join(args)}])'
+        if kind == 'derive':
+            previous = ', '.join(f'v{i}' for i in range(slot))
+            return f'apply({slot}, [{previous}])'
+        if kind == 'normcdf':
+            return f'_ndtr({args[0]})'
+        raise ValueError(f"Unknown operation {kind}")
+
+    def source(self):
+        """Source of kernel(ctx, apply). Without fusion, it returns the
+        values of all the slots, as Evaluator.run. With fusion, it
+        returns the values of the output slots only."""
+        lines = ['def kernel(ctx, apply):',
+                 "    data = ctx['data']",
+                 "    betas = ctx['betas']",
+                 "    draws = ctx['draws']"]
+        for i in range(len(self.ops)):
+            # Folded, aliased and inlined slots have no statement
+            if self.fuse and self.expression(i) != f'v{i}':
+                continue
+            lines.append(f'    v{i} = {self._statement(i)}')
+        if self.fuse:
+            outputs = ', '.join(f'{s}: {self.expression(s)}'
+                                for s in self.ev.outputs.values())
+            lines.append(f'    return {{{outputs}}}')
+        else:
+            slots = ', '.join(f'v{i}' for i in range(len(self.ops)))
+            lines.append(f'    return [{slots}]')
+        return '\n'.join(lines) + '\n'
+
+
+def programHash(evaluator, fuse, useNumexpr):
+    """Hash of the program of the evaluator, and of the values of the
+    fixed parameters, which are folded into the code."""
+    h = hashlib.sha1()
+    h.update(repr((VERSION, fuse, useNumexpr)).encode())
+    for op in evaluator.ops:
+        h.update(repr((op.kind, op.args, op.payload)).encode())
+    fixed = sorted((name, float(b.initValue))
+                   for name, b in evaluator.betas.items() if b.status != 0)
+    h.update(repr(fixed).encode())
+    return h.hexdigest()
+
+
+def loadKernel(evaluator, fuse=True, useNumexpr=None,
+               cacheDir='__kernels__'):
+    """Kernel of the program of the evaluator, read from the cache
+    directory if it has already been generated, or generated and
+    stored there otherwise. cacheDir None disables the cache."""
+    if useNumexpr is None:
+        useNumexpr = numexpr is not None
+    key = programHash(evaluator, fuse, useNumexpr)
+    source = None
+    path = None
+    if cacheDir is not None:
+        path = os.path.join(cacheDir, f'kernel_{key}.py')
+        if os.path.exists(path):
+            with open(path) as f:
+                source = f.read()
+    if source is None:
+        source = _Generator(evaluator, fuse, useNumexpr).source()
+        if path is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(source)
+            os.replace(tmp, path)
+    namespace = {'np': np, 'numexpr': numexpr, 'loglogit': loglogit,
+                 '_panel': _panel, '_elem': _elem, '_ndtr': _ndtr}
+    exec(compile(source, path or f'<kernel {key}>', 'exec'), namespace)
+    return namespace['kernel']
+
+
+class CompiledEvaluator(Evaluator):
+    """Evaluator running generated code instead of interpreting its
+    program. The values are the same, the derivatives are obtained as
+    with the Evaluator.
+
+    Fixed parameters (status 1) are folded into the code: their values
+    cannot be changed with betaValues.
+    """
+
+    def __init__(self, formulas, cacheDir='__kernels__', useNumexpr=None,
+                 **kwargs):
+        super().__init__(formulas, **kwargs)
+        self.cacheDir = cacheDir
+        self.useNumexpr = useNumexpr
+        self._kernels = {}
+
+    def kernel(self, fuse):
+        if fuse not in self._kernels:
+            self._kernels[fuse] = loadKernel(self, fuse, self.useNumexpr,
+                                             self.cacheDir)
+        return self._kernels[fuse]
+
+    def _applySlot(self, ctx):
+        def apply(slot, values):
+            return self._apply(self.ops[slot], values, ctx)
+        return apply
+
+    def run(self, ctx):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return self.kernel(False)(ctx, self._applySlot(ctx))
+
+    def evaluate(self, data, betaValues=None, gradient=False):
+        if gradient:
+            return super().evaluate(data, betaValues, gradient)
+        ctx = self._context(data, betaValues)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = self.kernel(True)(ctx, self._applySlot(ctx))
+        return {k: self._output(values[s], ctx)
+                for k, s in self.outputs.items()}
@@ -0,0 +1,316 @@
+########################################
+#
+# @file latentclass.py
+#
+# Latent class logit estimated by Expectation-Maximization.
+#
+# Each class c has its own utilities V_c (a dict, as for
+# biogeme.models.logit) and a membership utility W_c, possibly
+# depending on covariates, so that the probability to belong to class
+# c is exp(W_c) / sum_l exp(W_l). With panel data, the class is
+# drawn once for each individual:
+#
+#   L_i = sum_c pi_ic prod_t P_c(y_it).
+#
+# E-step: the posterior membership h_ic = pi_ic prod_t P_c(y_it) / L_i
+# is computed for all individuals and classes at once.
+# M-step: each class is a logit weighted by h, and the membership
+# model is a logit with the fractional choices h. Problems that share
+# no parameter are independent, and are solved in parallel.
+#
+# EM is slow near the optimum. When the improvement of the log
+# likelihood becomes small, Newton iterations on the full likelihood
+# finish the job, and the standard errors are obtained from its
+# Hessian.
+#
+#######################################
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import optimize
+
+from aggregation import GroupIndex
+from design import FormulaArrays, UtilitySpecification
+from estimation import EstimationResults, finiteDifferenceHessian
+
+
+def _logit(V, dV, av, choice):
+    """log probability of the chosen alternative, and its gradient."""
+    rows = np.arange(len(choice))
+    Vav = np.where(av, V, -np.inf)
+    top = np.max(Vav, axis=1, keepdims=True)
+    E = np.exp(Vav - top)
+    total = np.sum(E, axis=1, keepdims=True)
+    P = E / total
+    logP = V[rows, choice] - top[:, 0] - np.log(total[:, 0])
+    G = dV[rows, choice] - np.einsum('nj,njk->nk', P, dV)
+    return logP, G
+
+
+class LatentClass:
+    """Latent class logit model.
+
+    classes: list of dicts V, one for each class.
+    av, choice: as for biogeme.models.logit, common to all classes.
+    membership: list of the membership utilities of the classes (the
+    first one is typically 0).
+    panel: name of the column identifying the individuals, or None if
+    each observation is an individual.
+    """
+
+    def __init__(self, classes, av, choice, data, membership, panel=None,
+                 definitions=None, numberOfThreads=None,
+                 modelName='latentClass'):
+        if len(membership) != len(classes):
+            raise ValueError("One membership utility is needed per class")
+        self.modelName = modelName
+        self.numberOfClasses = len(classes)
+        self.specs = [UtilitySpecification(V, av, choice, data, definitions)
+                      for V in classes]
+        self.membership = FormulaArrays(dict(enumerate(membership)), data,
+                                        definitions)
+        self.names = []
+        start = []
+        self.bounds = []
+        for block in self.specs + [self.membership]:
+            for name, s, b in zip(block.names, block.start, block.bounds):
+                if name not in self.names:
+                    self.names.append(name)
+                    start.append(s)
+                    self.bounds.append(b)
+        self.start = np.array(start, dtype=float)
+        self.index = [np.array([self.names.index(n) for n in block.names],
+                               dtype=np.intp)
+                      for block in self.specs + [self.membership]]
+        n = self.specs[0].size
+        if panel is None:
+            ids = np.arange(n)
+        else:
+            ids = np.asarray(data[panel])
+        self.groups = GroupIndex(ids, names=[panel or 'row'])
+        self.groupOf = np.empty(n, dtype=np.intp)
+        self.groupOf[self.groups.order] = np.repeat(
+            np.arange(len(self.groups)), self.groups.counts)
+        self.first = self.groups.order[self.groups.offsets]
+        self.size = len(self.groups)
+        self.numberOfThreads = numberOfThreads
+        self._last = None
+
+    def _blocks(self, x, blocks=None):
+        """Per row log probabilities and gradients of the classes in
+        blocks, as a dict, and, if the membership model (the last block)
+        is included, the per individual membership log probabilities
+        and their gradients. Default: all blocks."""
+        if blocks is None:
+            blocks = range(self.numberOfClasses + 1)
+        classes = {}
+        logPi = dW = None
+        for b in blocks:
+            if b < self.numberOfClasses:
+                spec = self.specs[b]
+                V, dV = spec.utilities(x[self.index[b]], jacobian=True)
+                classes[b] = _logit(V, dV, spec.av, spec.choice)
+            else:
+                W, dW = self.membership(x[self.index[-1]], jacobian=True)
+                W = W[self.first]
+                dW = dW[self.first]
+                top = np.max(W, axis=1, keepdims=True)
+                logPi = W - top - np.log(np.sum(np.exp(W - top), axis=1,
+                                                keepdims=True))
+        return classes, logPi, dW
+
+    def _evaluate(self, x):
+        x = np.asarray(x, dtype=float)
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1]
+        classes, logPi, dW = self._blocks(x)
+        logPc = np.column_stack([classes[c][0]
+                                 for c in range(self.numberOfClasses)])
+        ell = logPi + self.groups.sum(logPc)
+        top = np.max(ell, axis=1, keepdims=True)
+        logL = top[:, 0] + np.log(np.sum(np.exp(ell - top), axis=1))
+        h = np.exp(ell - logL[:, None])
+        rowScores = np.zeros((len(self.groupOf), len(self.names)))
+        for c, (_, G) in classes.items():
+            np.add.at(rowScores.T, self.index[c],
+                      (h[self.groupOf, c][:, None] * G).T)
+        scores = self.groups.sum(rowScores)
+        pi = np.exp(logPi)
+        np.add.at(scores.T, self.index[-1],
+                  np.einsum('ic,ick->ik', h - pi, dW).T)
+        result = (logL, scores, h)
+        self._last = (x.copy(), result)
+        return result
+
+    def loglikelihood(self, x):
+        logL, scores = self._evaluate(x)[:2]
+        return np.sum(logL), np.sum(scores, axis=0)
+
+    def scores(self, x):
+        """Gradient of the log likelihood of each individual."""
+        return self._evaluate(x)[1]
+
+    def posteriors(self, x):
+        """Posterior probability of each class (individuals x classes)."""
+        return self._evaluate(x)[2]
+
+    def _components(self):
+        """Groups of M-step problems (classes, and membership as the
+        last one) connected by shared parameters."""
+        blocks = list(range(len(self.index)))
+        owner = {}
+        parent = blocks[:]
+
+        def find(b):
+            while parent[b] != b:
+                parent[b] = parent[parent[b]]
+                b = parent[b]
+            return b
+
+        for b in blocks:
+            for p in self.index[b]:
+                if p in owner:
+                    parent[find(b)] = find(owner[p])
+                else:
+                    owner[p] = b
+        components = {}
+        for b in blocks:
+            components.setdefault(find(b), []).append(b)
+        return [c for c in components.values()
+                if any(len(self.index[b]) > 0 for b in c)]
+
+    def _maximization(self, x, h, blocks):
+        """Maximize the expected complete log likelihood with respect to
+        the parameters of the given blocks, with the posteriors h."""
+        params = np.unique(np.concatenate([self.index[b] for b in blocks]))
+        weights = h[self.groupOf]
+
+        def f(y):
+            z = x.copy()
+            z[params] = y
+            classes, logPi, dW = self._blocks(z, blocks)
+            value = 0.0
+            grad = np.zeros(len(self.names))
+            for b, (logP, G) in classes.items():
+                value += np.dot(weights[:, b], logP)
+                np.add.at(grad, self.index[b], weights[:, b] @ G)
+            if logPi is not None:
+                value += np.sum(h * logPi)
+                np.add.at(grad, self.index[-1],
+                          np.einsum('ic,ick->k', h - np.exp(logPi), dW))
+            return -value, -grad[params]
+
+        bounds = [self.bounds[p] for p in params]
+        opt = optimize.minimize(f, x[params], jac=True, method='L-BFGS-B',
+                                bounds=bounds)
+        return params, opt.x
+
+    def emStep(self, x, executor=None):
+        """One iteration of EM from x."""
+        h = self.posteriors(x)
+        x = x.copy()
+        components = self._components()
+        if executor is None:
+            results = [self._maximization(x, h, c) for c in components]
+        else:
+            results = list(executor.map(
+                lambda c: self._maximization(x, h, c), components))
+        for params, values in results:
+            x[params] = values
+        return x
+
+
+def _clip(x, bounds):
+    lower = np.array([-np.inf if b[0] is None else b[0] for b in bounds])
+    upper = np.array([np.inf if b[1] is None else b[1] for b in bounds])
+    return np.clip(x, lower, upper), lower, upper
+
+
+def _newton(model, x, maxIterations=20, tolerance=1e-6):
+    """Newton iterations with step halving on the full log likelihood.
+    Parameters at a bound, with a gradient pointing outside, are kept
+    fixed. Returns the parameters (None if the Hessian is not negative
+    definite), the number of iterations, and True if the gradient is
+    below tolerance (False if maxIterations is reached or the line
+    search fails)."""
+    iterations = 0
+    for iterations in range(1, maxIterations + 1):
+        L, g = model.loglikelihood(x)
+        _, lower, upper = _clip(x, model.bounds)
+        free = ~(((x <= lower) & (g < 0)) | ((x >= upper) & (g > 0)))
+        if np.max(np.abs(g[free]), initial=0.0) < tolerance:
+            return x, iterations, True
+        H = finiteDifferenceHessian(lambda y: model.loglikelihood(y)[1], x)
+        Hf = H[np.ix_(free, free)]
+        try:
+            np.linalg.cholesky(-Hf)
+        except np.linalg.LinAlgError:
+            return None, iterations, False
+        step = np.zeros_like(x)
+        step[free] = np.linalg.solve(-Hf, g[free])
+        t = 1.0
+        while t > 1e-8:
+            y, _, _ = _clip(x + t * step, model.bounds)
+            if model.loglikelihood(y)[0] >= L:
+                break
+            t *= 0.5
+        else:
+            break
+        x = y
+    return x, iterations, False
+
+
+def estimateEM(model, x0=None, maxIterations=1000, tolerance=1e-8,
+               polish=True, polishTolerance=1e-5):
+    """Estimate a LatentClass model by EM, starting from x0 (default:
+    model.start). When the relative improvement of the log likelihood
+    is below polishTolerance, Newton iterations are used instead of EM
+    (if polish is True and the Hessian is negative definite). If they
+    do not converge, EM continues from their last point. The
+    covariance matrix is obtained from the Hessian of the full log
+    likelihood at the solution."""
+    x = np.array(model.start if x0 is None else x0, dtype=float)
+    x, _, _ = _clip(x, model.bounds)
+    start = time.perf_counter()
+    initLogLike, _ = model.loglikelihood(x)
+    L = initLogLike
+    emIterations = 0
+    newtonIterations = 0
+    message = 'Maximum number of EM iterations reached'
+    with ThreadPoolExecutor(model.numberOfThreads) as executor:
+        for emIterations in range(1, maxIterations + 1):
+            x = model.emStep(x, executor)
+            previous, L = L, model.loglikelihood(x)[0]
+            change = (L - previous) / max(1.0, abs(L))
+            if change < tolerance:
+                message = 'Relative change of the log likelihood below ' \
+                          'tolerance'
+                break
+            if polish and change < polishTolerance:
+                y, newtonIterations, converged = _newton(model, x)
+                if converged:
+                    x = y
+                    message = 'Newton polishing'
+                    break
+                # Too far from the optimum: continue with EM only, from
+                # the last Newton iterate (the line search never
+                # decreases the log likelihood)
+                polish = False
+                if y is not None:
+                    x = y
+                    L = model.loglikelihood(x)[0]
+    optimizationTime = time.perf_counter() - start
+    L, g = model.loglikelihood(x)
+    H = finiteDifferenceHessian(lambda y: model.loglikelihood(y)[1], x)
+    return EstimationResults(model, x, L, g, H, model.scores(x),
+                             initLogLike=initLogLike,
+                             optimizationMessages={
+                                 'Algorithm': 'EM',
+                                 'Message': message,
+                                 'Number of EM iterations': emIterations,
+                                 'Number of Newton iterations':
+                                 newtonIterations,
+                                 'Optimization time': optimizationTime},
+                             numberOfThreads=model.numberOfThreads)
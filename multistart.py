@@ -0,0 +1,123 @@
+########################################
+#
+# @file multistart.py
+#
+# Multi-start maximization of non-concave likelihoods (cross nested
+# logit, latent classes, mixtures), whose maximization may end at a
+# local maximum depending on the starting values.
+#
+# Starting points are a Latin hypercube sample of a box around a base
+# point (the starting values of the model, or an earlier estimate),
+# clipped to the bounds of the parameters. From each of them, a short
+# pilot maximization (a few iterations) is run. The pilots run in
+# threads sharing the model, so that the data and the draws are not
+# copied. The pilots are then continued to convergence, all of them by
+# default, or only the best ones to save time.
+#
+# The converged solutions are grouped into basins (same log likelihood
+# and parameters up to a tolerance), which tells whether the best
+# solution is found from most starting points or only from a few. This
+# holds for the starting points that are converged: pilots that are not
+# continued belong to no basin, since where they would end is unknown.
+#
+#######################################
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from estimation import _limits, estimate
+from profilelikelihood import _maximize
+
+
+def startingPoints(model, numberOfStarts, base=None, width=1.0, seed=None):
+    """Latin hypercube sample of the box base +/- width * max(|base|,
+    1), clipped to the bounds of the model. The first point is base
+    itself."""
+    base = np.array(model.start if base is None else base, dtype=float)
+    k = len(base)
+    spread = width * np.maximum(np.abs(base), 1.0)
+    lower, upper = _limits(getattr(model, 'bounds', None), k)
+    low = np.maximum(base - spread, lower)
+    high = np.minimum(base + spread, upper)
+    sample = qmc.LatinHypercube(d=k, seed=seed).random(numberOfStarts - 1)
+    points = low + sample * (high - low)
+    return np.vstack([base, points])
+
+
+def _basins(solutions, logLikeTolerance, parameterTolerance):
+    """Basin of each solution: solutions with the same log likelihood
+    and parameters, up to the tolerances, are in the same basin.
+    Basins are numbered by decreasing log likelihood."""
+    order = np.argsort([-L for _, L in solutions])
+    representatives = []
+    basin = np.empty(len(solutions), dtype=int)
+    for i in order:
+        x, L = solutions[i]
+        for b, (y, M) in enumerate(representatives):
+            if abs(L - M) <= logLikeTolerance and \
+                    np.max(np.abs(x - y), initial=0.0) <= parameterTolerance:
+                basin[i] = b
+                break
+        else:
+            basin[i] = len(representatives)
+            representatives.append((x, L))
+    return basin
+
+
+def multiStart(model, numberOfStarts=20, base=None, width=1.0,
+               pilotIterations=10, keep=None, numberOfThreads=None, seed=None,
+               logLikeTolerance=1e-3, parameterTolerance=1e-2):
+    """Estimate model from several starting points.
+
+    numberOfStarts: number of starting points, see startingPoints.
+    pilotIterations: maximum number of iterations of the pilot runs.
+    keep: number of pilots, the best ones, continued to convergence
+    (all of them if None). Only these are grouped into basins.
+    numberOfThreads: default is the number of processors.
+
+    Returns the EstimationResults of the best solution, a data frame
+    with one row per starting point (pilot and final log likelihoods,
+    basin) and a data frame with one row per basin (log likelihood,
+    number of runs that reached it and parameters).
+    """
+    numberOfThreads = numberOfThreads or os.cpu_count() or 1
+    starts = startingPoints(model, numberOfStarts, base, width, seed)
+    pilotOptions = {'maxiter': pilotIterations}
+
+    def run(x0, options=None):
+        return _maximize(model, x0, options)
+
+    with ThreadPoolExecutor(numberOfThreads) as executor:
+        pilots = list(executor.map(lambda x: run(x, pilotOptions), starts))
+        best = np.argsort([-L for _, L, _ in pilots])
+        if keep is not None:
+            best = best[:keep]
+        finals = dict(zip(best, executor.map(
+            lambda i: run(pilots[i][0]), best)))
+    basin = _basins([(finals[i][0], finals[i][1]) for i in best],
+                    logLikeTolerance, parameterTolerance)
+    rows = []
+    for i, (x, L, nfev) in enumerate(pilots):
+        row = {'start': i, 'pilot logLike': L,
+               'pilot function evaluations': nfev}
+        if i in finals:
+            row['final logLike'] = finals[i][1]
+            row['final function evaluations'] = finals[i][2]
+            row['basin'] = basin[list(best).index(i)]
+        rows.append(row)
+    starts = pd.DataFrame(rows).set_index('start')
+    basins = []
+    for b in range(basin.max() + 1):
+        members = [i for k, i in enumerate(best) if basin[k] == b]
+        x, L, _ = finals[members[0]]
+        entry = {'basin': b, 'logLike': L, 'runs': len(members)}
+        entry.update(zip(model.names, x))
+        basins.append(entry)
+    basins = pd.DataFrame(basins).set_index('basin')
+    winner = max(finals, key=lambda i: finals[i][1])
+    results = estimate(model, finals[winner][0])
+    return results, starts, basins
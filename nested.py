@@ -0,0 +1,178 @@
+########################################
+#
+# @file nested.py
+#
+# Nested logit with nests defined by integer membership arrays.
+#
+# The nests are given as in biogeme.models.lognested, a tuple of
+# (MU, [alternatives]), where MU is a Beta or a number. Alternatives
+# that belong to no nest are each put in a nest of their own. The
+# alternatives are sorted by nest once, so that the inclusive values
+# of all nests are obtained for all rows with a segmented log-sum-exp
+# (np.maximum.reduceat and np.add.reduceat along the alternatives).
+#
+# With a scale mu at the top (mu = 1 for models.lognested, MU for
+# models.lognestedMevMu), the probability of alternative i in nest m
+# is given by
+#
+#   S_m = sum_{j in m} av_j exp(mu_m V_j),  I_m = (mu / mu_m) log S_m,
+#   log P_i = mu_m V_i - log S_m + I_m - log sum_l exp(I_l).
+#
+#######################################
+
+import numpy as np
+
+from design import UtilitySpecification
+from evaluator import isNumeric
+
+
+def _segmentedLogSumExp(A, offsets, segmentOf):
+    """log sum exp of the columns of A (rows x columns) within each
+    segment of contiguous columns. -inf entries are ignored. Returns
+    the log sum (rows x segments), and exp(A - max) (rows x columns)."""
+    top = np.maximum.reduceat(A, offsets, axis=1)
+    top = np.where(np.isfinite(top), top, 0.0)
+    E = np.exp(A - top[:, segmentOf])
+    total = np.add.reduceat(E, offsets, axis=1)
+    with np.errstate(divide='ignore'):
+        return top + np.log(total), E, total
+
+
+class NestedLogit:
+    """Nested logit model.
+
+    V, av, choice: as for biogeme.models.lognested.
+    nests: tuple of (MU, list of alternatives).
+    mu: scale of the top level (Beta or number), as the last argument
+    of models.lognestedMevMu.
+    """
+
+    def __init__(self, V, av, nests, choice, data, mu=1.0,
+                 definitions=None, modelName='nested'):
+        self.modelName = modelName
+        self.spec = UtilitySpecification(V, av, choice, data, definitions)
+        self.size = self.spec.size
+        alts = self.spec.alternatives
+        J = len(alts)
+        self.K = len(self.spec.names)
+        self.names = list(self.spec.names)
+        start = list(self.spec.start)
+        self.bounds = list(self.spec.bounds)
+
+        nestOf = np.full(J, -1, dtype=np.intp)
+        nestMu = []
+        for m, (param, members) in enumerate(nests):
+            for a in members:
+                j = alts.index(a)
+                if nestOf[j] >= 0:
+                    raise ValueError(f"Alternative {a} is in several nests")
+                nestOf[j] = m
+            nestMu.append(param)
+        for j in np.flatnonzero(nestOf < 0):
+            nestOf[j] = len(nestMu)
+            nestMu.append(1.0)
+
+        def parameter(p):
+            """Index of p in the parameters, or its constant value."""
+            if isNumeric(p):
+                return -1, float(p)
+            if type(p).__name__ != 'Beta':
+                raise ValueError(f"A nest parameter must be a Beta or a "
+                                 f"number: {p}")
+            if p.status != 0:
+                return -1, float(p.initValue)
+            if p.name not in self.names:
+                self.names.append(p.name)
+                start.append(p.initValue)
+                self.bounds.append((p.lb, p.ub))
+            return self.names.index(p.name), float(p.initValue)
+
+        resolved = [parameter(p) for p in nestMu]
+        self.nestIndex = np.array([r[0] for r in resolved], dtype=np.intp)
+        self.nestValue = np.array([r[1] for r in resolved])
+        self.topIndex, self.topValue = parameter(mu)
+        self.start = np.array(start, dtype=float)
+
+        self.nestOf = nestOf
+        self.order = np.argsort(nestOf, kind='stable')
+        sortedNests = nestOf[self.order]
+        self.numberOfNests = len(nestMu)
+        self.offsets = np.searchsorted(sortedNests,
+                                       np.arange(self.numberOfNests))
+        self.sortedNests = sortedNests
+        self._last = None
+
+    def _scales(self, x):
+        mus = np.where(self.nestIndex >= 0, x[self.nestIndex],
+                       self.nestValue)
+        top = x[self.topIndex] if self.topIndex >= 0 else self.topValue
+        return mus, top
+
+    def _evaluate(self, x):
+        x = np.asarray(x, dtype=float)
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1]
+        n = self.size
+        rows = np.arange(n)
+        V, dV = self.spec.utilities(x[:self.K], jacobian=True)
+        mus, mu = self._scales(x)
+        av = self.spec.av
+        a = V * mus[self.nestOf]
+        A = np.where(av, a, -np.inf)[:, self.order]
+        with np.errstate(invalid='ignore', over='ignore'):
+            logS, E, total = _segmentedLogSumExp(A, self.offsets,
+                                                 self.sortedNests)
+            I = (mu / mus) * logS
+            top = np.max(I, axis=1, keepdims=True)
+            lse = top[:, 0] + np.log(np.sum(np.exp(I - top), axis=1))
+            Q = np.exp(I - lse[:, None])
+            q = np.empty_like(E)
+            q[:, self.order] = E / total[:, self.sortedNests]
+        q = np.nan_to_num(q)
+        Q = np.nan_to_num(Q)
+        P = Q[:, self.nestOf] * q
+
+        i = self.spec.choice
+        m = self.nestOf[i]
+        mum = mus[m]
+        logP = a[rows, i] - logS[rows, m] + I[rows, m] - lse
+
+        scores = np.zeros((n, len(self.names)))
+        # Derivatives with respect to the utilities
+        G = -mu * P
+        sameNest = self.nestOf[None, :] == m[:, None]
+        G += np.where(sameNest, (mu - mum)[:, None] * q, 0.0)
+        G[rows, i] += mum
+        scores[:, :self.K] = np.einsum('nj,njk->nk', G, dV)
+
+        # Derivatives with respect to the scale of each nest
+        finite = np.isfinite(logS)
+        Vbar = np.add.reduceat((q * V)[:, self.order], self.offsets, axis=1)
+        D = np.where(finite, (mu / mus) * Vbar -
+                     mu * np.where(finite, logS, 0.0) / mus ** 2, 0.0)
+        own = np.zeros((n, self.numberOfNests))
+        own[rows, m] = 1.0
+        dmus = own * (V[rows, i] - Vbar[rows, m])[:, None] + (own - Q) * D
+        for k in np.flatnonzero(self.nestIndex >= 0):
+            scores[:, self.nestIndex[k]] += dmus[:, k]
+
+        # Derivative with respect to the top scale
+        if self.topIndex >= 0:
+            ratio = np.where(finite, logS, 0.0) / mus
+            scores[:, self.topIndex] += ratio[rows, m] - \
+                np.sum(Q * ratio, axis=1)
+
+        result = (logP, scores, P)
+        self._last = (x.copy(), result)
+        return result
+
+    def loglikelihood(self, x):
+        logP, scores, _ = self._evaluate(x)
+        return np.sum(logP), np.sum(scores, axis=0)
+
+    def scores(self, x):
+        return self._evaluate(x)[1]
+
+    def probabilities(self, x):
+        """Probability of each alternative (rows x alternatives)."""
+        return self._evaluate(x)[2]
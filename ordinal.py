@@ -0,0 +1,161 @@
+########################################
+#
+# @file ordinal.py
+#
+# Ordinal logit and probit with any number of ordered categories.
+#
+# The latent variable is U + e, where e is logistic (ordinal logit)
+# or normal (ordinal probit), and category k (k=1,...,C) is observed
+# if tau_{k-1} < U + e <= tau_k, with tau_0 = -inf and tau_C = +inf.
+# The thresholds are parameterized as in 18ordinalLogit.py:
+#
+#    tau_1 = tau1,  tau_k = tau_{k-1} + delta_k,  delta_k >= 0,
+#
+# which guarantees that they are ordered. The cumulative distribution
+# is evaluated once on the array (rows x C+1) of tau - U, and the
+# probabilities of all categories are its differences.
+#
+#######################################
+
+import numpy as np
+from scipy import special, stats
+
+from design import FormulaArrays
+from evaluator import Evaluator
+
+
+def _logistic(x):
+    F = special.expit(x)
+    f = F * (1 - F)
+    return F, f, f * (1 - 2 * F)
+
+
+def _normal(x):
+    F = special.ndtr(x)
+    f = np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+    with np.errstate(invalid='ignore'):
+        return F, f, -x * f
+
+
+_distributions = {'logit': (_logistic, stats.logistic.ppf),
+                  'probit': (_normal, stats.norm.ppf)}
+
+
+class OrderedModel:
+    """Ordinal model.
+
+    U: expression of the utility (without constant, which is not
+    identified with the thresholds).
+    response: expression of the observed category.
+    categories: ordered list of the values of the response. Default
+    is the sorted distinct values observed.
+    distribution: 'logit' or 'probit'.
+    """
+
+    def __init__(self, U, response, data, categories=None,
+                 distribution='logit', definitions=None,
+                 modelName='ordinal'):
+        self.modelName = modelName
+        self.utility = FormulaArrays({'U': U}, data, definitions)
+        y = Evaluator({'y': response},
+                      definitions=definitions).evaluate(data)['y']
+        if categories is None:
+            categories = list(np.unique(y))
+        self.categories = list(categories)
+        C = len(self.categories)
+        if C < 2:
+            raise ValueError("At least two categories are needed")
+        self.y = np.full(len(y), -1, dtype=np.intp)
+        for k, c in enumerate(self.categories):
+            self.y[y == c] = k
+        if np.any(self.y < 0):
+            raise ValueError("Some responses are not in the categories")
+        self.size = len(y)
+        self.cdf, ppf = _distributions[distribution]
+        self.K = len(self.utility.names)
+        self.names = self.utility.names + ['tau1'] + \
+            [f'delta{k}' for k in range(2, C)]
+        # Starting thresholds reproduce the observed shares at the
+        # starting utility.
+        U0 = self.utility(self.utility.start)[0][:, 0]
+        shares = np.bincount(self.y, minlength=C) / self.size
+        cum = np.clip(np.cumsum(shares)[:-1], 1e-3, 1 - 1e-3)
+        tau0 = ppf(cum) + np.mean(U0)
+        tau0 = np.maximum.accumulate(tau0)
+        self.start = np.concatenate([self.utility.start, tau0[:1],
+                                     np.maximum(np.diff(tau0), 0.1)])
+        self.bounds = self.utility.bounds + [(None, None)] + \
+            [(0, None)] * (C - 2)
+        # tau = A theta, for the threshold parameters theta
+        self.A = np.tril(np.ones((C - 1, C - 1)))
+        # The second derivatives of a nonlinear utility are not computed
+        self.exactHessian = self.utility.linear
+        self._last = None
+
+    def thresholds(self, x):
+        return self.A @ x[self.K:]
+
+    def probabilities(self, x):
+        """Probability of each category (rows x categories)."""
+        U = self.utility(x[:self.K])[0][:, 0]
+        tau = self.thresholds(x)
+        ext = np.concatenate(([-np.inf], tau, [np.inf]))
+        F, _, _ = self.cdf(ext[None, :] - U[:, None])
+        return np.diff(F, axis=1)
+
+    def _evaluate(self, x):
+        x = np.asarray(x, dtype=float)
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1]
+        C = len(self.categories)
+        U, dU = self.utility(x[:self.K], jacobian=True)
+        U = U[:, 0]
+        dU = dU[:, 0, :]
+        tau = self.thresholds(x)
+        ext = np.concatenate(([-np.inf], tau, [np.inf]))
+        with np.errstate(invalid='ignore'):
+            F, f, g = self.cdf(ext[None, :] - U[:, None])
+        f = np.nan_to_num(f)
+        g = np.nan_to_num(g)
+        rows = np.arange(self.size)
+        hi = self.y + 1
+        lo = self.y
+        P = F[rows, hi] - F[rows, lo]
+        fhi, flo = f[rows, hi], f[rows, lo]
+        ghi, glo = g[rows, hi], g[rows, lo]
+        # Derivatives with respect to z = (U, tau_lo, tau_hi)
+        dP = np.column_stack([flo - fhi, -flo, fhi])
+        d2P = np.zeros((self.size, 3, 3))
+        d2P[:, 0, 0] = ghi - glo
+        d2P[:, 0, 1] = d2P[:, 1, 0] = glo
+        d2P[:, 0, 2] = d2P[:, 2, 0] = -ghi
+        d2P[:, 1, 1] = -glo
+        d2P[:, 2, 2] = ghi
+        dlogP = dP / P[:, None]
+        d2logP = d2P / P[:, None, None] - \
+            dlogP[:, :, None] * dlogP[:, None, :]
+        # Jacobian of z with respect to all the parameters
+        Aext = np.vstack([np.zeros(C - 1), self.A, np.zeros(C - 1)])
+        Jz = np.zeros((self.size, 3, len(self.names)))
+        Jz[:, 0, :self.K] = dU
+        Jz[:, 1, self.K:] = Aext[lo]
+        Jz[:, 2, self.K:] = Aext[hi]
+        scores = np.einsum('nz,nzp->np', dlogP, Jz)
+        H = np.einsum('nzp,nzw,nwq->pq', Jz, d2logP, Jz)
+        result = (np.log(P), scores, H)
+        self._last = (x.copy(), result)
+        return result
+
+    def loglikelihood(self, x):
+        logP, scores, _ = self._evaluate(x)
+        return np.sum(logP), np.sum(scores, axis=0)
+
+    def scores(self, x):
+        return self._evaluate(x)[1]
+
+    def hessian(self, x):
+        """Analytic Hessian. It is exact when the utility is linear in
+        the parameters (exactHessian). Otherwise, the second derivatives
+        of the utility are neglected, and estimate computes the
+        covariance matrix from finite differences."""
+        return self._evaluate(x)[2]
@@ -0,0 +1,221 @@
+########################################
+#
+# @file probit.py
+#
+# Binary and multinomial probit with analytic derivatives.
+#
+# The errors of the utilities, differenced with respect to the last
+# alternative, are normal with covariance L L', where L is lower
+# triangular with L[0,0] = 1 for the normalization of the scale. The
+# free elements of L are estimated with the coefficients of the
+# utilities, under the names CHOL_i_j.
+#
+# The observations are grouped by chosen alternative and availability
+# pattern. Within a group, the probability is the probability that a
+# normal vector of dimension m (number of other available
+# alternatives) is negative:
+#  - m = 1 (binary case): computed exactly with log_ndtr,
+#  - m > 1: GHK simulator with scrambled Halton draws.
+# The derivatives are propagated through the GHK recursion,
+# simultaneously for all rows and draws of a chunk of observations.
+# Chunks are processed in parallel by numberOfThreads threads.
+#
+#######################################
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.special import log_ndtr, ndtri
+from scipy.stats import qmc
+
+from design import UtilitySpecification
+
+_LOG_SQRT_2PI = 0.5 * np.log(2 * np.pi)
+
+
+def _logpdf(x):
+    return -0.5 * x * x - _LOG_SQRT_2PI
+
+
+def choleskyDerivative(C, dS):
+    """Derivatives of the Cholesky factor C of S, given the derivatives
+    dS (m x m x parameters) of S."""
+    Cinv = np.linalg.inv(C)
+    X = np.einsum('ij,jkp,lk->ilp', Cinv, dS, Cinv)
+    X = np.tril(X.transpose(2, 0, 1)).transpose(1, 2, 0)
+    idx = np.arange(C.shape[0])
+    X[idx, idx, :] *= 0.5
+    return np.einsum('ij,jkp->ikp', C, X)
+
+
+def ghk(mu, dmu, C, dC, u):
+    """Log of the probability that mu + C e is negative, e standard
+    normal, and its derivatives.
+
+    mu: (rows x m), dmu: (rows x m x parameters),
+    C: (m x m) lower triangular, dC: (m x m x parameters),
+    u: uniform draws (rows x draws x m-1), ignored if m is 1.
+    Returns log P (rows) and d log P (rows x parameters).
+    """
+    n, m = mu.shape
+    if m == 1:
+        a = -mu[:, 0] / C[0, 0]
+        da = -dmu[:, 0, :] / C[0, 0] - a[:, None] * dC[0, 0, :] / C[0, 0]
+        logP = log_ndtr(a)
+        lam = np.exp(_logpdf(a) - logP)
+        return logP, lam[:, None] * da
+    R = u.shape[1]
+    P = dmu.shape[2]
+    logPr = np.zeros((n, R))
+    dlogPr = np.zeros((n, R, P))
+    e = []
+    de = []
+    for k in range(m):
+        s = np.broadcast_to(-mu[:, k, None], (n, R))
+        ds = np.broadcast_to(-dmu[:, k, None, :], (n, R, P))
+        for l in range(k):
+            s = s - C[k, l] * e[l]
+            ds = ds - dC[k, l, :] * e[l][..., None] - C[k, l] * de[l]
+        a = s / C[k, k]
+        da = ds / C[k, k] - a[..., None] * (dC[k, k, :] / C[k, k])
+        lp = log_ndtr(a)
+        logPr += lp
+        dlogPr += np.exp(_logpdf(a) - lp)[..., None] * da
+        if k < m - 1:
+            t = np.clip(u[..., k] * np.exp(lp), 1e-300, 1 - 1e-16)
+            ek = ndtri(t)
+            dek = (u[..., k] * np.exp(_logpdf(a) - _logpdf(ek)))[..., None] \
+                * da
+            e.append(ek)
+            de.append(dek)
+    top = np.max(logPr, axis=1, keepdims=True)
+    w = np.exp(logPr - top)
+    logP = top[:, 0] + np.log(np.mean(w, axis=1))
+    dlogP = np.einsum('nr,nrp->np', w, dlogPr) / np.sum(w, axis=1)[:, None]
+    return logP, dlogP
+
+
+class Probit:
+    """Probit model with availability conditions.
+
+    V, av, choice: as for biogeme.models.logit.
+    numberOfDraws: number of Halton draws for the GHK simulator, used
+    only with more than two available alternatives.
+    numberOfThreads: default is the number of processors.
+    """
+
+    def __init__(self, V, av, choice, data, numberOfDraws=200, seed=None,
+                 numberOfThreads=None, chunkSize=2000, definitions=None,
+                 modelName='probit'):
+        self.modelName = modelName
+        self.spec = UtilitySpecification(V, av, choice, data, definitions)
+        self.size = self.spec.size
+        self.numberOfThreads = numberOfThreads or os.cpu_count() or 1
+        self.chunkSize = chunkSize
+        alts = self.spec.alternatives
+        J = len(alts)
+        self.dim = J - 1
+        self.cholIndex = [(a, b) for a in range(self.dim)
+                          for b in range(a + 1) if (a, b) != (0, 0)]
+        cholNames = [f"CHOL_{alts[a]}_{alts[b]}" for a, b in self.cholIndex]
+        self.K = len(self.spec.names)
+        self.names = self.spec.names + cholNames
+        self.start = np.concatenate(
+            [self.spec.start,
+             [1.0 if a == b else 0.0 for a, b in self.cholIndex]])
+        self.bounds = self.spec.bounds + \
+            [(1e-3, None) if a == b else (None, None)
+             for a, b in self.cholIndex]
+        self._groups()
+        self.draws = None
+        if self.dim >= 2 and any(len(g[1]) > 1 for g in self.groups):
+            sampler = qmc.Halton(d=self.dim - 1, scramble=True, seed=seed)
+            self.draws = sampler.random(self.size * numberOfDraws).reshape(
+                self.size, numberOfDraws, self.dim - 1)
+        self._last = None
+
+    def _groups(self):
+        """Groups of observations with the same chosen alternative and
+        the same available alternatives."""
+        code = self.spec.choice * (1 << self.dim + 1) + \
+            self.spec.av.dot(1 << np.arange(self.dim + 1))
+        self.groups = []
+        for c in np.unique(code):
+            rows = np.flatnonzero(code == c)
+            i = self.spec.choice[rows[0]]
+            others = [j for j in np.flatnonzero(self.spec.av[rows[0]])
+                      if j != i]
+            if not others:
+                continue
+            # Rows of the differences U_j - U_i, j in others, in terms of
+            # the utilities differenced with respect to the last one.
+            M = np.zeros((len(others), self.dim))
+            for r, j in enumerate(others):
+                if j < self.dim:
+                    M[r, j] += 1.0
+                if i < self.dim:
+                    M[r, i] -= 1.0
+            self.groups.append((rows, others, i, M))
+
+    def covariance(self, theta):
+        """Cholesky factor L, and its derivatives with respect to the
+        covariance parameters."""
+        L = np.zeros((self.dim, self.dim))
+        L[0, 0] = 1.0
+        dL = np.zeros((self.dim, self.dim, len(self.cholIndex)))
+        for p, (a, b) in enumerate(self.cholIndex):
+            L[a, b] = theta[p]
+            dL[a, b, p] = 1.0
+        return L, dL
+
+    def _task(self, rows, others, i, C, dC, V, dV):
+        mu = V[rows][:, others] - V[rows, i][:, None]
+        dmuBeta = dV[rows][:, others, :] - dV[rows, i][:, None, :]
+        dmu = np.zeros(mu.shape + (len(self.names),))
+        dmu[:, :, :self.K] = dmuBeta
+        u = None if self.draws is None else self.draws[rows]
+        return rows, ghk(mu, dmu, C, dC, u)
+
+    def _evaluate(self, x):
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1]
+        V, dV = self.spec.utilities(x[:self.K], jacobian=True)
+        L, dL = self.covariance(x[self.K:])
+        Omega = L @ L.T
+        dOmega = np.einsum('ijp,kj->ikp', dL, L)
+        dOmega = dOmega + dOmega.transpose(1, 0, 2)
+        tasks = []
+        for rows, others, i, M in self.groups:
+            S = M @ Omega @ M.T
+            C = np.linalg.cholesky(S)
+            dS = np.einsum('ij,jkp,lk->ilp', M, dOmega, M)
+            dC = np.zeros(C.shape + (len(self.names),))
+            dC[:, :, self.K:] = choleskyDerivative(C, dS)
+            for start in range(0, len(rows), self.chunkSize):
+                chunk = rows[start:start + self.chunkSize]
+                tasks.append((chunk, others, i, C, dC, V, dV))
+        logP = np.zeros(self.size)
+        scores = np.zeros((self.size, len(self.names)))
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if self.numberOfThreads > 1 and len(tasks) > 1:
+                with ThreadPoolExecutor(self.numberOfThreads) as pool:
+                    done = list(pool.map(lambda t: self._task(*t), tasks))
+            else:
+                done = [self._task(*t) for t in tasks]
+        for rows, (lp, dlp) in done:
+            logP[rows] = lp
+            scores[rows] = dlp
+        self._last = (x.copy(), (logP, scores))
+        return logP, scores
+
+    def loglikelihood(self, x):
+        logP, scores = self._evaluate(np.asarray(x, dtype=float))
+        return np.sum(logP), np.sum(scores, axis=0)
+
+    def scores(self, x):
+        return self._evaluate(np.asarray(x, dtype=float))[1]
+
+    def probabilities(self, x):
+        """Probability of the chosen alternative of each observation."""
+        return np.exp(self._evaluate(np.asarray(x, dtype=float))[0])
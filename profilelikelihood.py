@@ -0,0 +1,181 @@
+########################################
+#
+# @file profilelikelihood.py
+#
+# Profile likelihood of one parameter, such as LAMBDA in 08boxcox.py,
+# MU in 09nested.py or ALPHA_EXISTING in 11cnl.py:
+#
+#   Lp(v) = max over the other parameters of L(v, others),
+#
+# and the likelihood based confidence interval {v: 2 (L - Lp(v)) <=
+# chi2(1)}, which, unlike the Wald interval, follows the shape of the
+# likelihood and respects the bounds.
+#
+# The grid is cut at the estimate into chains of neighbouring points,
+# estimated in parallel threads. Each chain starts from the estimates
+# of the other parameters predicted by their covariance with the
+# profiled parameter, and each point starts from the estimates at the
+# previous point of its chain, so that a few iterations suffice.
+#
+# The model is any object with the interface of estimation.estimate
+# (e.g. CrossNestedLogit, NestedLogit, or a ModelFamily member for a
+# biogeme formula).
+#
+#######################################
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, stats
+
+from estimation import estimate
+
+
+class _Restricted:
+    """Model with one parameter fixed to a value."""
+
+    def __init__(self, model, index, value):
+        self.model = model
+        self.index = index
+        self.value = value
+        keep = [i for i in range(len(model.names)) if i != index]
+        self.keep = keep
+        self.names = [model.names[i] for i in keep]
+        bounds = getattr(model, 'bounds', None)
+        self.bounds = None if bounds is None else [bounds[i] for i in keep]
+
+    def full(self, x):
+        return np.insert(np.asarray(x, dtype=float), self.index, self.value)
+
+    def loglikelihood(self, x):
+        L, g = self.model.loglikelihood(self.full(x))
+        return L, np.asarray(g)[self.keep]
+
+
+def _maximize(restricted, x0, options):
+    def f(x):
+        L, g = restricted.loglikelihood(x)
+        return -L, -g
+
+    bounds = restricted.bounds
+    if bounds is not None and all(b == (None, None) for b in bounds):
+        bounds = None
+    opt = optimize.minimize(f, x0, jac=True, method='L-BFGS-B',
+                            bounds=bounds, options=options)
+    return opt.x, -opt.fun, opt.nfev
+
+
+def _chain(model, index, values, xhat, slope, options):
+    """Profile along values, ordered from the estimate outwards."""
+    rows = []
+    previous = None
+    for value in values:
+        restricted = _Restricted(model, index, value)
+        if previous is None:
+            x0 = (xhat + slope * (value - xhat[index]))[restricted.keep]
+        else:
+            x0 = previous
+        if restricted.bounds is not None:
+            x0 = np.clip(x0, [-np.inf if b[0] is None else b[0]
+                              for b in restricted.bounds],
+                         [np.inf if b[1] is None else b[1]
+                          for b in restricted.bounds])
+        x, L, nfev = _maximize(restricted, x0, options)
+        previous = x
+        rows.append((value, L, nfev, restricted.full(x)))
+    return rows
+
+
+def _crossing(values, lr, critical):
+    """Value where the signed root of the likelihood ratio, linear
+    interpolated between grid points, reaches the critical value.
+    values are ordered from the estimate outwards."""
+    root = np.sqrt(np.maximum(lr, 0))
+    target = np.sqrt(critical)
+    for k in range(1, len(values)):
+        if root[k] >= target:
+            t = (target - root[k - 1]) / (root[k] - root[k - 1])
+            return values[k - 1] + t * (values[k] - values[k - 1])
+    return np.nan
+
+
+def profileLikelihood(model, parameter, results=None, grid=None,
+                      numberOfPoints=21, width=4.0, level=0.95,
+                      numberOfThreads=2, options=None):
+    """Profile log likelihood of a parameter, and the likelihood based
+    confidence interval.
+
+    parameter: name of the parameter, in model.names.
+    results: EstimationResults of the model. Estimated if None.
+    grid: values of the parameter. By default, numberOfPoints values
+    within width standard errors of the estimate, inside the bounds.
+    numberOfThreads: number of chains estimated in parallel. Each side
+    of the estimate is cut into contiguous chains.
+    options: passed to scipy.optimize.minimize.
+
+    Returns a data frame with one row per grid point (value of the
+    parameter, profile log likelihood, likelihood ratio statistic,
+    number of function evaluations and estimates of the other
+    parameters), and a dict with the likelihood based and Wald
+    intervals. A bound of the likelihood based interval is NaN if the
+    likelihood ratio does not reach the critical value on the grid.
+    """
+    if results is None:
+        results = estimate(model)
+    d = results.data
+    names = list(model.names)
+    index = names.index(parameter)
+    xhat = np.asarray(d.betaValues, dtype=float)
+    cov = np.asarray(d.varCovar, dtype=float)
+    stdErr = np.sqrt(max(cov[index, index], 0.0))
+    # Conditional mean of the other parameters given the profiled one
+    slope = cov[:, index] / cov[index, index] if stdErr > 0 \
+        else np.zeros(len(names))
+    lb, ub = (None, None)
+    if getattr(model, 'bounds', None) is not None:
+        lb, ub = model.bounds[index]
+    if grid is None:
+        grid = xhat[index] + width * stdErr * np.linspace(-1, 1,
+                                                          numberOfPoints)
+        grid = np.clip(grid, -np.inf if lb is None else lb,
+                       np.inf if ub is None else ub)
+    grid = np.unique(np.asarray(grid, dtype=float))
+    left = grid[grid < xhat[index]][::-1]
+    right = grid[grid >= xhat[index]]
+    # Chains ordered from the estimate outwards, so that each point is
+    # warm-started from a point closer to the estimate
+    sides = [s for s in (left, right) if len(s)]
+    perSide = max(1, numberOfThreads // max(len(sides), 1))
+    chains = [c for s in sides
+              for c in np.array_split(s, min(perSide, len(s)))]
+    with ThreadPoolExecutor(max(len(chains), 1)) as executor:
+        done = list(executor.map(
+            lambda c: _chain(model, index, c, xhat, slope, options),
+            chains))
+    rows = sorted((r for chain in done for r in chain), key=lambda r: r[0])
+    logLike = d.logLike
+    table = pd.DataFrame({parameter: [r[0] for r in rows],
+                          'logLike': [r[1] for r in rows],
+                          'function evaluations': [r[2] for r in rows]})
+    # The profile cannot be above the maximum. A higher value means
+    # that the estimate was not the maximum.
+    logLike = max(logLike, table['logLike'].max())
+    table['LR'] = 2 * (logLike - table['logLike'])
+    for j, name in enumerate(names):
+        if j != index:
+            table[name] = [r[3][j] for r in rows]
+    critical = stats.chi2.ppf(level, 1)
+    values = table[parameter].to_numpy()
+    lr = table['LR'].to_numpy()
+    below = values < xhat[index]
+    z = stats.norm.ppf(0.5 + level / 2)
+    interval = {
+        'Lower': _crossing(np.append(xhat[index], values[below][::-1]),
+                           np.append(0.0, lr[below][::-1]), critical),
+        'Upper': _crossing(np.append(xhat[index], values[~below]),
+                           np.append(0.0, lr[~below]), critical),
+        'Wald lower': xhat[index] - z * stdErr,
+        'Wald upper': xhat[index] + z * stdErr}
+    interval = {k: float(v) for k, v in interval.items()}
+    return table, interval
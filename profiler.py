@@ -0,0 +1,214 @@
+########################################
+#
+# @file profiler.py
+#
+# Where the evaluation of a likelihood spends its time, node by node.
+#
+# A NodeProfiler attached to an Evaluator (e.g. family.evaluator of a
+# ModelFamily) times each operation of its program, that is each node
+# of the expression tree: computation of its value, and of its
+# derivatives (tangents) with respect to the parameters. The memory of
+# a node is the size of the arrays it produces (rows x draws for the
+# nodes depending on draws). The times and sizes are accumulated over
+# all the evaluations, e.g. over a full estimation, until the profiler
+# is detached.
+#
+# The report lists the subtrees with the largest inclusive time (the
+# node and everything below it), and draws the tree from the log
+# likelihood downwards, flame graph style, so that one sees whether
+# the cost is in the PanelLikelihoodTrajectory branches, in the terms
+# with draws, or in the log(MonteCarlo(...)) at the top. The tree can
+# also be written as folded stacks, for flamegraph.pl or speedscope.
+#
+# A node shared by several parents (common subexpression) is drawn
+# under the first one only, so that the times add up to the total.
+#
+#######################################
+
+import threading
+import time
+
+import numpy as np
+
+from evaluator import _tangentRule
+
+_names = {'mc': 'MonteCarlo', 'panel': 'PanelLikelihoodTrajectory',
+          'loglogit': 'LogLogit', 'elem': 'Elem', 'sum': 'bioMultSum',
+          'derive': 'Derive'}
+
+
+class NodeProfiler:
+    """Time and memory of each node of the program of an evaluator.
+
+    Attaches itself to the evaluator. detach() stops the profiling.
+    """
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        n = len(evaluator.ops)
+        self.calls = np.zeros(n, dtype=int)
+        self.valueTime = np.zeros(n)
+        self.tangentTime = np.zeros(n)
+        self.memory = np.zeros(n)
+        self._lock = threading.Lock()
+        evaluator.profiler = self
+
+    def detach(self):
+        self.evaluator.profiler = None
+
+    def apply(self, i, values, ctx):
+        ev = self.evaluator
+        start = time.perf_counter()
+        value = ev._apply(ev.ops[i], values, ctx)
+        elapsed = time.perf_counter() - start
+        size = value.nbytes if isinstance(value, np.ndarray) else 0
+        with self._lock:
+            self.calls[i] += 1
+            self.valueTime[i] += elapsed
+            self.memory[i] += size
+        return value
+
+    def tangent(self, i, args, targs, value, ctx):
+        start = time.perf_counter()
+        t = _tangentRule(self.evaluator.ops[i], args, targs, value, ctx)
+        elapsed = time.perf_counter() - start
+        size = t.nbytes if isinstance(t, np.ndarray) else 0
+        with self._lock:
+            self.tangentTime[i] += elapsed
+            self.memory[i] += size
+        return t
+
+    # Report
+
+    def selfTime(self):
+        return self.valueTime + self.tangentTime
+
+    def inclusive(self, quantity=None):
+        """Quantity (default: self time) of each node summed over its
+        subtree, each node of the subtree counted once."""
+        quantity = self.selfTime() if quantity is None else quantity
+        ev = self.evaluator
+        return np.array([quantity[ev.subgraph(i)].sum()
+                         for i in range(len(ev.ops))])
+
+    def label(self, i, depth=1):
+        """Readable description of node i, its arguments described down
+        to depth levels."""
+        op = self.evaluator.ops[i]
+        if op.kind in ('var', 'beta', 'draw'):
+            return str(op.payload)
+        if op.kind == 'const':
+            return f'{op.payload:g}'
+        name = _names.get(op.kind, op.kind)
+        if depth == 0:
+            return f'{name}(...)'
+        args = [self.label(a, depth - 1) for a in op.args[:3]]
+        if len(op.args) > 3:
+            args.append('...')
+        return f"{name}({', '.join(args)})"
+
+    def table(self, top=10):
+        """Rows (dicts) of the top subtrees by inclusive time."""
+        total = self.selfTime().sum()
+        inclusive = self.inclusive()
+        memory = self.inclusive(self.memory)
+        selfTime = self.selfTime()
+        rows = []
+        for i in np.argsort(-inclusive)[:top]:
+            rows.append({'node': int(i), 'expression': self.label(i),
+                         'inclusive time [s]': float(inclusive[i]),
+                         'share': float(inclusive[i] / total) if total else 0,
+                         'self time [s]': float(selfTime[i]),
+                         'derivatives [s]': float(self.tangentTime[i]),
+                         'calls': int(self.calls[i]),
+                         'inclusive memory [MB]': float(memory[i]) / 2 ** 20})
+        return rows
+
+    def _tree(self, roots):
+        """Children of each node in the drawn tree: each node under the
+        first parent reaching it, in a depth first traversal."""
+        ev = self.evaluator
+        placed = set()
+        children = {}
+
+        def visit(i):
+            placed.add(i)
+            children[i] = []
+            for a in ev.ops[i].args:
+                if a not in placed:
+                    children[i].append(a)
+                    visit(a)
+
+        for r in roots:
+            if r not in placed:
+                visit(r)
+        return children
+
+    def _roots(self):
+        return sorted(set(self.evaluator.outputs.values()))
+
+    def flame(self, minimumShare=0.01, depth=1):
+        """Lines of the tree drawn from the outputs, with the inclusive
+        time of each node; subtrees below minimumShare of the total
+        are omitted."""
+        roots = self._roots()
+        children = self._tree(roots)
+        selfTime = self.selfTime()
+        inclusive = {}
+
+        def total(i):
+            inclusive[i] = selfTime[i] + sum(total(c) for c in children[i])
+            return inclusive[i]
+
+        grand = sum(total(r) for r in roots) or 1.0
+        lines = []
+
+        def draw(i, indent):
+            share = inclusive[i] / grand
+            if share < minimumShare:
+                return
+            bar = '#' * max(1, int(round(40 * share)))
+            lines.append(f"{100 * share:5.1f}% {inclusive[i]:8.3f}s "
+                         f"{indent}{self.label(i, depth)} {bar}")
+            for c in sorted(children[i], key=lambda c: -inclusive[c]):
+                draw(c, indent + '  ')
+
+        for r in roots:
+            draw(r, '')
+        return lines
+
+    def report(self, top=10, minimumShare=0.01):
+        """Text report: totals, top subtrees and tree."""
+        selfTime = self.selfTime()
+        lines = [f"Evaluation: {self.valueTime.sum():.3f}s, derivatives: "
+                 f"{self.tangentTime.sum():.3f}s, memory allocated: "
+                 f"{self.memory.sum() / 2 ** 20:.1f} MB",
+                 f"Top {top} subtrees (inclusive time):"]
+        for row in self.table(top):
+            lines.append(f"  {row['inclusive time [s]']:8.3f}s "
+                         f"{100 * row['share']:5.1f}% "
+                         f"self {row['self time [s]']:7.3f}s "
+                         f"{row['inclusive memory [MB]']:9.1f} MB  "
+                         f"{row['expression']}")
+        lines.append("Tree (inclusive time):")
+        lines.extend(self.flame(minimumShare))
+        if not selfTime.sum():
+            lines.append("No evaluation was recorded")
+        return '\n'.join(lines)
+
+    def writeFolded(self, path):
+        """Folded stacks (one line per node: path from the output and
+        self time in microseconds), for flamegraph.pl or speedscope."""
+        roots = self._roots()
+        children = self._tree(roots)
+        selfTime = self.selfTime()
+        with open(path, 'w') as f:
+            def write(i, stack):
+                stack = stack + [f'{self.label(i, 0)}#{i}'.replace(';', ',')]
+                micro = int(round(selfTime[i] * 1e6))
+                if micro > 0:
+                    f.write(f"{';'.join(stack)} {micro}\n")
+                for c in children[i]:
+                    write(c, stack)
+            for r in roots:
+                write(r, [])
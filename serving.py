@@ -0,0 +1,260 @@
+########################################
+#
+# @file serving.py
+#
+# Local prediction service for estimated choice models.
+#
+# The estimation results are read once from the pickle file produced
+# by biogeme.estimate(), and the formulas are compiled once by the
+# vectorized evaluator. Requests arriving within a few milliseconds of
+# each other are grouped and scored as one array.
+#
+# Protocol (HTTP/1.1, over TCP or a Unix socket):
+#   POST /predict/<model>
+#                   body: a JSON object with the attributes of one
+#                   observation, or a list of such objects.
+#                   Answer: the value of each formula, per object.
+#                   When only one model is served, /predict is enough.
+#   GET  /metrics   latency percentiles and batching statistics, and
+#                   the counters of the cache if any (see cache.py).
+#
+#######################################
+
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import biogeme.results as res
+from evaluator import Evaluator
+
+
+class PredictionModel:
+    """Estimated model ready to score observations.
+
+    formulas: dict associating names with the expressions to report,
+    typically the choice probabilities.
+    pickleFile: estimation results of the model.
+    """
+
+    def __init__(self, formulas, pickleFile, definitions=None, **kwargs):
+        self.evaluator = Evaluator(formulas, definitions=definitions,
+                                   **kwargs)
+        self.pickleFile = pickleFile
+        self.load()
+
+    def load(self):
+        self.mtime = os.stat(self.pickleFile).st_mtime_ns
+        results = res.bioResults(pickleFile=self.pickleFile)
+        self.betas = results.getBetaValues()
+
+    def refresh(self):
+        """Reload the parameters if the pickle file has been modified
+        since it was read. Returns True if it has."""
+        if os.stat(self.pickleFile).st_mtime_ns == self.mtime:
+            return False
+        self.load()
+        return True
+
+    def score(self, data):
+        """Value of the formulas for each row of data, a pandas data
+        frame or a dict of columns."""
+        return self.evaluator.evaluate(data, self.betas)
+
+    def scoreRecords(self, records):
+        """Same as score, for a list of dicts. Returns a list of dicts."""
+        data = pd.DataFrame.from_records(records)
+        values = self.score(data)
+        return [{k: float(v[i]) for k, v in values.items()}
+                for i in range(len(records))]
+
+
+class LatencyStats:
+    """Latencies of the last requests, in seconds."""
+
+    def __init__(self, size=10000):
+        self.latencies = np.zeros(size)
+        self.count = 0
+        self.batches = 0
+        self.batchedRequests = 0
+
+    def record(self, latency):
+        self.latencies[self.count % len(self.latencies)] = latency
+        self.count += 1
+
+    def recordBatch(self, size):
+        self.batches += 1
+        self.batchedRequests += size
+
+    def summary(self):
+        n = min(self.count, len(self.latencies))
+        stats = {'requests': self.count,
+                 'batches': self.batches,
+                 'meanBatchSize': self.batchedRequests / self.batches
+                 if self.batches else 0.0}
+        if n > 0:
+            p50, p99 = np.percentile(self.latencies[:n], [50, 99])
+            stats['p50_ms'] = 1000 * p50
+            stats['p99_ms'] = 1000 * p99
+        return stats
+
+
+class MicroBatcher:
+    """Collects the requests received during maxDelay seconds, or until
+    maxBatch observations are waiting, and scores them together."""
+
+    def __init__(self, model, maxDelay=0.002, maxBatch=4096, stats=None):
+        self.model = model
+        self.maxDelay = maxDelay
+        self.maxBatch = maxBatch
+        self.stats = LatencyStats() if stats is None else stats
+        self.queue = None
+        self.worker = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.ensure_future(self._work())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+    async def predict(self, records):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((records, future))
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.maxDelay
+            while size < self.maxBatch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._score(pending)
+
+    def _score(self, pending):
+        records = [r for recs, _ in pending for r in recs]
+        self.stats.recordBatch(len(pending))
+        try:
+            scored = self.model.scoreRecords(records)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for recs, future in pending:
+            if not future.done():
+                future.set_result(scored[start:start + len(recs)])
+            start += len(recs)
+
+
+def _response(status, body):
+    payload = json.dumps(body).encode()
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+              500: 'Internal Server Error'}[status]
+    header = (f"HTTP/1.1 {status} {reason}\r\n"
+              f"Content-Type: application/json\r\n"
+              f"Content-Length: {len(payload)}\r\n\r\n")
+    return header.encode() + payload
+
+
+class PredictionServer:
+    """Minimal HTTP server answering prediction requests.
+
+    models: a PredictionModel, or a dict associating a name with each
+    model served.
+    """
+
+    def __init__(self, models, maxDelay=0.002, maxBatch=4096):
+        if isinstance(models, PredictionModel):
+            models = {'': models}
+        self.stats = {name: LatencyStats() for name in models}
+        self.batchers = {name: MicroBatcher(m, maxDelay, maxBatch,
+                                            self.stats[name])
+                         for name, m in models.items()}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                method, path, _ = requestLine.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    k, v = line.decode().split(':', 1)
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                writer.write(await self._dispatch(method, path, body))
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        if method == 'GET' and path == '/metrics':
+            metrics = {name: s.summary() for name, s in self.stats.items()}
+            for name, batcher in self.batchers.items():
+                if hasattr(batcher.model, 'statistics'):
+                    metrics[name]['cache'] = batcher.model.statistics()
+            return _response(200, metrics)
+        name = path[len('/predict/'):] if path.startswith('/predict/') \
+            else None
+        if len(self.batchers) == 1 and path == '/predict':
+            name = next(iter(self.batchers))
+        if method != 'POST' or name not in self.batchers:
+            return _response(404, {'error': f'{method} {path}'})
+        start = time.perf_counter()
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            return _response(400, {'error': str(e)})
+        single = isinstance(request, dict)
+        records = [request] if single else request
+        try:
+            scored = await self.batchers[name].predict(records)
+        except Exception as e:
+            return _response(500, {'error': str(e)})
+        self.stats[name].record(time.perf_counter() - start)
+        return _response(200, scored[0] if single else scored)
+
+    async def serve(self, host='127.0.0.1', port=8080, path=None):
+        """Serve forever, on a Unix socket if path is given, on
+        host:port otherwise."""
+        for batcher in self.batchers.values():
+            batcher.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def serve(models, host='127.0.0.1', port=8080, path=None, **kwargs):
+    asyncio.run(PredictionServer(models, **kwargs).serve(host, port, path))
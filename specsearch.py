@@ -0,0 +1,255 @@
+########################################
+#
+# @file specsearch.py
+#
+# Search over alternative specifications, such as the thresholds of
+# the piecewise linear travel time of SpecTest_SM_piecewise.py, a
+# Box-Cox transform (08boxcox.py) on some variables, or a segmentation
+# (SpecTest_SM_segmentation.py).
+#
+# A candidate is a dict of choices, e.g. {'thresholds': (90, 180, 270),
+# 'boxcox': True, 'segment': 'MALE'}. The candidates are the grid of all
+# the combinations of a search space, or a random sample of it. A
+# function provided by the analyst builds the log likelihood of a
+# candidate.
+#
+# The candidates are estimated on a pool of processes. Each candidate
+# starts from the estimates of the closest candidate already finished,
+# and each process keeps a ColumnCache, so that the derived columns
+# (e.g. the pieces of TRAIN_TT for given thresholds) are computed once
+# for all the candidates it estimates. The results are written to the
+# output file as they arrive, and ranked by BIC (or rho-bar-square).
+#
+# A candidate whose Hessian is singular at the estimates has parameters
+# that are not identified (e.g. a variable constant within a segment):
+# its log likelihood is valid, but not its number of parameters, so it
+# is flagged and not ranked.
+#
+#######################################
+
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from estimation import estimate
+from family import ColumnCache, ModelFamily
+
+
+def gridCandidates(space):
+    """All the combinations of the values in space, a dict associating
+    each choice with the list of its possible values."""
+    keys = list(space)
+    return [dict(zip(keys, values))
+            for values in itertools.product(*[space[k] for k in keys])]
+
+
+def randomCandidates(space, numberOfCandidates, seed=None):
+    """Random sample, without replacement, of the grid of space."""
+    grid = gridCandidates(space)
+    rng = np.random.default_rng(seed)
+    size = min(numberOfCandidates, len(grid))
+    return [grid[i] for i in rng.choice(len(grid), size, replace=False)]
+
+
+def distance(a, b):
+    """Number of choices that differ between two candidates. Sequences
+    of numbers of the same length (thresholds) count for their
+    relative difference."""
+    total = 0.0
+    for k in set(a) | set(b):
+        x, y = a.get(k), b.get(k)
+        if x == y:
+            continue
+        try:
+            x = np.asarray(x, dtype=float)
+            y = np.asarray(y, dtype=float)
+        except (TypeError, ValueError):
+            total += 1.0
+            continue
+        if x.shape != y.shape or x.ndim == 0:
+            total += 1.0
+        else:
+            scale = np.sum(np.abs(x)) + np.sum(np.abs(y))
+            total += np.sum(np.abs(x - y)) / scale if scale else 0.0
+    return total
+
+
+# State of each process of the pool, set by _initialize
+_worker = {}
+
+
+def _initialize(build, data, kwargs):
+    _worker['build'] = build
+    _worker['data'] = data
+    _worker['kwargs'] = kwargs
+    _worker['cache'] = ColumnCache()
+
+
+def singularHessian(H, tolerance=1e-8):
+    """True if the smallest eigenvalue of minus the Hessian H is not
+    larger than tolerance times the largest (in absolute value)."""
+    if np.size(H) == 0:
+        return False
+    eigenvalues = np.abs(np.linalg.eigvalsh(-np.asarray(H, dtype=float)))
+    return bool(np.min(eigenvalues) <= tolerance * np.max(eigenvalues))
+
+
+def _estimateCandidate(candidate, start):
+    """Estimates of one candidate, starting from start, a dict
+    associating each member (segment) with the values of its
+    parameters."""
+    t0 = time.perf_counter()
+    spec = _worker['build'](candidate)
+    loglike, segments = spec if isinstance(spec, tuple) else (spec, None)
+    family = ModelFamily(_worker['data'], columnCache=_worker['cache'],
+                         **_worker['kwargs'])
+    if segments:
+        for name, condition in segments.items():
+            family.add(str(name), loglike, sample=condition)
+    else:
+        family.add('model', loglike)
+    family.compile()
+    hits = _worker['cache'].hits
+    row = {'logLike': 0.0, 'nullLogLike': 0.0, 'nparam': 0,
+           'sampleSize': 0, 'singular Hessian': False}
+    estimates = {}
+    for name, member in family.members.items():
+        values = start.get(name) or next(iter(start.values()), {})
+        x0 = [values.get(n, s) for n, s in zip(member.names, member.start)]
+        results = estimate(member, x0)
+        d = results.data
+        estimates[name] = results.getBetaValues()
+        row['logLike'] += d.logLike
+        # The null log likelihood is at the starting values of the
+        # specification, not at the warm start
+        row['nullLogLike'] += member.loglikelihood(member.start)[0]
+        row['nparam'] += d.nparam
+        row['sampleSize'] += member.size
+        if singularHessian(d.H):
+            row['singular Hessian'] = True
+    row['cached columns'] = _worker['cache'].hits - hits
+    row['time [s]'] = time.perf_counter() - t0
+    row['process'] = os.getpid()
+    return row, estimates
+
+
+def _criteria(row):
+    k, n = row['nparam'], row['sampleSize']
+    row['akaike'] = 2 * k - 2 * row['logLike']
+    row['bayesian'] = k * np.log(n) - 2 * row['logLike']
+    row['rhoBarSquare'] = 1 - (row['logLike'] - k) / row['nullLogLike']
+    return row
+
+
+_columns = ['logLike', 'nullLogLike', 'nparam', 'sampleSize', 'akaike',
+            'bayesian', 'rhoBarSquare', 'singular Hessian', 'cached columns',
+            'time [s]', 'process', 'error']
+
+
+def _label(value):
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(v) for v in value)
+    return value
+
+
+def specificationSearch(build, data, candidates, processes=None,
+                        output=None, criterion='bayesian', callback=None,
+                        **kwargs):
+    """Estimate all the candidates and rank them.
+
+    build: function of a candidate returning its log likelihood (an
+    expression), or a tuple (log likelihood, segments) where segments
+    is a dict associating the name of each segment with the expression
+    selecting its rows (e.g. {'females': MALE == 0, 'males': MALE ==
+    1}). The segments are estimated separately, and their log
+    likelihoods and numbers of parameters summed. It must be defined at
+    the top level of a module if the processes are not forked.
+    data: the data frame, e.g. database.data.
+    processes: size of the pool (number of CPUs if None). With 1, the
+    candidates are estimated in this process.
+    output: name of a CSV file, to which each result is appended as
+    soon as it is available.
+    criterion: 'bayesian', 'akaike' (smallest first) or 'rhoBarSquare'
+    (largest first).
+    callback: function called with each row of the table, as soon as
+    it is available.
+    kwargs: passed to ModelFamily (definitions, panel, numberOfDraws...).
+
+    Returns the table of the candidates, sorted by the criterion. The
+    candidates with a singular Hessian (see singularHessian) and those
+    that failed are not ranked, and come last.
+    """
+    processes = processes or os.cpu_count()
+    candidates = list(candidates)
+    if output is not None and os.path.exists(output):
+        os.remove(output)
+    keys = list(dict.fromkeys(k for c in candidates for k in c))
+    columns = ['candidate'] + keys + ['warm start'] + _columns
+    finished = []
+    rows = []
+
+    def start(candidate):
+        if not finished:
+            return None, {}
+        d = [distance(candidate, c) for _, c, _ in finished]
+        index, _, estimates = finished[int(np.argmin(d))]
+        return index, estimates
+
+    def record(index, candidate, neighbour, compute):
+        row = {'candidate': index}
+        row.update({k: _label(v) for k, v in candidate.items()})
+        row['warm start'] = neighbour
+        try:
+            result, estimates = compute()
+        except Exception as e:
+            row['error'] = f'{type(e).__name__}: {e}'
+        else:
+            row.update(_criteria(result))
+            finished.append((index, candidate, estimates))
+        rows.append(row)
+        if output is not None:
+            pd.DataFrame([row], columns=columns).to_csv(
+                output, mode='a', index=False, header=len(rows) == 1)
+        if callback is not None:
+            callback(row)
+
+    if processes == 1:
+        _initialize(build, data, kwargs)
+        for index, candidate in enumerate(candidates):
+            neighbour, values = start(candidate)
+            record(index, candidate, neighbour,
+                   lambda: _estimateCandidate(candidate, values))
+    else:
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            context = None
+        with ProcessPoolExecutor(processes, mp_context=context,
+                                 initializer=_initialize,
+                                 initargs=(build, data, kwargs)) as executor:
+            pending = list(enumerate(candidates))
+            running = {}
+            while pending or running:
+                while pending and len(running) < processes:
+                    index, candidate = pending.pop(0)
+                    neighbour, values = start(candidate)
+                    future = executor.submit(_estimateCandidate, candidate,
+                                             values)
+                    running[future] = (index, candidate, neighbour)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(*running.pop(future), future.result)
+    table = pd.DataFrame(rows, columns=columns).set_index('candidate')
+    table = table.dropna(axis=1, how='all')
+    if criterion in table:
+        identified = table['singular Hessian'].eq(False)
+        ranked = table[identified].sort_values(
+            criterion, ascending=criterion != 'rhoBarSquare')
+        ranked['rank'] = np.arange(1, len(ranked) + 1)
+        table = pd.concat([ranked, table[~identified]])
+    return table
@@ -0,0 +1,130 @@
+########################################
+#
+# @file test_evaluator.py
+#
+# The vectorized evaluator against biogeme itself: formulas built with
+# the expressions and models of the installed biogeme are evaluated by
+# the Evaluator and by BIOGEME.simulate, on a small random data set.
+#
+# Run with: python -m pytest test_evaluator.py
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+import pytest
+
+db = pytest.importorskip('biogeme.database')
+bio = pytest.importorskip('biogeme.biogeme')
+models = pytest.importorskip('biogeme.models')
+from biogeme.expressions import (Beta, Derive, Elem, MonteCarlo,
+                                 PanelLikelihoodTrajectory, Variable,
+                                 bioDraws, bioMultSum, exp, log)
+
+try:
+    from biogeme.expressions import bioLogLogit
+except ImportError:
+    # biogeme 3.2: the class is _bioLogLogit, built by models.loglogit
+    from biogeme.models import loglogit as bioLogLogit
+
+from evaluator import Evaluator
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 50
+    df = pd.DataFrame({'X1': rng.normal(size=n), 'X2': rng.normal(size=n),
+                       'X3': rng.normal(size=n),
+                       'CHOICE': rng.integers(1, 4, n),
+                       'AV3': rng.integers(0, 2, n)})
+    df.loc[df.CHOICE == 3, 'AV3'] = 1
+    return df
+
+
+def _formulas():
+    B1 = Beta('B1', 0.5, None, None, 0)
+    B2 = Beta('B2', -0.3, None, None, 0)
+    MU = Beta('MU', 2.0, 1, None, 0)
+    ALPHA = Beta('ALPHA', 0.4, 0, 1, 0)
+    X1, X2, X3 = Variable('X1'), Variable('X2'), Variable('X3')
+    CHOICE = Variable('CHOICE')
+    V = {1: B1 * X1, 2: B2 * X2, 3: B1 * X3}
+    av = {1: 1, 2: 1, 3: Variable('AV3')}
+    nested = (MU, [1, 2]), (1.0, [3])
+    cnl = (MU, {1: 1.0, 2: ALPHA}), (1.0, {2: 1 - ALPHA, 3: 1.0})
+    return {'loglogit': bioLogLogit(V, av, CHOICE),
+            'lognested': models.lognested(V, av, nested, CHOICE),
+            'cnl': models.cnl_avail(V, av, cnl, 2),
+            'logcnl': models.logcnl_avail(V, av, cnl, CHOICE),
+            'multsum': bioMultSum([B1 * X1, B2 * X2, X3]),
+            'elem': Elem({1: X1, 2: X2, 3: X3}, CHOICE)}
+
+
+def test_formulas_match_biogeme(data):
+    formulas = _formulas()
+    expected = bio.BIOGEME(db.Database('test', data), formulas).simulate()
+    result = Evaluator(formulas).evaluate(data)
+    for name in formulas:
+        np.testing.assert_allclose(result[name], expected[name],
+                                   rtol=1e-10, err_msg=name)
+
+
+def test_gradient_of_mev_models(data):
+    formulas = _formulas()
+    ev = Evaluator(formulas)
+    x = {name: float(b.initValue) for name, b in ev.betas.items()}
+    _, gradient = ev.evaluate(data, x, gradient=True)
+    for j, name in enumerate(ev.freeBetas()):
+        h = 1e-6
+        up = ev.evaluate(data, dict(x, **{name: x[name] + h}))
+        down = ev.evaluate(data, dict(x, **{name: x[name] - h}))
+        for f in ('lognested', 'logcnl'):
+            np.testing.assert_allclose(
+                gradient[f][:, j], (up[f] - down[f]) / (2 * h),
+                rtol=1e-5, atol=1e-8, err_msg=f'{f} {name}')
+
+
+def test_derive(data):
+    # Elasticity of a nested logit probability, as in 11cnl_serve.py
+    formulas = _formulas()
+    prob = exp(formulas['lognested'])
+    X1 = Variable('X1')
+    elasticity = {'elasticity': Derive(prob, 'X1') * X1 / prob}
+    expected = bio.BIOGEME(db.Database('test', data), elasticity).simulate()
+    result = Evaluator(elasticity).evaluate(data)
+    np.testing.assert_allclose(result['elasticity'], expected['elasticity'],
+                               rtol=1e-8)
+
+
+def test_draws(data):
+    B = Beta('B', 0.5, None, None, 0)
+    ev = Evaluator(MonteCarlo(exp(B * bioDraws('E', 'NORMAL'))),
+                   numberOfDraws=20000, seed=1)
+    assert ev.drawTypes == {'E': 'NORMAL'}
+    value = ev.evaluate(data)['loglike']
+    np.testing.assert_allclose(value, np.exp(0.5 ** 2 / 2), rtol=0.02)
+
+
+def test_database_draws(data):
+    # The draws generated by biogeme in the database, with a panel
+    data['ID'] = np.arange(len(data)) // 5
+    database = db.Database('test', data)
+    database.panel('ID')
+    B = Beta('B', 0.5, None, None, 0)
+    X1 = Variable('X1')
+    trajectory = PanelLikelihoodTrajectory(
+        exp(-(B * bioDraws('E', 'NORMAL') + X1 * bioDraws('A', 'UNIFORM'))
+            ** 2))
+    logprob = log(MonteCarlo(trajectory))
+    biogeme = bio.BIOGEME(database, logprob, numberOfDraws=10)
+    try:
+        expected = biogeme.calculateLikelihood([0.5])
+    except TypeError:
+        # biogeme 3.2: scaled argument
+        expected = biogeme.calculateLikelihood([0.5], scaled=False)
+    ev = Evaluator(logprob, panel='ID')
+    ev.useDatabaseDraws(database)
+    assert ev.numberOfDraws == 10
+    result = ev.evaluate(database.data)['loglike']
+    np.testing.assert_allclose(np.sum(result), expected, rtol=1e-10)
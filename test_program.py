@@ -0,0 +1,302 @@
+########################################
+#
+# @file test_program.py
+#
+# The vectorized evaluator without biogeme. The formulas are built
+# with small stand-in classes having the names and the attributes of
+# the biogeme expressions read by Evaluator._compileNode, so that these
+# tests run where biogeme is not installed (see test_evaluator.py for
+# the comparison with biogeme itself).
+#
+# Run with: python -m pytest test_program.py
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from estimation import estimate
+from evaluator import Evaluator
+from family import ModelFamily
+from instrumentation import Monitor
+from kernels import CompiledEvaluator
+
+
+class _Expression:
+    def __add__(self, other):
+        return Plus(self, other)
+
+    def __radd__(self, other):
+        return Plus(other, self)
+
+    def __sub__(self, other):
+        return Minus(self, other)
+
+    def __rsub__(self, other):
+        return Minus(other, self)
+
+    def __mul__(self, other):
+        return Times(self, other)
+
+    def __rmul__(self, other):
+        return Times(other, self)
+
+    def __truediv__(self, other):
+        return Divide(self, other)
+
+    def __neg__(self):
+        return UnaryMinus(self)
+
+
+class Beta(_Expression):
+    def __init__(self, name, initValue, lb, ub, status):
+        self.name = name
+        self.initValue = initValue
+        self.lb = lb
+        self.ub = ub
+        self.status = status
+
+
+class Variable(_Expression):
+    def __init__(self, name):
+        self.name = name
+
+
+class bioDraws(_Expression):
+    def __init__(self, name, drawType):
+        self.name = name
+        self.drawType = drawType
+
+
+class _Binary(_Expression):
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+
+class Plus(_Binary):
+    pass
+
+
+class Minus(_Binary):
+    pass
+
+
+class Times(_Binary):
+    pass
+
+
+class Divide(_Binary):
+    pass
+
+
+class _Unary(_Expression):
+    def __init__(self, child):
+        self.child = child
+
+
+class UnaryMinus(_Unary):
+    pass
+
+
+class exp(_Unary):
+    pass
+
+
+class log(_Unary):
+    pass
+
+
+class bioNormalCdf(_Unary):
+    pass
+
+
+class MonteCarlo(_Unary):
+    pass
+
+
+class PanelLikelihoodTrajectory(_Unary):
+    pass
+
+
+class Elem(_Expression):
+    def __init__(self, dictOfExpressions, keyExpression):
+        self.dictOfExpressions = dictOfExpressions
+        self.keyExpression = keyExpression
+
+
+class bioLogLogit(_Expression):
+    def __init__(self, util, av, choice):
+        self.util = util
+        self.av = av
+        self.choice = choice
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 40
+    df = pd.DataFrame({'ID': np.repeat(np.arange(10), 4),
+                       'X1': rng.normal(size=n), 'X2': rng.normal(size=n),
+                       'X3': rng.normal(size=n),
+                       'CHOICE': rng.integers(1, 4, n),
+                       'AV3': rng.integers(0, 2, n)})
+    df.loc[df.CHOICE == 3, 'AV3'] = 1
+    return df
+
+
+def _utilities(B1, B2, X1, X2, X3):
+    return {1: B1 * X1, 2: B2 * X2, 3: B1 * X3}
+
+
+def _formulas():
+    B1 = Beta('B1', 0.5, None, None, 0)
+    B2 = Beta('B2', -0.3, None, None, 0)
+    SIGMA = Beta('SIGMA', 0.8, None, None, 0)
+    X1, X2, X3 = Variable('X1'), Variable('X2'), Variable('X3')
+    CHOICE = Variable('CHOICE')
+    av = {1: 1, 2: 1, 3: Variable('AV3')}
+    V = _utilities(B1, B2, X1, X2, X3)
+    R = B1 + SIGMA * bioDraws('R', 'NORMAL')
+    mixed = _utilities(R, B2, X1, X2, X3)
+    return {'loglogit': bioLogLogit(V, av, CHOICE),
+            'mixture': log(MonteCarlo(exp(bioLogLogit(mixed, av, CHOICE)))),
+            'elem': Elem({1: exp(B1 * X1), 2: -B2 * X2, 3: X3 / 2}, CHOICE),
+            'probit': log(bioNormalCdf(B1 * X1 - B2 * X2))}
+
+
+def _numericalGradient(ev, data, betas, h=1e-6):
+    columns = {k: [] for k in ev.outputs}
+    for name in ev.freeBetas():
+        up = ev.evaluate(data, {**betas, name: betas[name] + h})
+        down = ev.evaluate(data, {**betas, name: betas[name] - h})
+        for k in ev.outputs:
+            columns[k].append((up[k] - down[k]) / (2 * h))
+    return {k: np.stack(c, axis=1) for k, c in columns.items()}
+
+
+def test_loglogit(data):
+    ev = Evaluator(_formulas()['loglogit'])
+    value = ev.evaluate(data)['loglike']
+    V = np.stack([0.5 * data.X1, -0.3 * data.X2, 0.5 * data.X3], axis=1)
+    V[data.AV3 == 0, 2] = -np.inf
+    P = np.exp(V) / np.exp(V).sum(axis=1, keepdims=True)
+    expected = np.log(P[np.arange(len(data)), data.CHOICE - 1])
+    assert np.allclose(value, expected)
+
+
+def test_gradient(data):
+    ev = Evaluator(_formulas(), numberOfDraws=200, seed=1)
+    betas = {'B1': 0.7, 'B2': -0.2, 'SIGMA': 1.1}
+    _, gradient = ev.evaluate(data, betas, gradient=True)
+    numerical = _numericalGradient(ev, data, betas)
+    for k in ev.outputs:
+        assert np.allclose(gradient[k], numerical[k], atol=1e-6), k
+
+
+def test_panel_gradient(data):
+    B1 = Beta('B1', 0.5, None, None, 0)
+    SIGMA = Beta('SIGMA', 0.8, None, None, 0)
+    B2 = Beta('B2', -0.3, None, None, 0)
+    R = B1 + SIGMA * bioDraws('R', 'NORMAL')
+    V = _utilities(R, B2, Variable('X1'), Variable('X2'), Variable('X3'))
+    av = {1: 1, 2: 1, 3: Variable('AV3')}
+    prob = exp(bioLogLogit(V, av, Variable('CHOICE')))
+    ev = Evaluator(log(MonteCarlo(PanelLikelihoodTrajectory(prob))),
+                   numberOfDraws=100, seed=1, panel='ID')
+    betas = {'B1': 0.7, 'B2': -0.2, 'SIGMA': 1.1}
+    value, gradient = ev.evaluate(data, betas, gradient=True)
+    assert value['loglike'].shape == (10,)
+    numerical = _numericalGradient(ev, data, betas)
+    assert np.allclose(gradient['loglike'], numerical['loglike'], atol=1e-6)
+
+
+def _family(data, **kwargs):
+    B1 = Beta('B1', 0.5, None, None, 0)
+    P = Beta('P', 0.0, None, None, 0)
+    X1, X2, X3 = Variable('X1'), Variable('X2'), Variable('X3')
+    av = {1: 1, 2: 1, 3: Variable('AV3')}
+    CHOICE = Variable('CHOICE')
+    family = ModelFamily(data, **kwargs)
+    family.add('A', bioLogLogit(_utilities(B1, P, X1, X2, X3), av, CHOICE))
+    family.add('B', bioLogLogit(_utilities(B1, 0, X1, X2, X3), av, CHOICE))
+    return family
+
+
+@pytest.mark.parametrize('numberOfThreads', [1, 3])
+def test_family_members_alternating(data, numberOfThreads):
+    # With several threads, the chunks are evaluated in parallel
+    family = _family(data, chunkSize=15,
+                     numberOfThreads=numberOfThreads).compile()
+    A, B = family.members['A'], family.members['B']
+    steps = [(A, [0.5, 1.0]), (B, [0.3]), (A, [0.5, 0.0]), (B, [0.5]),
+             (A, [0.3, 1.0]), (A, [0.3, 0.0]), (B, [0.3])]
+    for member, x in steps:
+        fresh = _family(data, chunkSize=15).compile()
+        expected = fresh.members[member.modelName].loglikelihood(x)
+        L, g = member.loglikelihood(x)
+        assert np.isclose(L, expected[0], rtol=1e-12)
+        assert np.allclose(g, expected[1], rtol=1e-12)
+
+
+def test_nested_pairs_after_estimation(data):
+    B1 = Beta('B1', 0.5, None, None, 0)
+    B2 = Beta('B2', 0.0, None, None, 0)
+    B3 = Beta('B3', 0.0, None, None, 0)
+    X1, X2, X3 = Variable('X1'), Variable('X2'), Variable('X3')
+    av = {1: 1, 2: 1, 3: Variable('AV3')}
+    CHOICE = Variable('CHOICE')
+    family = ModelFamily(data, chunkSize=15)
+    family.add('R', bioLogLogit({1: B1 * X1, 2: 0, 3: B1 * X3}, av, CHOICE))
+    family.add('U', bioLogLogit({1: B1 * X1, 2: B2 * X2, 3: B1 * X3},
+                                av, CHOICE))
+    family.add('U2', bioLogLogit({1: B1 * X1, 2: B2 * X2, 3: B3 + B1 * X3},
+                                 av, CHOICE))
+    family.addSegmentation('S', bioLogLogit({1: B1 * X1, 2: 0, 3: B1 * X3},
+                                            av, CHOICE),
+                           {'low': data.ID < 5, 'high': data.ID >= 5})
+    before = family.nestedPairs()
+    family.estimate()
+    after = family.nestedPairs()
+    assert after == before
+    assert sorted(p for p in after if isinstance(p[1], str)) == [
+        ('R', 'U'), ('R', 'U2'), ('S', 'U'), ('S', 'U2'), ('U', 'U2')]
+    assert ('S', ['S_low', 'S_high']) in after
+    assert len(family.lrTests()) == 6
+
+
+@pytest.mark.parametrize('useNumexpr', [False, True])
+def test_kernels(data, useNumexpr):
+    if useNumexpr:
+        pytest.importorskip('numexpr')
+    formulas = _formulas()
+    formulas['sum'] = log(exp(formulas['probit']) + 1) * 2 - 1
+    betas = {'B1': 0.7, 'B2': -0.2, 'SIGMA': 1.1}
+    expected = Evaluator(formulas, numberOfDraws=50,
+                         seed=1).evaluate(data, betas)
+    ev = CompiledEvaluator(formulas, cacheDir=None, useNumexpr=useNumexpr,
+                           numberOfDraws=50, seed=1)
+    value = ev.evaluate(data, betas)
+    for k in expected:
+        assert np.allclose(value[k], expected[k], rtol=1e-12), k
+
+
+def test_monitor(data):
+    family = _family(data, numberOfThreads=2).compile()
+    monitor = Monitor()
+    estimate(family.members['A'], monitor=monitor)
+    events = monitor.iterationEvents()
+    assert events and all(e['threads'] == 2 for e in events)
+    assert all(e['gradient norm'] >= 0 for e in events)
+
+
+def test_family_parallel_estimation(data):
+    # Members estimated in parallel threads, each evaluating its chunks
+    # in parallel: a chunk may be busy with another member
+    expected = _family(data).estimate()
+    results = _family(data, chunkSize=10, numberOfThreads=2).estimate(
+        numberOfThreads=2)
+    for name, r in results.items():
+        assert np.isclose(r.data.logLike, expected[name].data.logLike,
+                          rtol=1e-8)
@@ -0,0 +1,220 @@
+########################################
+#
+# @file threadtuning.py
+#
+# Number of threads of the likelihood evaluations, chosen by
+# measurement instead of by habit (forcing 1 thread, or taking the
+# default).
+#
+# A few evaluations of the log likelihood (with its gradient) are
+# timed for several numbers of threads, on the data of the model. The
+# measured scaling curve is kept in a JSON file, keyed by the machine
+# and by a hash of the model (its program, number of draws and number
+# of rows), so that the next run of the same model on the same machine
+# reads the decision instead of measuring again.
+#
+# Other jobs running on the machine are accounted for: the number of
+# threads is limited to the processors available to this process,
+# minus the load average, when the curve is measured and when a cached
+# curve is used.
+#
+# The model is any object with the interface of estimation.estimate
+# and a numberOfThreads attribute used by its evaluations: a member of
+# a ModelFamily (chunks evaluated in parallel), Probit, LatentClass...
+# For the models estimated by biogeme itself, BiogemeLikelihood times
+# calculateLikelihoodAndDerivatives of BIOGEME objects created with
+# each number of threads, which is fixed when the object is created.
+#
+#######################################
+
+import hashlib
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class BiogemeLikelihood:
+    """Log likelihood and gradient computed by biogeme, for tuneThreads.
+    A BIOGEME object is created on the database for each number of
+    threads, e.g.
+
+        model = BiogemeLikelihood(database, logprob, modelName='21probit')
+        numberOfThreads, curve = tuneThreads(model)
+        biogeme = bio.BIOGEME(database, logprob,
+                              numberOfThreads=numberOfThreads)
+
+    kwargs: passed to bio.BIOGEME (numberOfDraws, seed...).
+    """
+
+    def __init__(self, database, formulas, modelName=None, **kwargs):
+        import biogeme.biogeme as bio
+        self._bio = bio
+        self.database = database
+        self.formulas = formulas
+        # Text of the formulas, for modelKey (str, as the repr of the
+        # expressions of biogeme 3.1 is their address)
+        if isinstance(formulas, dict):
+            self.description = str({k: str(f) for k, f in formulas.items()})
+        else:
+            self.description = str(formulas)
+        self.modelName = modelName
+        self.kwargs = kwargs
+        self._objects = {}
+        self.numberOfThreads = 1
+        biogeme = self.biogeme()
+        self.names = list(biogeme.freeBetaNames)
+        self.start = np.array(biogeme.betaInitValues, dtype=float)
+        self.size = database.getSampleSize()
+        self.numberOfDraws = kwargs.get('numberOfDraws')
+
+    def biogeme(self):
+        """BIOGEME object with the current number of threads."""
+        n = self.numberOfThreads
+        if n not in self._objects:
+            self._objects[n] = self._bio.BIOGEME(
+                self.database, self.formulas, numberOfThreads=n,
+                **self.kwargs)
+        return self._objects[n]
+
+    def loglikelihood(self, x):
+        biogeme = self.biogeme()
+        try:
+            f, g = biogeme.calculateLikelihoodAndDerivatives(x)[:2]
+        except TypeError:
+            # biogeme 3.2: scaled argument
+            f, g = biogeme.calculateLikelihoodAndDerivatives(
+                x, scaled=False)[:2]
+        return f, np.asarray(g)
+
+
+def machineKey():
+    """Identification of the machine."""
+    return f'{platform.node()}-{platform.machine()}-{os.cpu_count()}'
+
+
+def modelKey(model):
+    """Hash of the model (its program, or its formulas for a
+    BiogemeLikelihood) and of the size of its data."""
+    h = hashlib.sha1()
+    family = getattr(model, 'family', None)
+    if family is not None:
+        if family.evaluator is None:
+            family.compile()
+        ev = family.evaluator
+        for op in ev.ops:
+            h.update(repr((op.kind, op.args, op.payload)).encode())
+        h.update(repr((model.slot, len(family.data), ev.numberOfDraws,
+                       ev.panel, family.chunkSize)).encode())
+    else:
+        h.update(repr((type(model).__name__,
+                       getattr(model, 'modelName', None),
+                       getattr(model, 'description', None), list(model.names),
+                       getattr(model, 'size', None),
+                       getattr(model, 'numberOfDraws', None),
+                       getattr(model, 'chunkSize', None))).encode())
+    return h.hexdigest()
+
+
+def availableProcessors():
+    """Processors this process may use, minus those busy with other
+    jobs (load average)."""
+    if hasattr(os, 'sched_getaffinity'):
+        processors = len(os.sched_getaffinity(0))
+    else:
+        processors = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        load = 0.0
+    return max(1, processors - int(round(load)))
+
+
+def scalingCurve(model, threadCounts=None, repetitions=3, x=None):
+    """Time of an evaluation of the log likelihood and its gradient
+    for each number of threads (the best of repetitions, after one
+    evaluation to prepare the chunks), around x.
+
+    threadCounts: default 1, 2, 4... up to the number of processors.
+    x: parameters (default: model.start).
+
+    Returns a data frame with the number of threads, the time, the
+    speedup and the efficiency (speedup per thread).
+    """
+    if threadCounts is None:
+        processors = os.cpu_count() or 1
+        threadCounts = sorted({2 ** k for k in range(
+            int(np.log2(processors)) + 1)} | {processors})
+    x = np.array(model.start if x is None else x, dtype=float)
+    previous = model.numberOfThreads
+    rows = []
+    try:
+        for n in threadCounts:
+            model.numberOfThreads = n
+            model.loglikelihood(x)
+            times = []
+            for k in range(repetitions):
+                # Slightly different parameters, so that a model keeping
+                # its last evaluation does not return it
+                y = x + 1e-8 * (k + 1)
+                start = time.perf_counter()
+                model.loglikelihood(y)
+                times.append(time.perf_counter() - start)
+            rows.append({'threads': int(n), 'time [s]': min(times)})
+    finally:
+        model.numberOfThreads = previous
+    curve = pd.DataFrame(rows)
+    base = curve['time [s]'].iloc[0] * curve['threads'].iloc[0]
+    curve['speedup'] = base / curve['time [s]']
+    curve['efficiency'] = curve['speedup'] / curve['threads']
+    return curve
+
+
+def _choose(curve, available, tolerance):
+    """Smallest number of threads, among those available, whose time is
+    within tolerance of the fastest."""
+    usable = curve[curve['threads'] <= available]
+    if usable.empty:
+        usable = curve[curve['threads'] == curve['threads'].min()]
+    best = usable['time [s]'].min()
+    good = usable[usable['time [s]'] <= best * (1 + tolerance)]
+    return int(good['threads'].min())
+
+
+def tuneThreads(model, threadCounts=None, repetitions=3,
+                cacheFile='threads.json', refresh=False, tolerance=0.05):
+    """Set model.numberOfThreads to the fastest number of threads.
+
+    cacheFile: JSON file of the measured curves (None: no cache).
+    refresh: measure again even if the curve is in the cache.
+    tolerance: a smaller number of threads is preferred if its time is
+    within this fraction of the fastest, leaving the processors to
+    other jobs.
+
+    Returns the number of threads and the scaling curve.
+    """
+    key = f'{machineKey()}/{modelKey(model)}'
+    cache = {}
+    if cacheFile is not None and os.path.exists(cacheFile):
+        with open(cacheFile) as f:
+            cache = json.load(f)
+    available = availableProcessors()
+    if key in cache and not refresh:
+        curve = pd.DataFrame(cache[key]['curve'])
+    else:
+        curve = scalingCurve(model, threadCounts, repetitions)
+        if cacheFile is not None:
+            cache[key] = {'model': getattr(model, 'modelName', None),
+                          'measured': time.strftime('%Y-%m-%d %H:%M:%S'),
+                          'available processors': available,
+                          'curve': curve.to_dict(orient='records')}
+            tmp = f'{cacheFile}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(cache, f, indent=1)
+            os.replace(tmp, cacheFile)
+    numberOfThreads = _choose(curve, available, tolerance)
+    model.numberOfThreads = numberOfThreads
+    return numberOfThreads, curve
@@ -0,0 +1,167 @@
+########################################
+#
+# @file wtp.py
+#
+# Willingness to pay, such as the value of time B_TIME / B_COST, and
+# its distribution.
+#
+# A ratio is given by a numerator and a denominator, each a parameter
+# name or a linear combination of parameters {name: coefficient}, so
+# that segment specific values (e.g. (B_TIME + B_TIME_GA) / B_COST)
+# and changes of units (e.g. {'B_TIME': 60} for a value per hour with
+# times in minutes) are covered. With the numerators A beta and the
+# denominators B beta of all the ratios stacked as matrices:
+#
+# - delta method: the gradients of all the ratios form one matrix
+#   G = A / (B beta) - (A beta) B / (B beta)^2, and their covariance
+#   is G Sigma G',
+# - Krinsky and Robb: parameters are drawn from N(beta, Sigma) and all
+#   the ratios are computed for all the draws with two matrix
+#   products.
+#
+# Ratios of random coefficients (e.g. in 17lognormalMixture.py) are
+# simulated with the draws stored by bio.BIOGEME in the database, those
+# of the estimation if BIOGEME was given its seed.
+#
+#######################################
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from evaluator import Evaluator
+
+
+def _estimates(results, robust):
+    """Names, values and covariance matrix of the estimated parameters.
+    results may be biogeme results or EstimationResults."""
+    d = results.data
+    names = list(d.betaNames)
+    values = np.asarray(d.betaValues, dtype=float)
+    cov = d.robust_varCovar if robust and \
+        getattr(d, 'robust_varCovar', None) is not None else d.varCovar
+    return names, values, np.asarray(cov, dtype=float)
+
+
+def ratioMatrices(ratios, names):
+    """Matrices of the numerators and denominators (ratios x
+    parameters). Parameters that are not in names (fixed) are not
+    allowed."""
+    A = np.zeros((len(ratios), len(names)))
+    B = np.zeros((len(ratios), len(names)))
+    for r, (num, den) in enumerate(ratios.values()):
+        for M, combination in ((A, num), (B, den)):
+            if isinstance(combination, str):
+                combination = {combination: 1.0}
+            for name, coefficient in combination.items():
+                if name not in names:
+                    raise ValueError(f"Unknown parameter {name}")
+                M[r, names.index(name)] += coefficient
+    return A, B
+
+
+def deltaMethod(results, ratios, robust=True, level=0.95):
+    """Value, standard error and confidence interval of each ratio.
+
+    ratios: dict associating a name with a tuple (numerator,
+    denominator).
+    robust: use the robust covariance matrix, if available.
+    """
+    names, beta, cov = _estimates(results, robust)
+    A, B = ratioMatrices(ratios, names)
+    num = A @ beta
+    den = B @ beta
+    value = num / den
+    G = A / den[:, None] - (num / den ** 2)[:, None] * B
+    stdErr = np.sqrt(np.maximum(np.einsum('rk,kl,rl->r', G, cov, G), 0))
+    z = stats.norm.ppf(0.5 + level / 2)
+    return pd.DataFrame({'Value': value,
+                         'Std err': stdErr,
+                         'Lower': value - z * stdErr,
+                         'Upper': value + z * stdErr},
+                        index=list(ratios.keys()))
+
+
+def krinskyRobb(results, ratios, numberOfDraws=10000, seed=None,
+                robust=True, level=0.95):
+    """Distribution of each ratio obtained by drawing the parameters
+    from their asymptotic distribution (Krinsky and Robb, 1986).
+
+    Returns the summary table, and the array of the simulated ratios
+    (draws x ratios).
+    """
+    names, beta, cov = _estimates(results, robust)
+    A, B = ratioMatrices(ratios, names)
+    rng = np.random.default_rng(seed)
+    draws = rng.multivariate_normal(beta, cov, size=numberOfDraws,
+                                    method='eigh')
+    simulated = (draws @ A.T) / (draws @ B.T)
+    alpha = (1 - level) / 2
+    lower, median, upper = np.quantile(simulated, [alpha, 0.5, 1 - alpha],
+                                       axis=0)
+    table = pd.DataFrame({'Mean': np.mean(simulated, axis=0),
+                          'Median': median,
+                          'Std': np.std(simulated, axis=0),
+                          'Lower': lower,
+                          'Upper': upper},
+                         index=list(ratios.keys()))
+    return table, simulated
+
+
+def randomRatios(ratios, data, betaValues, panel=None, segment=None,
+                 quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), drawNames=None,
+                 **kwargs):
+    """Distribution of ratios involving random coefficients, over the
+    draws and the individuals.
+
+    ratios: dict associating a name with an expression, such as
+    B_TIME_RND / B_COST.
+    data: the biogeme database of the estimation, after bio.BIOGEME
+    has generated its draws, or a data frame (the draws are then
+    generated by the Evaluator).
+    betaValues: estimated values, e.g. results.getBetaValues().
+    panel: column identifying individuals. The draws are then per
+    individual, and the first row of each individual is used. By
+    default, the panel column of the database.
+    segment: column of data. If given, the distribution is reported
+    for each of its values.
+    drawNames: the draw variables of database.theDraws (see
+    Evaluator.useDatabaseDraws).
+    kwargs: numberOfDraws, seed, drawGenerators, definitions, passed
+    to the Evaluator.
+
+    Returns a data frame with the mean, standard deviation and
+    quantiles of each ratio (and segment).
+    """
+    database = None
+    if hasattr(data, 'panelColumn'):
+        database, data = data, data.data
+        if panel is None:
+            panel = database.panelColumn
+    evaluator = Evaluator(ratios, panel=panel, **kwargs)
+    if database is not None and evaluator.drawTypes:
+        evaluator.useDatabaseDraws(database, drawNames)
+    values = evaluator.evaluate(data, betaValues)
+    n = len(data)
+    rows = np.arange(n) if panel is None else evaluator.panelOffsets(data)
+    if segment is None:
+        segments = np.zeros(len(rows))
+    else:
+        segments = np.asarray(data[segment])[rows]
+    table = []
+    for name in ratios:
+        v = np.asarray(values[name])
+        if v.ndim == 1:
+            v = v[:, None]
+        if v.shape[0] != len(rows):
+            v = v[rows]
+        for s in np.unique(segments):
+            x = v[segments == s].ravel()
+            entry = {'ratio': name, 'Mean': np.mean(x), 'Std': np.std(x)}
+            if segment is not None:
+                entry[segment] = s
+            for q, value in zip(quantiles, np.quantile(x, quantiles)):
+                entry[f'{q:g}'] = value
+            table.append(entry)
+    index = ['ratio'] if segment is None else ['ratio', segment]
+    return pd.DataFrame(table).set_index(index)